@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+run_benchmarks.py
+
+Reproducible throughput benchmarks for the GEMspa pipeline on synthetic
+data with known D and alpha (gemspa.synthetic).
+
+For each dataset size the main stages are timed in isolation, each in a
+fresh process so peak RSS is per stage:
+    load, load_cached, msd_fit, step_sizes, rainbow, run_ensemble,
+    compare_conditions
+plus an end-to-end GEMspa-CLI.py run. Results (tracks/s, points/s, wall
+and CPU time, peak RSS, fitted-vs-true D/alpha) go to one JSON file so
+runs on different commits or machines can be compared. Cold import times
+of the package and each stage module are recorded alongside.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000 -o bench.json
+"""
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import datetime
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+
+CONDITIONS = {'ctrl': (0.2, 1.0), 'slow': (0.05, 0.7)}
+TIME_STEP = 0.010
+MICRON_PER_PX = 0.11
+ALL_STAGES = ('load', 'load_cached', 'msd_fit', 'step_sizes', 'rainbow',
+              'run_ensemble', 'compare_conditions', 'end_to_end')
+SCHEMA_VERSION = 1
+
+
+# ---- stage bodies (run inside a fresh spawned process) ----
+
+def _new_analysis(src, results_dir, use_cache=False, rainbow=False):
+    from gemspa.trajectory_analysis import trajectory_analysis
+    return trajectory_analysis(
+        src['path'], results_dir=results_dir, condition=src['condition'], time_step=TIME_STEP,
+        micron_per_px=MICRON_PER_PX, make_rainbow_tracks=rainbow,
+        threads_per_rep=None, use_cache=use_cache, log_file='bench.log',
+        plot_mode='deferred'
+    )
+
+
+def _stage_child(stage, src, scratch):
+    """Run one stage on dataset file `src` after its setup; return the timing record."""
+    import numpy as np
+    from gemspa.timing import stage_timer, peak_rss_mb
+
+    timer = stage_timer()
+    rec = {}
+    if stage == 'load':
+        with timer.stage(stage) as st:
+            ta = _new_analysis(src, scratch)
+            st.update(points=len(ta.raw_df), tracks=int(ta.raw_df['track_id'].nunique()))
+    elif stage == 'load_cached':
+        _new_analysis(src, scratch, use_cache=True)   # prime the cache
+        with timer.stage(stage) as st:
+            ta = _new_analysis(src, scratch, use_cache=True)
+            st.update(points=len(ta.raw_df), tracks=int(ta.raw_df['track_id'].nunique()))
+    elif stage == 'msd_fit':
+        from gemspa.msd_diffusion import warmup_kernels
+        ta = _new_analysis(src, scratch)
+        warmup_kernels()
+        with timer.stage(stage) as st:
+            ids, msd = ta._track_msd_matrix()
+            D, alpha, r2 = ta.msd_processor.fit_msd_batch(
+                msd[:, :ta.tlag_cutoff_linfit], TIME_STEP, mode=ta.fit_mode,
+                n_jobs=ta.threads_per_rep
+            )
+            st.update(points=len(ta.raw_df), tracks=len(ids))
+        rec.update(D_median=float(np.nanmedian(D)), alpha_median=float(np.nanmedian(alpha)),
+                   D_true=src['D'], alpha_true=src['alpha'])
+        rec['D_rel_err'] = abs(rec['D_median'] - src['D']) / src['D']
+        rec['alpha_abs_err'] = abs(rec['alpha_median'] - src['alpha'])
+    elif stage == 'step_sizes':
+        ta = _new_analysis(src, scratch)
+        with timer.stage(stage) as st:
+            ta.export_step_sizes()
+            st.update(points=len(ta.raw_df), steps=ta.timer.records[-1]['steps'])
+    elif stage == 'rainbow':
+        # the overlay is timed by the pipeline's own rainbow_tracks stage
+        ta = _new_analysis(src, scratch, rainbow=True)
+        ta.calculate_msd_and_diffusion()
+        drawn = [r for r in ta.timer.records if r['stage'] == 'rainbow_tracks']
+        if not drawn:
+            raise RuntimeError(f"no rainbow overlay drawn for {src['path']}")
+        timer.records.append(dict(drawn[-1], stage=stage, points=len(ta.raw_df)))
+    elif stage in ('run_ensemble', 'compare_conditions'):
+        from gemspa.ensemble_analysis import run_ensemble
+        from gemspa.compare_conditions import compare_conditions
+        filters = dict(filter_D_min=0.001, filter_D_max=2.0,
+                       filter_alpha_min=0.0, filter_alpha_max=2.0)
+        if stage == 'compare_conditions':
+            run_ensemble(scratch, **filters)
+        fn = run_ensemble if stage == 'run_ensemble' else compare_conditions
+        with timer.stage(stage) as st:
+            fn(scratch, **filters)
+            st['tracks'] = sum(
+                sum(1 for _ in open(p)) - 1
+                for p in glob.glob(os.path.join(scratch, '*_[0-9]*', 'msd_results.csv'))
+            )
+    else:
+        raise ValueError(f"unknown stage {stage!r}")
+
+    rec.update(timer.records[-1])
+    rec['peak_rss_mb'] = peak_rss_mb()
+    return rec
+
+
+def run_stage(stage, src, scratch):
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as ex:
+        return ex.submit(_stage_child, stage, src, scratch).result()
+
+
+def run_end_to_end(data_dir, extra_args):
+    """
+    Full CLI run on a copy of the dataset, interpreter start-up included.
+    CPU time and peak RSS cover the CLI and its worker processes.
+    """
+    import resource
+    cmd = [sys.executable, os.path.join(REPO, 'bin', 'GEMspa-CLI.py'),
+           '-d', data_dir, '--force', *extra_args]
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    ru0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall0 = time.perf_counter()
+    subprocess.run(cmd, check=True, env=env, stdout=subprocess.DEVNULL)
+    wall = time.perf_counter() - wall0
+    ru1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with open(os.path.join(data_dir, 'timings.json')) as fh:
+        run = json.load(fh)
+    return {
+        'stage': 'end_to_end',
+        'wall_s': wall,
+        'cpu_s': (ru1.ru_utime + ru1.ru_stime) - (ru0.ru_utime + ru0.ru_stime),
+        'peak_rss_mb': ru1.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10),
+        'replicate_stage_totals': run.get('replicate_stage_totals'),
+    }
+
+
+# ---- driver ----
+
+def _dataset(root, n_tracks, replicates, seed):
+    """Generate (or reuse) a dataset of n_tracks per replicate."""
+    from gemspa.synthetic import write_synthetic_dataset
+    data_dir = os.path.join(root, f'n{n_tracks}')
+    marker = os.path.join(data_dir, 'dataset.json')
+    key = {'tracks': n_tracks, 'replicates': replicates, 'seed': seed,
+           'conditions': CONDITIONS}
+    if os.path.exists(marker):
+        with open(marker) as fh:
+            saved = json.load(fh)
+        if saved.get('key') == json.loads(json.dumps(key)):
+            return data_dir, saved['files']
+        shutil.rmtree(data_dir)
+    files = write_synthetic_dataset(
+        data_dir, CONDITIONS, n_tracks, replicates=replicates, seed=seed,
+        write_images=True, time_step=TIME_STEP, micron_per_px=MICRON_PER_PX
+    )
+    with open(marker, 'w') as fh:
+        json.dump({'key': key, 'files': files}, fh, indent=1)
+    return data_dir, files
+
+
+def _machine():
+    info = {'python': platform.python_version(), 'platform': platform.platform(),
+            'cores': os.cpu_count()}
+    for mod in ('numpy', 'pandas', 'numba', 'scipy'):
+        try:
+            info[mod] = __import__(mod).__version__
+        except ImportError:
+            info[mod] = None
+    try:
+        info['git_commit'] = subprocess.check_output(
+            ['git', '-C', REPO, 'rev-parse', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        info['git_commit'] = None
+    return info
+
+
+def main():
+    p = argparse.ArgumentParser(description="GEMspa pipeline benchmarks on synthetic data")
+    p.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                   help="Tracks per replicate file (e.g. 1000 10000 100000 1000000)")
+    p.add_argument('--replicates', type=int, default=2, help="Replicates per condition")
+    p.add_argument('--stages', nargs='+', choices=ALL_STAGES, default=list(ALL_STAGES))
+    p.add_argument('--work-dir', default=os.path.join(HERE, '_data'),
+                   help="Where synthetic datasets are generated and reused")
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('-o', '--output', default='bench_results.json')
+    args = p.parse_args()
+    from gemspa.timing import import_report
+
+    results = []
+    for n in args.sizes:
+        data_dir, files = _dataset(args.work_dir, n, args.replicates, args.seed)
+        scratch = os.path.join(args.work_dir, f'scratch_n{n}')
+        shutil.rmtree(scratch, ignore_errors=True)
+        os.makedirs(scratch)
+
+        if {'end_to_end', 'run_ensemble', 'compare_conditions'} & set(args.stages):
+            run_dir = os.path.join(args.work_dir, f'run_n{n}')
+            shutil.rmtree(run_dir, ignore_errors=True)
+            shutil.copytree(data_dir, run_dir)
+            rec = run_end_to_end(run_dir, ['--no-cache', '--step-size-analysis', '--rainbow-tracks'])
+            rec.update(points=sum(f['rows'] for f in files), tracks=n * len(files))
+            if 'end_to_end' in args.stages:
+                results.append({'size': n, **rec})
+
+        for stage in args.stages:
+            if stage == 'end_to_end':
+                continue
+            target = run_dir if stage in ('run_ensemble', 'compare_conditions') else scratch
+            rec = run_stage(stage, files[0], target)
+            results.append({'size': n, **rec})
+            print(f"[bench] n={n:>8} {stage:<18} {rec['wall_s']:8.3f}s "
+                  f"peak {rec['peak_rss_mb'] or 0:8.1f} MB")
+
+    for rec in results:
+        if rec.get('wall_s'):
+            for item in ('tracks', 'points', 'steps'):
+                if rec.get(item):
+                    rec[f'{item}_per_s'] = rec[item] / rec['wall_s']
+
+    out = {
+        'schema': SCHEMA_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': _machine(),
+        'config': {'sizes': args.sizes, 'replicates': args.replicates,
+                   'conditions': CONDITIONS, 'seed': args.seed,
+                   'time_step': TIME_STEP, 'micron_per_px': MICRON_PER_PX},
+        'imports': import_report(),
+        'results': results,
+    }
+    with open(args.output, 'w') as fh:
+        json.dump(out, fh, indent=1)
+    print(f"[bench] wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,262 +1,548 @@
 #!/usr/bin/env python3
-# gemspa/trajectory_analysis.py
+# bin/GEMspa-CLI.py
 
 import os
 import re
 import glob
-import datetime
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-from scipy import ndimage
-from tifffile import imread
-from joblib import Parallel, delayed, parallel_backend
-import numba
-from numba import njit, prange
-from multiprocessing import cpu_count
-
-from .msd_diffusion import msd_diffusion
-from .rainbow_tracks import draw_rainbow_tracks
-
-class trajectory_analysis:
+import json
+import shutil
+import argparse
+import importlib.util
+
+# stdlib-only modules; stage modules (numba, scipy, matplotlib, seaborn,
+# skimage, joblib) are imported inside the functions that run those stages
+from gemspa.resources import plan_resources, export_thread_env
+from gemspa.timing import stage_timer, rollup, profiled, import_report
+from gemspa.run_manifest import (
+    run_manifest, params_key, MANIFEST_NAME, RUN_MANIFEST_NAME
+)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        description="GEMspa single-particle tracking analysis over a folder of Traj_*.csv files."
+    )
+    p.add_argument('-d', '--work-dir', required=True,
+                   help="Folder containing Traj_*.csv files")
+
+    # parallelism
+    p.add_argument('-j', '--n-jobs', type=int, default=None,
+                   help="Parallel processes across replicates (default: CPU cores, "
+                        "capped at the number of replicates)")
+    p.add_argument('--threads-per-rep', type=int, default=None,
+                   help="Threads per replicate for Numba/BLAS/joblib "
+                        "(default and cap: cores / n_jobs)")
+
+    # instrumentation
+    p.add_argument('--profile', action='store_true',
+                   help="Capture cProfile output per replicate (profile.prof/.txt) and for the run")
+    p.add_argument('--import-times', action='store_true',
+                   help="Measure cold import time of the package and each stage, write "
+                        "import_times.json to the work dir and exit")
+
+    # plot rendering
+    plots = p.add_mutually_exclusive_group()
+    plots.add_argument('--no-plots', action='store_true',
+                       help="Compute and save results only; spool plot jobs for a later --plots-only run")
+    plots.add_argument('--plots-only', action='store_true',
+                       help="Skip analysis; render spooled plot jobs and comparison figures "
+                            "from saved results")
+    plots.add_argument('--filter-sweep', action='store_true',
+                       help="Skip analysis; tabulate counts, medians, histograms and KS tests "
+                            "for every combination of the --sweep-* bounds from saved results")
+
+    # incremental runs
+    p.add_argument('--force', action='store_true',
+                   help="Rerun every replicate and stage even if the manifest says it is up to date")
+
+    # trajectory cache
+    p.add_argument('--no-cache', action='store_true',
+                   help="Always parse the CSVs; do not read or write the binary trajectory cache")
+    p.add_argument('--clear-cache', action='store_true',
+                   help="Delete existing trajectory and rainbow base-image caches before processing")
+
+    # streaming
+    p.add_argument('--stream', action='store_true',
+                   help="Read each CSV in chunks and analyse tracks incrementally (bounded memory)")
+    p.add_argument('--memory-budget-mb', type=int, default=1024,
+                   help="Per-replicate memory budget for --stream (default: 1024)")
+
+    # core SPT / MSD fit parameters
+    p.add_argument('--time-step', type=float, default=0.010,
+                   help="Frame interval in seconds")
+    p.add_argument('--micron-per-px', type=float, default=0.11,
+                   help="Pixel size in um/px")
+    p.add_argument('--ts-resolution', type=float, default=0.005,
+                   help="Time resolution used for plots/labels")
+    p.add_argument('--min-track-len', type=int, default=11,
+                   help="Minimum frames per track to fit")
+    p.add_argument('--tlag-cutoff', type=int, default=10,
+                   help="Max lag for MSD fitting")
+    p.add_argument('--fit-mode', choices=['fast', 'scipy-exact'], default='fast',
+                   help="Batch compiled MSD fits, or per-track scipy curve_fit")
+    p.add_argument('--max-msd-lag', type=int, default=None,
+                   help="Compute full MSD curves up to this lag and save msd_curves.npz "
+                        "(FFT path for long lags; fits still use --tlag-cutoff)")
+
+    # rainbow tracks
+    p.add_argument('--rainbow-tracks', action='store_true',
+                   help="Draw diffusion-coloured track overlays")
+    p.add_argument('--img-prefix', default='MAX_',
+                   help="Image filename prefix")
+    p.add_argument('--rainbow-min-D', type=float, default=0.0)
+    p.add_argument('--rainbow-max-D', type=float, default=2.0)
+    p.add_argument('--rainbow-colormap', default='viridis')
+    p.add_argument('--rainbow-scale', type=float, default=1.0)
+    p.add_argument('--rainbow-dpi', type=int, default=200)
+    p.add_argument('--rainbow-color-by', choices=['track', 'local'], default='track',
+                   help="Colour whole tracks by D_fit, or each segment by its sliding-window "
+                        "D_local (see --local-window)")
+    p.add_argument('--rainbow-line-px', type=int, default=1,
+                   help="Track line width in image pixels (default: 1)")
+    p.add_argument('--rainbow-antialias', action='store_true',
+                   help="Anti-aliased track lines (default: exact 1-px Bresenham lines)")
+    p.add_argument('--rainbow-tiled', action='store_true',
+                   help="Write the overlay tile by tile from the memory-mapped TIFF instead of "
+                        "through a matplotlib figure (memory bounded by tile size)")
+    p.add_argument('--rainbow-format', choices=['png', 'tiff'], default='png',
+                   help="Tiled output: streamed PNG or tiled pyramidal TIFF (default: png)")
+    p.add_argument('--rainbow-tile-size', type=int, default=1024,
+                   help="Output tile edge in pixels for --rainbow-tiled (default: 1024)")
+    p.add_argument('--rainbow-movie', choices=['gif', 'mp4', 'tiff'], default=None,
+                   help="Also write rainbow_movie.<ext>: tracks growing frame by frame "
+                        "(gif needs Pillow>=9.1, mp4 imageio-ffmpeg; see the movie/mp4 extras)")
+    p.add_argument('--rainbow-movie-fps', type=float, default=10,
+                   help="Movie frame rate (default: 10)")
+    p.add_argument('--rainbow-trail', type=int, default=0,
+                   help="Fade segments out over this many frames; 0 keeps whole tracks (default: 0)")
+
+    # ensemble filtering
+    p.add_argument('--filter-D-min', type=float, default=0.001)
+    p.add_argument('--filter-D-max', type=float, default=2.0)
+    p.add_argument('--filter-alpha-min', type=float, default=0.0)
+    p.add_argument('--filter-alpha-max', type=float, default=2.0)
+    p.add_argument('--no-grouped-csv', dest='export_grouped_csv', action='store_false',
+                   help="Skip the grouped_raw/ and grouped_filtered/msd_results.csv exports "
+                        "(the ensembles stay queries on results.store)")
+    p.add_argument('--sweep-D-min', type=float, nargs='+', default=None,
+                   help="--filter-sweep values of the D lower bound (default: --filter-D-min)")
+    p.add_argument('--sweep-D-max', type=float, nargs='+', default=None,
+                   help="--filter-sweep values of the D upper bound (default: --filter-D-max)")
+    p.add_argument('--sweep-alpha-min', type=float, nargs='+', default=None,
+                   help="--filter-sweep values of the alpha lower bound "
+                        "(default: --filter-alpha-min)")
+    p.add_argument('--sweep-alpha-max', type=float, nargs='+', default=None,
+                   help="--filter-sweep values of the alpha upper bound "
+                        "(default: --filter-alpha-max)")
+    p.add_argument('--bootstrap', type=int, default=10000,
+                   help="Hierarchical bootstrap resamples for condition CIs in the comparison "
+                        "(0 disables; default: 10000)")
+    p.add_argument('--bootstrap-seed', type=int, default=0,
+                   help="Seed of the bootstrap resampling (default: 0)")
+    p.add_argument('--binned-comparison', action='store_true',
+                   help="Draw comparison histograms and KS p-values from the per-replicate "
+                        "grid summaries (approximate) instead of the per-track rows")
+
+    # step sizes
+    p.add_argument('--step-size-analysis', action='store_true',
+                   help="Export step sizes and run KDE/KS step-size analysis")
+    p.add_argument('--legacy-step-tsv', action='store_true',
+                   help="Also write the old wide all_data_step_sizes.txt table")
+    p.add_argument('--turning-angle-analysis', action='store_true',
+                   help="Export turning angles; per-lag angle histograms, mean cos θ and "
+                        "displacement autocorrelation per replicate and pooled per condition")
+    p.add_argument('--angle-bins', type=int, default=18,
+                   help="Turning-angle histogram bins over 0-180 degrees (default: 18)")
+    p.add_argument('--autocorr-max-tau', type=int, default=10,
+                   help="Largest frame offset of the displacement autocorrelation (default: 10)")
+    p.add_argument('--local-diffusivity', action='store_true',
+                   help="Fit D/alpha in a sliding window along each track; per-window "
+                        "local_D.store and per-track local_D_summary.csv")
+    p.add_argument('--local-window', type=int, default=10,
+                   help="Points per sliding window (default: 10)")
+    p.add_argument('--local-max-lag', type=int, default=3,
+                   help="Lags fitted in each window, < --local-window (default: 3)")
+    args = p.parse_args()
+    if args.rainbow_movie and not args.rainbow_tracks:
+        p.error("--rainbow-movie needs --rainbow-tracks")
+    if args.rainbow_movie == 'mp4' and importlib.util.find_spec('imageio_ffmpeg') is None:
+        p.error("--rainbow-movie mp4 needs imageio-ffmpeg (pip install 'gemspa_cli[mp4]')")
+    if not 2 <= args.local_max_lag < args.local_window:
+        p.error("--local-max-lag must be at least 2 and below --local-window")
+    return args
+
+
+def replicate_name(csv_path):
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    return base[len('Traj_'):] if base.startswith('Traj_') else base
+
+
+def process_replicate(csv_path, args):
     """
-    MSD, diffusion, rainbow overlay, and step-size export for single-particle tracking.
+    Run the per-replicate stages that are out of date according to the
+    replicate's manifest. Returns (replicate, msd stage key, status, timings).
     """
+    if args.profile:
+        prof = os.path.join(args.work_dir, replicate_name(csv_path), 'profile.prof')
+        os.makedirs(os.path.dirname(prof), exist_ok=True)
+        with profiled(prof):
+            return _process_replicate(csv_path, args)
+    return _process_replicate(csv_path, args)
 
-    def __init__(
-        self,
-        data_file,
-        results_dir='.',
-        condition=None,
-        time_step=0.010,
-        micron_per_px=0.11,
-        ts_resolution=0.005,
-        min_track_len_linfit=11,
-        tlag_cutoff_linfit=10,
-        make_rainbow_tracks=False,
-        img_file_prefix='MAX_',
-        rainbow_min_D=0.0,
-        rainbow_max_D=2.0,
-        rainbow_colormap='viridis',
-        rainbow_scale=1.0,
-        rainbow_dpi=200,
-        n_jobs=1,
-        threads_per_rep=None,
-        log_file=None
-    ):
-        # decide processes & threads per replicate
-        self.n_jobs = n_jobs
-        if threads_per_rep is None:
-            self.threads_per_rep = max(1, cpu_count() // max(1, self.n_jobs))
-        else:
-            self.threads_per_rep = threads_per_rep
-
-        # core parameters
-        self.data_file            = data_file
-        self.results_dir          = results_dir
-        base = os.path.splitext(os.path.basename(self.data_file))[0]
-        self.condition            = condition or re.sub(r'_[0-9]+$', '', base)
-        self.time_step            = time_step
-        self.micron_per_px        = micron_per_px
-        self.ts_resolution        = ts_resolution
-        self.min_track_len_linfit = min_track_len_linfit
-        self.tlag_cutoff_linfit   = tlag_cutoff_linfit
-        self.make_rainbow_tracks  = make_rainbow_tracks
-        self.img_prefix           = img_file_prefix
-        self.rainbow_min_D        = rainbow_min_D
-        self.rainbow_max_D        = rainbow_max_D
-        self.rainbow_colormap     = rainbow_colormap
-        self.rainbow_scale        = rainbow_scale
-        self.rainbow_dpi          = rainbow_dpi
-        self.rainbow_line_width   = 0.1
-
-        # prepare output & logging
-        os.makedirs(self.results_dir, exist_ok=True)
-        ts = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        logn = log_file or f"{base}_{ts}.log"
-        self.log = open(os.path.join(self.results_dir, logn), 'w')
-
-        # ---- load & sanitize input CSV (now TrackMate-friendly) ----
-        # Use pandas' sep=None to auto-detect delimiter (comma/tab)
-        df = pd.read_csv(data_file, sep=None, engine='python')
-        # Normalize headers
-        df.columns = [c.strip().lower() for c in df.columns]
-
-        # Common alias mappings:
-        # - TrackMate "Spots in tracks" CSV typically has: track_id, frame, position_x, position_y
-        alias_map = {}
-        if 'trajectory' in df.columns:  # legacy alias
-            alias_map['trajectory'] = 'track_id'
-        if 'position_x' in df.columns and 'x' not in df.columns:
-            alias_map['position_x'] = 'x'
-        if 'position_y' in df.columns and 'y' not in df.columns:
-            alias_map['position_y'] = 'y'
-        if 'spot_frame' in df.columns and 'frame' not in df.columns:
-            alias_map['spot_frame'] = 'frame'
-        # Apply if any
-        if alias_map:
-            df = df.rename(columns=alias_map)
-
-        # Validate required columns
-        for req in ('track_id', 'frame', 'x', 'y'):
-            if req not in df.columns:
-                raise KeyError(
-                    f"Input CSV missing required column '{req}'. "
-                    f"Found columns: {list(df.columns)}"
-                )
-
-        self.raw_df = df
-        self.raw_df['condition'] = self.condition
-
-        # MSD / diffusion helper
-        self.msd_processor = msd_diffusion(save_dir=self.results_dir)
-
-    @staticmethod
-    @njit(parallel=True)
-    def _compute_msd(coords, max_lag):
-        n = coords.shape[0]
-        out = np.zeros(max_lag)
-        for lag in prange(1, max_lag+1):
-            d = coords[lag:] - coords[:n-lag]
-            out[lag-1] = np.mean(d[:,0]**2 + d[:,1]**2) if d.size else 0.0
-        return out
-
-    def _one_track(self, grp):
-        coords = grp[['x','y']].to_numpy() * self.micron_per_px
-        max_lag = min(self.tlag_cutoff_linfit, coords.shape[0]-1)
-        msd_v = self._compute_msd(coords, max_lag)
-        return self.msd_processor.fit_msd(msd_v, self.time_step)
-
-    def calculate_msd_and_diffusion(self):
-        """
-        Parallel per-track MSD→D/alpha, save results & plots, and optional rainbow overlay.
-        """
-        tracks = [
-            grp for _, grp in self.raw_df.groupby('track_id')
-            if len(grp) >= self.min_track_len_linfit
-        ]
-
-        # per-track fits using threads_per_rep threads
-        with parallel_backend('threading'):
-            results = Parallel(n_jobs=self.threads_per_rep)(
-                delayed(self._one_track)(grp) for grp in tracks
-            )
 
-        # assemble results
-        ids, D_vals, alpha_vals, r2_vals = zip(
-            *[(grp['track_id'].iloc[0], *res)
-              for grp, res in zip(tracks, results)]
-        )
-        self.results_df = pd.DataFrame({
-            'track_id':  ids,
-            'condition': self.condition,
-            'D_fit':     D_vals,
-            'alpha_fit': alpha_vals,
-            'r2_fit':    r2_vals
-        })
-
-        # save + plots
-        self.results_df.to_csv(
-            os.path.join(self.results_dir, 'msd_results.csv'), index=False
-        )
-        self.make_plot()
-        self.make_scatter()
-
-        # rainbow overlay
-        if self.make_rainbow_tracks:
-            base = os.path.splitext(os.path.basename(self.data_file))[0]
-            rep  = base.replace('Traj_', '') if base.startswith('Traj_') else base
-            cond = self.condition
-            rep_num = rep.rsplit('_',1)[-1]
-            patterns = [
-                f"{self.img_prefix}{cond}_{rep_num}.tif",
-                f"{self.img_prefix}{cond}.tif",
-                f"{self.img_prefix}{cond}*.tif",
-            ]
-            matches = []
-            for pat in patterns:
-                matches += glob.glob(os.path.join(os.path.dirname(self.data_file), pat))
-            matches = sorted(set(matches))
-            if not matches:
-                self.log.write(f"WARNING: no TIFF matching any of {patterns}\n")
-                return
-
-            img_path = matches[0]
-            draw_rainbow_tracks(
-                image_path=img_path,
-                raw_df=self.raw_df,
-                results_df=self.results_df,
-                output_path=os.path.join(self.results_dir, 'rainbow_tracks.png'),
-                min_D=self.rainbow_min_D,
-                max_D=self.rainbow_max_D,
-                colormap=self.rainbow_colormap,
-                scale=self.rainbow_scale,
-                dpi=self.rainbow_dpi,
-                line_width=self.rainbow_line_width
+def _process_replicate(csv_path, args):
+    from gemspa.trajectory_analysis import trajectory_analysis, analysis_params
+    from gemspa.plot_queue import PLOT_JOBS_NAME
+    from gemspa.step_store import STEP_STORE_NAME
+    from gemspa.angle_analysis import ANGLE_STORE_NAME, ANGLE_DIR_NAME, ANGLE_STATS_NAME
+    from gemspa.ensemble_msd import ENSEMBLE_MSD_DIR
+    from gemspa.local_diffusivity import LOCAL_STORE_NAME, LOCAL_SUMMARY_NAME
+    from gemspa.rainbow_tiles import RAINBOW_CACHE_DIR
+    from gemspa.results_store import RESULTS_STORE_NAME
+    rep = replicate_name(csv_path)
+    cond = re.sub(r'_[0-9]+$', '', rep)
+    results_dir = os.path.join(args.work_dir, rep)
+
+    manifest = run_manifest(os.path.join(results_dir, MANIFEST_NAME))
+    digest = manifest.input_digest(csv_path)
+    params = analysis_params(
+        cond, args.time_step, args.micron_per_px, args.min_track_len,
+        args.tlag_cutoff, args.fit_mode, args.max_msd_lag
+    )
+    rainbow = dict(
+        enabled=args.rainbow_tracks, img_prefix=args.img_prefix,
+        min_D=args.rainbow_min_D, max_D=args.rainbow_max_D,
+        colormap=args.rainbow_colormap, scale=args.rainbow_scale, dpi=args.rainbow_dpi,
+        color_by=args.rainbow_color_by, line_px=args.rainbow_line_px,
+        antialias=args.rainbow_antialias, tiled=args.rainbow_tiled,
+        format=args.rainbow_format if args.rainbow_tiled else 'png',
+        tile_size=args.rainbow_tile_size if args.rainbow_tiled else None,
+        movie=args.rainbow_movie, movie_fps=args.rainbow_movie_fps, trail=args.rainbow_trail,
+    ) if args.rainbow_tracks else None
+    if rainbow and args.rainbow_color_by == 'local':
+        rainbow.update(local_window=args.local_window, local_max_lag=args.local_max_lag)
+    msd_key = params_key(digest, params, rainbow)
+    msd_outputs = ['msd_results.csv', 'msd_vs_tau.csv', PLOT_JOBS_NAME,
+                   os.path.join(ENSEMBLE_MSD_DIR, 'stats.npz'),
+                   os.path.join(os.pardir, RESULTS_STORE_NAME, rep, 'meta.json')]
+    step_key = params_key(digest, cond, args.micron_per_px, args.legacy_step_tsv)
+    step_outputs = [STEP_STORE_NAME] + (['all_data_step_sizes.txt'] if args.legacy_step_tsv else [])
+    angle_key = params_key(digest, cond, args.micron_per_px, args.angle_bins, args.autocorr_max_tau)
+    angle_outputs = [ANGLE_STORE_NAME, os.path.join(ANGLE_DIR_NAME, ANGLE_STATS_NAME)]
+    local_key = params_key(digest, cond, args.micron_per_px, args.time_step,
+                           args.local_window, args.local_max_lag)
+    local_outputs = [LOCAL_STORE_NAME, LOCAL_SUMMARY_NAME]
+
+    run_msd = args.force or not manifest.is_current('msd', msd_key)
+    run_steps = args.step_size_analysis and (
+        args.force or not manifest.is_current('step_sizes', step_key)
+    )
+    run_angles = args.turning_angle_analysis and (
+        args.force or not manifest.is_current('turning_angles', angle_key)
+    )
+    run_local = args.local_diffusivity and (
+        args.force or not manifest.is_current('local_diffusivity', local_key)
+    )
+    if not (run_msd or run_steps or run_angles or run_local):
+        return rep, msd_key, 'up to date', None
+
+    ta = trajectory_analysis(
+        csv_path,
+        results_dir=results_dir,
+        condition=cond,
+        time_step=args.time_step,
+        micron_per_px=args.micron_per_px,
+        ts_resolution=args.ts_resolution,
+        min_track_len_linfit=args.min_track_len,
+        tlag_cutoff_linfit=args.tlag_cutoff,
+        fit_mode=args.fit_mode,
+        max_msd_lag=args.max_msd_lag,
+        make_rainbow_tracks=args.rainbow_tracks,
+        img_file_prefix=args.img_prefix,
+        rainbow_min_D=args.rainbow_min_D,
+        rainbow_max_D=args.rainbow_max_D,
+        rainbow_colormap=args.rainbow_colormap,
+        rainbow_scale=args.rainbow_scale,
+        rainbow_dpi=args.rainbow_dpi,
+        rainbow_color_by=args.rainbow_color_by,
+        rainbow_line_px=args.rainbow_line_px,
+        rainbow_antialias=args.rainbow_antialias,
+        rainbow_tiled=args.rainbow_tiled,
+        rainbow_format=args.rainbow_format,
+        rainbow_tile_size=args.rainbow_tile_size,
+        rainbow_cache_dir=os.path.join(args.work_dir, RAINBOW_CACHE_DIR),
+        rainbow_movie=args.rainbow_movie,
+        rainbow_movie_fps=args.rainbow_movie_fps,
+        rainbow_trail=args.rainbow_trail,
+        n_jobs=args.n_jobs,
+        threads_per_rep=args.threads_per_rep,
+        use_cache=not args.no_cache,
+        stream=args.stream,
+        memory_budget_mb=args.memory_budget_mb,
+        plot_mode='deferred',
+        legacy_step_tsv=args.legacy_step_tsv,
+        angle_bins=args.angle_bins,
+        angle_max_tau=args.autocorr_max_tau,
+        local_window=args.local_window,
+        local_max_lag=args.local_max_lag,
+        results_store=os.path.join(args.work_dir, RESULTS_STORE_NAME),
+    )
+    ta.write_params_to_log_file()
+    if args.stream:
+        # one chunked pass produces MSD fits, step sizes, angles and local D together
+        ta.run_streaming(step_sizes=args.step_size_analysis,
+                         turning_angles=args.turning_angle_analysis,
+                         local=args.local_diffusivity)
+        manifest.record('msd', msd_key, msd_outputs, params=params)
+        if args.step_size_analysis:
+            from gemspa.step_size_analysis import run_step_size_analysis_if_requested
+            with ta.timer.stage('step_size_analysis'):
+                run_step_size_analysis_if_requested(results_dir)
+            manifest.record('step_sizes', step_key, step_outputs)
+        if args.turning_angle_analysis:
+            manifest.record('turning_angles', angle_key, angle_outputs)
+        if args.local_diffusivity:
+            manifest.record('local_diffusivity', local_key, local_outputs)
+        timings = ta.write_timings(replicate=rep)
+        ta.log.close()
+        return rep, msd_key, 'done', timings
+    if run_msd:
+        ta.calculate_msd_and_diffusion()
+        outputs = list(msd_outputs)
+        if (args.max_msd_lag or 0) > args.tlag_cutoff:
+            outputs.append('msd_curves.npz')
+        if args.rainbow_tracks:
+            outputs.append(ta.rainbow_output_name())
+            if args.rainbow_movie:
+                outputs.append(ta.rainbow_movie_name())
+        manifest.record('msd', msd_key, outputs, params=params)
+    if run_steps:
+        from gemspa.step_size_analysis import run_step_size_analysis_if_requested
+        ta.export_step_sizes()
+        with ta.timer.stage('step_size_analysis'):
+            run_step_size_analysis_if_requested(results_dir)
+        manifest.record('step_sizes', step_key, step_outputs)
+    if run_angles:
+        ta.export_turning_angles()
+        manifest.record('turning_angles', angle_key, angle_outputs)
+    if run_local:
+        # windows are reused if the rainbow overlay was coloured by them
+        ta.local_diffusivity()
+        manifest.record('local_diffusivity', local_key, local_outputs)
+    timings = ta.write_timings(replicate=rep)
+    ta.log.close()
+    return rep, msd_key, 'done', timings
+
+
+def main():
+    args = parse_args()
+    if args.import_times:
+        report_import_times(args.work_dir)
+        return
+
+    files = sorted(glob.glob(os.path.join(args.work_dir, 'Traj_*.csv')))
+    files = [f for f in files if os.path.getsize(f) > 0]
+    if not files:
+        print(f"[gemspa] no Traj_*.csv files found in {args.work_dir}")
+        return
+    if args.clear_cache:
+        from gemspa.trajectory_io import clear_trajectory_cache, CACHE_DIR_NAME
+        for f in files:
+            clear_trajectory_cache(
+                os.path.join(args.work_dir, replicate_name(f), CACHE_DIR_NAME)
             )
+        from gemspa.rainbow_tiles import RAINBOW_CACHE_DIR
+        shutil.rmtree(os.path.join(args.work_dir, RAINBOW_CACHE_DIR), ignore_errors=True)
+
+    plan = plan_resources(args.n_jobs, args.threads_per_rep, n_tasks=len(files))
+    args.n_jobs, args.threads_per_rep = plan['n_jobs'], plan['threads_per_rep']
+    for note in plan['notes']:
+        print(f"[gemspa] resources: {note}")
+    print(f"[gemspa] resources: cores={plan['cores']} n_jobs={args.n_jobs} "
+          f"threads_per_rep={args.threads_per_rep} plot_workers={plan['plot_workers']}")
+    # workers inherit these before importing numpy/numba
+    export_thread_env(args.threads_per_rep)
 
-    def export_step_sizes(self, max_tlag=None):
-        """
-        Export all_data_step_sizes.txt for step-size analysis.
-        """
-        df = self.raw_df[['track_id','frame','x','y']].copy()
-        df['x'] *= self.micron_per_px
-        df['y'] *= self.micron_per_px
-        arr = df.sort_values(['track_id','frame']).to_numpy()
-
-        self.msd_processor.set_track_data(arr)
-        if max_tlag is not None:
-            self.msd_processor.max_tlag_step_size = max_tlag
-        self.msd_processor.step_sizes_and_angles()
-
-        ss = self.msd_processor.save_step_sizes(file_name='all_data_step_sizes.txt')
-        ss = ss.rename(columns={'t': 'tlag'})
-        ss.insert(1, 'group', self.condition)
-        out = os.path.join(self.results_dir, 'all_data_step_sizes.txt')
-        ss.to_csv(out, sep='\t', index=False)
-
-    def make_plot(self):
-        fig, ax = plt.subplots(figsize=(8,5))
-        d = self.results_df['D_fit']
-        dpos = d[d > 0]
-        if len(dpos) == 0:
-            # fallback: avoid logspace error if all D<=0
-            bins = 30
-        else:
-            lo, hi = dpos.min(), d.max()
-            bins = np.logspace(np.log10(lo), np.log10(hi), 30)
-            ax.set_xscale('log')
-
-        ax.hist(d, bins=bins, edgecolor='black')
-        ax.set_xlabel('D_fit (μm²/s)' + (' (log scale)' if len(dpos) else ''))
-        ax.set_title(f"D_fit Distribution ({self.condition})")
-        fig.tight_layout()
-        fig.savefig(os.path.join(self.results_dir, 'D_fit_distribution.png'))
-        plt.close(fig)
-
-    def make_scatter(self):
-        fig, ax = plt.subplots(figsize=(8,5))
-        d = self.results_df['D_fit']
-        d = d.replace({0: np.nan})
-        ax.scatter(np.log10(d), self.results_df['alpha_fit'], alpha=0.6)
-        ax.set_xlabel('log10(D_fit)')
-        ax.set_ylabel('alpha_fit')
-        ax.set_title(f"alpha vs log D ({self.condition})")
-        fig.tight_layout()
-        fig.savefig(os.path.join(self.results_dir, 'alpha_vs_logD.png'))
-        plt.close(fig)
-
-    def write_params_to_log_file(self):
-        params = {
-            'condition':             self.condition,
-            'time_step':             self.time_step,
-            'micron_per_px':         self.micron_per_px,
-            'min_track_len_linfit':  self.min_track_len_linfit,
-            'tlag_cutoff_linfit':    self.tlag_cutoff_linfit
-        }
-        pd.Series(params).to_csv(
-            os.path.join(self.results_dir,'params_log.csv'), header=False
+    print(f"[gemspa] processing {len(files)} replicate(s) with n_jobs={args.n_jobs}")
+
+    if args.profile:
+        with profiled(os.path.join(args.work_dir, 'profile_run.prof')):
+            run_all(files, args, plan)
+    else:
+        run_all(files, args, plan)
+
+
+def run_all(files, args, plan):
+    run_timer = stage_timer()
+    filters = dict(
+        filter_D_min=args.filter_D_min,
+        filter_D_max=args.filter_D_max,
+        filter_alpha_min=args.filter_alpha_min,
+        filter_alpha_max=args.filter_alpha_max,
+    )
+    if args.plots_only:
+        done = []
+        render_saved_plots(args, plan, run_timer, filters)
+    elif args.filter_sweep:
+        done = []
+        run_sweep(args, run_timer)
+    else:
+        done = run_analysis(files, args, plan, run_timer, filters)
+
+    # run-level rollup: this run's replicate stages plus post-processing
+    rep_timings = [t for _, _, _, t in done if t]
+    run_timer.write_json(
+        os.path.join(args.work_dir, 'timings.json'),
+        resources={k: plan[k] for k in ('cores', 'n_jobs', 'threads_per_rep', 'plot_workers')},
+        replicate_stage_totals=rollup(rep_timings),
+        replicates={t['replicate']: t['total_wall_s'] for t in rep_timings},
+    )
+    print(f"[gemspa] total {run_timer.total_wall():.1f}s; timings in "
+          f"{os.path.join(args.work_dir, 'timings.json')}")
+
+
+def run_analysis(files, args, plan, run_timer, filters):
+    """
+    Replicate, ensemble and comparison stages. Plot jobs spooled by the
+    analysis are drawn by a separate Agg process pool while later stages run
+    (not at all with --no-plots); it gets plan['plot_workers'], the cores the
+    compute stages leave free. Returns the replicate results.
+    """
+    from joblib import Parallel, delayed
+    from gemspa.plot_queue import plot_renderer, load_plot_jobs, stale_jobs
+    from gemspa.ensemble_analysis import run_ensemble
+    renderer = None if args.no_plots else plot_renderer(plan['plot_workers'])
+    submitted = set()
+
+    def submit_stale(jobs):
+        todo = [j for j in (jobs if args.force else stale_jobs(jobs))
+                if j['out'] not in submitted]
+        submitted.update(j['out'] for j in todo)
+        renderer.submit(todo)
+
+    # compile (or load from the on-disk cache) the Numba kernels once here,
+    # so workers read cached machine code instead of compiling concurrently
+    with run_timer.stage('warmup') as st:
+        from gemspa.msd_diffusion import warmup_kernels
+        warmup_kernels()
+    print(f"[gemspa] kernels ready in {st['wall_s']:.1f}s")
+
+    with run_timer.stage('replicates', replicates=len(files)):
+        done = Parallel(n_jobs=args.n_jobs)(
+            delayed(process_replicate)(f, args) for f in files
         )
-        for k, v in params.items():
-            self.log.write(f"{k}: {v}\n")
-        self.log.flush()
+    for rep, _, status, _ in done:
+        print(f"[gemspa] {rep}: {status}")
+    if renderer:
+        for rep, _, _, _ in done:
+            submit_stale(load_plot_jobs(os.path.join(args.work_dir, rep), recursive=False))
+
+    run_m = run_manifest(os.path.join(args.work_dir, RUN_MANIFEST_NAME))
+    ens_key = params_key(sorted((rep, key) for rep, key, _, _ in done), filters,
+                         args.export_grouped_csv)
+
+    if args.force or not run_m.is_current('ensemble', ens_key):
+        with run_timer.stage('run_ensemble'):
+            run_ensemble(args.work_dir, n_jobs=plan['n_jobs'], plot_mode='deferred',
+                         export_csv=args.export_grouped_csv, force=args.force, **filters)
+        run_m.record('ensemble', ens_key,
+                     glob.glob(os.path.join(args.work_dir, '*', 'grouped_*', 'results_query.json'))
+                     + glob.glob(os.path.join(args.work_dir, '*', 'grouped_*', 'msd_results.csv')),
+                     params=filters)
+    else:
+        print("[gemspa] ensemble: up to date")
+    if args.turning_angle_analysis:
+        pool_turning_angles(args, run_timer, run_m)
+    if renderer:
+        submit_stale(load_plot_jobs(args.work_dir))
+
+    # comparison figures are rendering only: skipped with --no-plots
+    compare_key = params_key(ens_key, args.bootstrap, args.bootstrap_seed,
+                             args.binned_comparison)
+    if args.no_plots:
+        print("[gemspa] compare: skipped (--no-plots)")
+    elif args.force or not run_m.is_current('compare', compare_key):
+        from gemspa.compare_conditions import compare_conditions
+        with run_timer.stage('compare_conditions', n_boot=args.bootstrap):
+            compare_conditions(args.work_dir, n_boot=args.bootstrap,
+                               boot_seed=args.bootstrap_seed, binned=args.binned_comparison,
+                               **filters)
+        run_m.record('compare', compare_key,
+                     glob.glob(os.path.join(args.work_dir, 'comparison', '*.png'))
+                     + glob.glob(os.path.join(args.work_dir, 'comparison', '*.csv')),
+                     params=filters)
+    else:
+        print("[gemspa] compare: up to date")
+
+    if renderer:
+        with run_timer.stage('plots', plots=len(submitted)):
+            report_plots(renderer.wait())
+    return done
+
+
+def pool_turning_angles(args, run_timer, run_m):
+    """Sum replicate angle accumulators per condition when any of them changed."""
+    from gemspa.angle_analysis import pool_angle_stats, replicate_angle_stats
+    stats = sorted(p for paths in replicate_angle_stats(args.work_dir).values() for p in paths)
+    key = params_key([(os.path.relpath(p, args.work_dir), os.stat(p).st_mtime_ns) for p in stats])
+    if not (args.force or not run_m.is_current('turning_angles', key)):
+        print("[gemspa] turning angles: up to date")
+        return
+    with run_timer.stage('turning_angles', replicates=len(stats)):
+        jobs = pool_angle_stats(args.work_dir, plot_mode='deferred')
+    run_m.record('turning_angles', key, sorted({os.path.dirname(j['out']) for j in jobs}))
+
+
+def render_saved_plots(args, plan, run_timer, filters):
+    """--plots-only: draw spooled plot jobs and the comparison figures from saved results."""
+    from gemspa.plot_queue import render_plot_jobs, load_plot_jobs, stale_jobs
+    from gemspa.compare_conditions import compare_conditions
+    jobs = load_plot_jobs(args.work_dir)
+    if not args.force:
+        jobs = stale_jobs(jobs)
+    print(f"[gemspa] rendering {len(jobs)} plot(s)")
+    with run_timer.stage('plots', plots=len(jobs)):
+        report_plots(render_plot_jobs(jobs, plan['cores']))
+    with run_timer.stage('compare_conditions', n_boot=args.bootstrap):
+        compare_conditions(args.work_dir, n_boot=args.bootstrap,
+                           boot_seed=args.bootstrap_seed, binned=args.binned_comparison,
+                           **filters)
+
+
+def run_sweep(args, run_timer):
+    """--filter-sweep: answer every bound combination from the per-condition D/alpha indexes."""
+    from gemspa.results_store import backfill_results
+    from gemspa.filter_sweep import sweep_grid, run_filter_sweep, SWEEP_TABLE_NAME
+    grid = sweep_grid(args.sweep_D_min or [args.filter_D_min],
+                      args.sweep_D_max or [args.filter_D_max],
+                      args.sweep_alpha_min or [args.filter_alpha_min],
+                      args.sweep_alpha_max or [args.filter_alpha_max])
+    with run_timer.stage('filter_sweep', combinations=len(grid)):
+        backfill_results(args.work_dir)
+        table, _, _ = run_filter_sweep(args.work_dir, grid)
+    print(f"[gemspa] filter sweep: {len(grid)} combination(s) x "
+          f"{table['condition'].nunique() if len(table) else 0} condition(s) in "
+          f"{os.path.join(args.work_dir, 'comparison', SWEEP_TABLE_NAME)}")
+
+
+def report_import_times(work_dir):
+    """Print and save the cold import cost of the package and each stage."""
+    report = import_report()
+    for stage, rec in report.items():
+        loads = ', '.join(rec['loads']) or '-'
+        print(f"[gemspa] import {stage:<20} {rec['seconds']:6.3f}s  ({rec['module']}; loads {loads})")
+    out = os.path.join(work_dir, 'import_times.json')
+    with open(out, 'w') as fh:
+        json.dump(report, fh, indent=1)
+    print(f"[gemspa] import times in {out}")
+
+
+def report_plots(results):
+    failed = [(out, err) for out, err in results if err]
+    for out, err in failed:
+        print(f"[gemspa] plot {out} failed: {err}")
+    print(f"[gemspa] plots: {len(results) - len(failed)} drawn, {len(failed)} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,23 @@
 # Make gemspa a package and expose classes
-from .trajectory_analysis import trajectory_analysis
-from .step_size_analysis import run_step_size_analysis_if_requested
-from .msd_diffusion import msd_diffusion
+# Names load on first attribute access (PEP 562), so `import gemspa` and CLI
+# start-up do not pull in numba, scipy, matplotlib or seaborn. Classes named
+# like their submodule are imported from it: from gemspa.msd_diffusion import
+# msd_diffusion, from gemspa.trajectory_analysis import trajectory_analysis.
+import importlib
+
+_LAZY = {
+    'run_step_size_analysis_if_requested': '.step_size_analysis',
+}
 # Optional: expose other modules if needed
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
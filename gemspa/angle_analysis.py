@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+angle_analysis.py
+
+Turning-angle and displacement-correlation analysis from the arrays of
+msd_diffusion.step_sizes_and_angles.
+
+Per replicate, angles are exported to angles.store (long format, like the
+step store; dx/dy live in step_sizes.store) and reduced to additive
+accumulators saved as angle_analysis/angle_stats.npz:
+    hist      (max_lag x n_bins) turning-angle counts over [0, 180] degrees
+    cos_sum   (max_lag)          sum of cos(theta) per lag
+    corr_sum  (max_tau + 1)      sum of dr(t) . dr(t + tau), frame-to-frame dr
+    corr_n    (max_tau + 1)      number of pairs per tau
+All reductions are single np.bincount / vectorised passes. Accumulators
+add, so replicates are pooled per condition by summing them
+(<condition>/angle_analysis), without reloading any angles.
+"""
+import os
+import re
+import glob
+import numpy as np
+import pandas as pd
+
+from .step_store import step_store_writer
+from .plot_queue import plot_queue, render_plot_jobs
+
+ANGLE_STORE_NAME = 'angles.store'
+ANGLE_DIR_NAME = 'angle_analysis'
+ANGLE_STATS_NAME = 'angle_stats.npz'
+
+ANGLE_COLUMNS = {
+    'group':     '<u2',
+    'replicate': '<u2',
+    'tlag':      '<i4',
+    'angle':     '<f8',
+}
+
+
+def empty_stats(max_lag, n_bins=18, max_tau=10):
+    return {
+        'hist':     np.zeros((max_lag, n_bins), dtype=np.int64),
+        'cos_sum':  np.zeros(max_lag),
+        'corr_sum': np.zeros(max_tau + 1),
+        'corr_n':   np.zeros(max_tau + 1, dtype=np.int64),
+    }
+
+
+def merge_stats(a, b):
+    """Sum of two accumulators (same lags, bins and taus)."""
+    return {k: a[k] + b[k] for k in a}
+
+
+def accumulate_angles(stats, angles):
+    """
+    Add a (max_lag x n) NaN-padded turning-angle matrix (degrees) to the
+    per-lag histogram and cos sums with one bincount each.
+    """
+    hist = stats['hist']
+    n_lags, n_bins = hist.shape
+    angles = angles[:n_lags]
+    mask = ~np.isnan(angles)
+    lag = np.nonzero(mask)[0]
+    vals = angles[mask]
+    b = np.minimum((vals * (n_bins / 180.0)).astype(np.int64), n_bins - 1)
+    flat = lag * n_bins + b
+    hist += np.bincount(flat, minlength=n_lags * n_bins).reshape(n_lags, n_bins)
+    stats['cos_sum'] += np.bincount(lag, weights=np.cos(np.radians(vals)), minlength=n_lags)
+    return stats
+
+
+def accumulate_autocorr(stats, dx, dy, offsets):
+    """
+    Add frame-to-frame displacement correlations: dx/dy are the lag-1 rows
+    of the step matrices (track k's n_k - 1 steps are contiguous) and
+    offsets the CSR point offsets of those tracks. tau = 0 sums |dr|^2.
+    """
+    seg = np.diff(offsets) - 1
+    m = int(seg.sum())
+    dx, dy = dx[:m], dy[:m]
+    track = np.repeat(np.arange(seg.size), seg)
+    for tau in range(stats['corr_sum'].size):
+        if tau >= m:
+            break
+        same = track[:m - tau] == track[tau:]
+        dot = dx[:m - tau] * dx[tau:] + dy[:m - tau] * dy[tau:]
+        stats['corr_sum'][tau] += dot[same].sum()
+        stats['corr_n'][tau] += np.count_nonzero(same)
+    return stats
+
+
+def processor_stats(p, n_bins=18, max_tau=10):
+    """Accumulators from an msd_diffusion after step_sizes_and_angles()."""
+    stats = empty_stats(p.max_tlag_step_size, n_bins, max_tau)
+    if p.angles.size:
+        accumulate_angles(stats, p.angles)
+    if p.deltaX.size:
+        accumulate_autocorr(stats, p.deltaX[0], p.deltaY[0], p.step_offsets)
+    return stats
+
+
+def long_angles(angles):
+    """Long-format (tlag, angle) arrays from the NaN-padded angle matrix."""
+    mask = ~np.isnan(angles)
+    return {'tlag': (np.nonzero(mask)[0] + 1).astype(np.int32), 'angle': angles[mask]}
+
+
+def angle_store_writer(path):
+    return step_store_writer(path, columns=ANGLE_COLUMNS)
+
+
+def save_stats(path, stats):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, **stats)
+
+
+def load_stats(path):
+    with np.load(path) as z:
+        return {k: z[k] for k in z.files}
+
+
+def stats_tables(stats):
+    """
+    (turning, histogram, autocorr) DataFrames: per-lag angle counts and
+    mean cos(theta); per-lag binned densities; and C(tau) = <dr(t).dr(t+tau)>
+    normalised by <|dr|^2>.
+    """
+    hist = stats['hist']
+    n_lags, n_bins = hist.shape
+    n = hist.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        turning = pd.DataFrame({
+            'tlag':     np.arange(1, n_lags + 1),
+            'n_angles': n,
+            'mean_cos': stats['cos_sum'] / n,
+        })
+        width = 180.0 / n_bins
+        histogram = pd.DataFrame({
+            'tlag':       np.repeat(np.arange(1, n_lags + 1), n_bins),
+            'bin_lo':     np.tile(np.arange(n_bins) * width, n_lags),
+            'bin_hi':     np.tile((np.arange(n_bins) + 1) * width, n_lags),
+            'count':      hist.ravel(),
+            'density':    (hist / (n[:, None] * width)).ravel(),
+        })
+        mean_dot = stats['corr_sum'] / stats['corr_n']
+        autocorr = pd.DataFrame({
+            'tau':     np.arange(stats['corr_sum'].size),
+            'n_pairs': stats['corr_n'],
+            'C':       mean_dot / mean_dot[0],
+        })
+    return turning, histogram, autocorr
+
+
+def write_angle_tables(out_dir, stats, condition, plots=True):
+    """
+    Write turning_angles.csv, angle_histograms.csv and displacement_autocorr.csv
+    to out_dir; with plots, also queue their figures. Returns the plot_queue.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    turning, histogram, autocorr = stats_tables(stats)
+    paths = {name: os.path.join(out_dir, f'{name}.csv')
+             for name in ('turning_angles', 'angle_histograms', 'displacement_autocorr')}
+    turning.to_csv(paths['turning_angles'], index=False)
+    histogram.to_csv(paths['angle_histograms'], index=False)
+    autocorr.to_csv(paths['displacement_autocorr'], index=False)
+    queue = plot_queue(out_dir)
+    if plots:
+        for kind, data in (('angle_histograms', 'angle_histograms'),
+                           ('mean_cos', 'turning_angles'),
+                           ('displacement_autocorr', 'displacement_autocorr')):
+            queue.add(kind, paths[data], os.path.join(out_dir, f'{kind}.png'),
+                      condition=condition)
+        queue.save()
+    return queue
+
+
+def replicate_angle_stats(root_dir):
+    """Condition -> angle_stats.npz paths of its <condition>_<n> replicate folders."""
+    cond_map = {}
+    pattern = os.path.join(root_dir, '*', ANGLE_DIR_NAME, ANGLE_STATS_NAME)
+    for path in sorted(glob.glob(pattern)):
+        rep = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        if re.match(r'.+_[0-9]+$', rep):
+            cond_map.setdefault(re.sub(r'_[0-9]+$', '', rep), []).append(path)
+    return cond_map
+
+
+def pool_angle_stats(root_dir, plot_mode='inline'):
+    """
+    Sum the replicates' angle_stats.npz per condition into
+    <root_dir>/<condition>/angle_analysis. Returns the plot jobs queued.
+    """
+    jobs = []
+    for cond, paths in sorted(replicate_angle_stats(root_dir).items()):
+        pooled = None
+        for path in paths:
+            stats = load_stats(path)
+            pooled = stats if pooled is None else merge_stats(pooled, stats)
+        out_dir = os.path.join(root_dir, cond, ANGLE_DIR_NAME)
+        save_stats(os.path.join(out_dir, ANGLE_STATS_NAME), pooled)
+        jobs += write_angle_tables(out_dir, pooled, cond).resolved()
+    if plot_mode == 'inline':
+        render_plot_jobs(jobs)
+    return jobs
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+bootstrap.py
+
+Hierarchical bootstrap for condition-level statistics: each resample draws
+the condition's replicates with replacement, then each drawn replicate's
+tracks with replacement, so replicates count equally however many tracks
+they hold.
+
+Resampling n_r tracks of replicate r with replacement only matters through
+how many times each value is drawn, i.e. a multinomial over its values.
+Values are bucketed into n_bins quantile bins of the pooled condition and
+every resample is one vectorised multinomial draw of bin counts per
+replicate (a replicate drawn m times contributes Multinomial(m * n_r, p_r)),
+so the cost is O(n_boot x n_bins) per replicate, independent of track
+count. Medians are interpolated within the bin; the sum of the c draws
+from a bin has mean c * (bin mean) and variance c * (bin variance), which
+is drawn from its normal approximation. A fixed seed makes the intervals
+reproducible; each condition's stream is seeded from its name, so its
+intervals do not change when other conditions are added.
+
+bootstrap_binned takes the per-replicate bins directly, e.g. the fixed-grid
+summaries of ensemble_summary.py merged into quantile groups (coarsen_bins).
+"""
+import zlib
+import numpy as np
+import pandas as pd
+
+BOOT_STATS = ('median', 'mean')
+
+
+def _binned(values, replicate, n_bins):
+    """Quantile bin edges, and per-replicate bin counts, sums and sums of squares."""
+    edges = np.quantile(values, np.linspace(0.0, 1.0, n_bins + 1))
+    idx = np.searchsorted(edges[1:-1], values, side='right')
+    n_reps = int(replicate.max()) + 1
+    flat = replicate * n_bins + idx
+    size = n_reps * n_bins
+    counts = np.bincount(flat, minlength=size).reshape(n_reps, n_bins)
+    sums = np.bincount(flat, weights=values, minlength=size).reshape(n_reps, n_bins)
+    sumsq = np.bincount(flat, weights=values * values, minlength=size).reshape(n_reps, n_bins)
+    return edges, counts, sums, sumsq
+
+
+def _median_from_counts(counts, edges):
+    """Median of each row of binned counts, linearly interpolated within the bin."""
+    cum = np.cumsum(counts, axis=1)
+    half = cum[:, -1] / 2.0
+    k = np.minimum((cum < half[:, None]).sum(axis=1), counts.shape[1] - 1)
+    rows = np.arange(counts.shape[0])
+    below = np.where(k > 0, cum[rows, k - 1], 0)
+    in_bin = counts[rows, k]
+    frac = np.divide(half - below, in_bin, out=np.full(half.shape, 0.5), where=in_bin > 0)
+    return edges[k] + frac * (edges[k + 1] - edges[k])
+
+
+def coarsen_bins(edges, counts, sums, sumsq, n_bins=128):
+    """
+    Merge consecutive fine bins (per-replicate rows) into about n_bins
+    groups of equal pooled count: the quantile bins of _binned, with edges
+    snapped to the fine grid.
+    """
+    pooled = counts.sum(axis=0)
+    total = max(pooled.sum(), 1)
+    group = np.minimum(((np.cumsum(pooled) - pooled / 2.0) * n_bins // total).astype(np.int64),
+                       n_bins - 1)
+    starts = np.flatnonzero(np.diff(group, prepend=-1))
+    merged = [np.add.reduceat(a, starts, axis=1) for a in (counts, sums, sumsq)]
+    return (np.append(edges[starts], edges[-1]), *merged)
+
+
+def bootstrap_binned(edges, counts, sums, sumsq, n_boot=10000, seed=0):
+    """
+    Bootstrap distributions of the median and mean from per-replicate bin
+    counts, sums and sums of squares (R x n_bins, bins between `edges`).
+    Returns {stat: (n_boot,) array}.
+    """
+    rng = np.random.default_rng(seed)
+    n_rep = counts.sum(axis=1)
+    present = n_rep > 0
+    counts, sums, sumsq, n_rep = counts[present], sums[present], sumsq[present], n_rep[present]
+    R = counts.shape[0]
+    bin_mean = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    bin_var = np.divide(sumsq, counts, out=np.zeros_like(sums), where=counts > 0) - bin_mean**2
+    bin_var = np.clip(bin_var, 0.0, None)
+    p = counts / n_rep[:, None]
+
+    # replicate level: how often each replicate is drawn in each resample
+    picks = rng.multinomial(R, np.full(R, 1.0 / R), size=n_boot)
+    total = np.zeros((n_boot, counts.shape[1]), dtype=np.int64)
+    value_sum = np.zeros(n_boot)
+    value_var = np.zeros(n_boot)
+    for r in range(R):
+        # track level: m draws of n_r tracks pool into one multinomial
+        c = rng.multinomial(picks[:, r] * n_rep[r], p[r])
+        total += c
+        value_sum += c @ bin_mean[r]
+        value_var += c @ bin_var[r]
+    value_sum += np.sqrt(value_var) * rng.standard_normal(n_boot)
+    return {
+        'median': _median_from_counts(total, edges),
+        'mean':   value_sum / total.sum(axis=1),
+    }
+
+
+def hierarchical_bootstrap(values, replicate, n_boot=10000, n_bins=128, seed=0):
+    """
+    Bootstrap distributions of the median and mean of `values`, grouped by
+    the integer codes in `replicate` (0..R-1). Returns {stat: (n_boot,) array}.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    replicate = np.asarray(replicate, dtype=np.int64)
+    return bootstrap_binned(*_binned(values, replicate, n_bins), n_boot=n_boot, seed=seed)
+
+
+def condition_seed(seed, cond, qi):
+    """Seed of one condition's and quantity's resamples, independent of the other conditions."""
+    return [seed, zlib.crc32(str(cond).encode('utf-8')), qi]
+
+
+def _point(values, stat):
+    return float(np.median(values) if stat == 'median' else np.mean(values))
+
+
+def bootstrap_table(data, columns=('D_fit', 'alpha_fit'), n_boot=10000, n_bins=128,
+                    seed=0, level=0.95):
+    """
+    Confidence intervals per condition and for each pair of conditions.
+
+    data : DataFrame with condition, replicate and the `columns` per track.
+    Returns a DataFrame with one row per (quantity, statistic, condition or
+    'A - B' contrast): estimate on the pooled tracks, bootstrap CI bounds,
+    replicate and track counts. Contrasts pair independent resamples.
+    """
+    results = {}
+    for cond in sorted(data['condition'].unique()):
+        sub = data[data['condition'] == cond]
+        codes = pd.factorize(sub['replicate'])[0]
+        res = results[cond] = {}
+        for qi, col in enumerate(columns):
+            vals = sub[col].to_numpy(dtype=np.float64)
+            ok = np.isfinite(vals)
+            if not ok.any():
+                continue
+            dist = hierarchical_bootstrap(vals[ok], codes[ok], n_boot, n_bins,
+                                          seed=condition_seed(seed, cond, qi))
+            for stat in BOOT_STATS:
+                res[(col, stat)] = (dist[stat], _point(vals[ok], stat),
+                                    int(np.unique(codes[ok]).size), int(ok.sum()))
+    return ci_table(results, columns, n_boot, level)
+
+
+def ci_table(results, columns=('D_fit', 'alpha_fit'), n_boot=10000, level=0.95):
+    """
+    bootstrap_table from per-condition results {condition: {(column, stat):
+    (bootstrap distribution, estimate, n_replicates, n_tracks)}}.
+    """
+    lo_q, hi_q = 100 * (1 - level) / 2, 100 * (1 + level) / 2
+    conds = sorted(results)
+    rows = []
+    for cond in conds:
+        for col in columns:
+            for stat in BOOT_STATS:
+                if (col, stat) not in results[cond]:
+                    continue
+                dist, estimate, n_reps, n_tracks = results[cond][(col, stat)]
+                rows.append({
+                    'quantity':     col,
+                    'statistic':    stat,
+                    'condition':    cond,
+                    'estimate':     estimate,
+                    'ci_lo':        np.percentile(dist, lo_q),
+                    'ci_hi':        np.percentile(dist, hi_q),
+                    'n_replicates': n_reps,
+                    'n_tracks':     n_tracks,
+                })
+    for i, a in enumerate(conds):
+        for b in conds[i + 1:]:
+            for col in columns:
+                for stat in BOOT_STATS:
+                    if (col, stat) not in results[a] or (col, stat) not in results[b]:
+                        continue
+                    (da, ea, _, _), (db, eb, _, _) = results[a][(col, stat)], results[b][(col, stat)]
+                    diff = da - db
+                    rows.append({
+                        'quantity':     col,
+                        'statistic':    stat,
+                        'condition':    f'{a} - {b}',
+                        'estimate':     ea - eb,
+                        'ci_lo':        np.percentile(diff, lo_q),
+                        'ci_hi':        np.percentile(diff, hi_q),
+                        'n_replicates': None,
+                        'n_tracks':     None,
+                    })
+    out = pd.DataFrame(rows, columns=['quantity', 'statistic', 'condition', 'estimate',
+                                      'ci_lo', 'ci_hi', 'n_replicates', 'n_tracks'])
+    out[['n_replicates', 'n_tracks']] = out[['n_replicates', 'n_tracks']].astype('Int64')
+    out['n_boot'] = n_boot
+    out['level'] = level
+    return out
@@ -8,15 +8,34 @@ Generates comparative plots across experimental conditions:
 - Linear-scale histogram of alpha_fit.
 - Linear-scale boxplot of replicate median D_fit with jittered points and 
   Mann–Whitney U test asterisk annotation.
+- Hierarchical bootstrap CIs (replicates, then tracks) for the median and
+  mean D_fit / alpha_fit per condition and their differences, written to
+  bootstrap_ci.csv and drawn as error bars on the plots above.
+Means, replicate medians and bootstrap inputs come from the per-replicate
+summaries of ensemble_summary.py; each condition's bootstrap distributions
+are cached in grouped_filtered/bootstrap_dist.npz, so only conditions whose
+replicates changed are resampled. Histograms and KS tests use the filtered
+per-track rows (exact ks_2samp, as filter_sweep.py); binned=True draws them
+from the summaries' grid bins instead and takes the KS p-value from the grid
+CDFs (asymptotic, see ensemble_summary.binned_ks), never reading track rows.
 """
 import os
-import re
-import pandas as pd
+import json
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.stats import ks_2samp, mannwhitneyu
 
+from .bootstrap import ci_table
+from .results_store import (
+    list_partitions, filter_bounds, read_results, RESULTS_STORE_NAME, RESULTS_QUERY_NAME
+)
+from .ensemble_summary import (
+    condition_summary, condition_bootstrap, pooled_counts, pooled_mean, binned_ks, rebin,
+    GRID_EDGES
+)
+
 def _p_to_asterisks(p):
     if p < 1e-4:   return "****"
     if p < 1e-3:   return "***"
@@ -24,23 +43,92 @@ def _p_to_asterisks(p):
     if p < 5e-2:   return "*"
     return "n.s."
 
+def _condition_replicates(root_dir, cond):
+    """Replicates of a condition's filtered ensemble, from its results_query.json."""
+    with open(os.path.join(root_dir, cond, 'grouped_filtered', RESULTS_QUERY_NAME)) as fh:
+        reps = json.load(fh)['replicates']
+    if reps is None:
+        reps = [r for r in list_partitions(os.path.join(root_dir, RESULTS_STORE_NAME))
+                if r.rsplit('_', 1)[0] == cond]
+    return reps
+
+def _ks_p(summaries, rows, conds, col):
+    """KS p-value of the first two conditions: exact on rows, else on the grid CDFs."""
+    if rows is not None:
+        return ks_2samp(rows[conds[0]][col], rows[conds[1]][col]).pvalue
+    return binned_ks(pooled_counts(summaries[conds[0]], col),
+                     pooled_counts(summaries[conds[1]], col))[1]
+
+def _hist(ax, summary, values, col, bins, lo, hi, **kw):
+    """
+    Density histogram of the filtered values over `bins`, or with values None
+    of the summary's grid bins (5 merged per bar) within [lo, hi].
+    """
+    if values is not None:
+        ax.hist(values, bins=bins, density=True, **kw)
+        return
+    edges, counts = rebin(GRID_EDGES[col], pooled_counts(summary, col)[1:-1], 5, lo, hi)
+    if counts.sum():
+        ax.hist(edges[:-1], bins=edges, weights=counts, density=True, **kw)
+
+def _ci(boot, quantity, statistic, cond):
+    """(estimate, lo, hi) of a bootstrap_ci row, or None."""
+    if boot is None:
+        return None
+    row = boot[(boot['quantity'] == quantity) & (boot['statistic'] == statistic)
+               & (boot['condition'] == cond)]
+    if row.empty:
+        return None
+    r = row.iloc[0]
+    return r['estimate'], r['ci_lo'], r['ci_hi']
+
+def _ci_errorbar(ax, ci, pos, color, horizontal):
+    est, lo, hi = ci
+    err = [[est - lo], [hi - est]]
+    if horizontal:
+        ax.errorbar(est, pos, xerr=err, fmt='o', color=color, capsize=4, lw=1.5)
+    else:
+        ax.errorbar(pos, est, yerr=err, fmt='D', color=color, capsize=4, lw=1.5)
+
 def compare_conditions(root_dir,
                        filter_D_min=0.0, filter_D_max=float('inf'),
-                       filter_alpha_min=0.0, filter_alpha_max=float('inf')):
-    # Load grouped_filtered data
-    cond_map = {}
-    for sub in os.listdir(root_dir):
-        path = os.path.join(root_dir, sub, 'grouped_filtered', 'msd_results.csv')
-        if os.path.isfile(path):
-            cond_map[sub] = pd.read_csv(path, usecols=['D_fit','alpha_fit'])
-    if len(cond_map) < 2:
+                       filter_alpha_min=0.0, filter_alpha_max=float('inf'),
+                       n_boot=10000, boot_seed=0, binned=False):
+    """
+    Comparison plots in <root_dir>/comparison. n_boot > 0 also writes
+    bootstrap_ci.csv (hierarchical bootstrap, fixed boot_seed) and adds its
+    95% CIs as error bars: mean D_fit / alpha_fit on the histograms, median
+    D_fit on the boxplot. binned=True draws the histograms and KS p-values
+    from the per-replicate summaries (approximate, see module docstring).
+    """
+    # Conditions with a filtered ensemble, as summaries of their replicates
+    conds = [sub for sub in os.listdir(root_dir)
+             if os.path.isfile(os.path.join(root_dir, sub, 'grouped_filtered', RESULTS_QUERY_NAME))]
+    if len(conds) < 2:
         return
-    conds = list(cond_map.keys())
+    store = os.path.join(root_dir, RESULTS_STORE_NAME)
+    bounds = filter_bounds(filter_D_min, filter_D_max, filter_alpha_min, filter_alpha_max)
+    reps = {c: _condition_replicates(root_dir, c) for c in conds}
+    summaries = {c: condition_summary(store, reps[c], bounds) for c in conds}
+    rows = None if binned else {
+        c: read_results(store, conditions=[c], replicates=reps[c], bounds=bounds)
+        for c in conds}
 
     # Output folder
     comp_dir = os.path.join(root_dir, 'comparison')
     os.makedirs(comp_dir, exist_ok=True)
 
+    # Hierarchical bootstrap on the same filtered tracks, replicate by replicate
+    boot = None
+    if n_boot > 0:
+        boot = ci_table({
+            c: condition_bootstrap(summaries[c], c, n_boot=n_boot, seed=boot_seed,
+                                   cache_path=os.path.join(root_dir, c, 'grouped_filtered',
+                                                           'bootstrap_dist.npz'))
+            for c in conds
+        }, n_boot=n_boot)
+        boot.to_csv(os.path.join(comp_dir, 'bootstrap_ci.csv'), index=False)
+
     # Color palette
     colors = sns.color_palette(n_colors=len(conds))
 
@@ -48,16 +136,22 @@ def compare_conditions(root_dir,
     fig, ax = plt.subplots(figsize=(8, 6))
     means = {}
     for c, col in zip(conds, colors):
-        df = cond_map[c]
-        ax.hist(
-            df['D_fit'], bins=np.logspace(-3, np.log10(filter_D_max), 50),
-            density=True, alpha=0.5, color=col, label=c
-        )
-        mean_val = df['D_fit'].mean()
+        _hist(ax, summaries[c], None if binned else rows[c]['D_fit'], 'D_fit',
+              np.logspace(-3, np.log10(filter_D_max), 50),
+              filter_D_min if filter_D_min > 0 else 1e-3, filter_D_max,
+              alpha=0.5, color=col, label=c)
+        mean_val = pooled_mean(summaries[c], 'D_fit')
         means[c] = mean_val
         darker = tuple(max(0, x * 0.7) for x in col)
         ax.axvline(mean_val, color=darker, linewidth=2)
 
+    y_top = ax.get_ylim()[1]
+    for i, (c, col) in enumerate(zip(conds, colors)):
+        ci = _ci(boot, 'D_fit', 'mean', c)
+        if ci:
+            _ci_errorbar(ax, ci, y_top * (0.8 - 0.05 * i),
+                         tuple(max(0, x * 0.7) for x in col), horizontal=True)
+
     ax.set_xscale('log')
     ax.set_xlim(filter_D_min if filter_D_min > 0 else 1e-3, filter_D_max)
     ax.set_xlabel('D_fit (μm²/s), log scale')
@@ -66,9 +160,7 @@ def compare_conditions(root_dir,
     ax.legend()
 
     # KS-test bracket at mean positions
-    d1 = cond_map[conds[0]]['D_fit']
-    d2 = cond_map[conds[1]]['D_fit']
-    p = ks_2samp(d1, d2).pvalue
+    p = _ks_p(summaries, rows, conds, 'D_fit')
     stars = _p_to_asterisks(p)
     y_max = ax.get_ylim()[1]
     y_base = y_max * 0.90
@@ -88,23 +180,27 @@ def compare_conditions(root_dir,
     fig, ax = plt.subplots(figsize=(8, 6))
     means = {}
     for c, col in zip(conds, colors):
-        df = cond_map[c]
-        ax.hist(df['alpha_fit'], bins=50, density=True,
-                alpha=0.5, color=col, label=c)
-        mean_val = df['alpha_fit'].mean()
+        _hist(ax, summaries[c], None if binned else rows[c]['alpha_fit'], 'alpha_fit', 50,
+              filter_alpha_min, filter_alpha_max, alpha=0.5, color=col, label=c)
+        mean_val = pooled_mean(summaries[c], 'alpha_fit')
         means[c] = mean_val
         darker = tuple(max(0, x * 0.7) for x in col)
         ax.axvline(mean_val, color=darker, linewidth=2)
 
+    y_top = ax.get_ylim()[1]
+    for i, (c, col) in enumerate(zip(conds, colors)):
+        ci = _ci(boot, 'alpha_fit', 'mean', c)
+        if ci:
+            _ci_errorbar(ax, ci, y_top * (0.8 - 0.05 * i),
+                         tuple(max(0, x * 0.7) for x in col), horizontal=True)
+
     ax.set_xlabel('alpha_fit')
     ax.set_ylabel('Density')
     ax.set_title('Ensemble Filtered alpha Distributions')
     ax.legend()
 
     # KS-test bracket at mean positions
-    a1 = cond_map[conds[0]]['alpha_fit']
-    a2 = cond_map[conds[1]]['alpha_fit']
-    p = ks_2samp(a1, a2).pvalue
+    p = _ks_p(summaries, rows, conds, 'alpha_fit')
     stars = _p_to_asterisks(p)
     y_max = ax.get_ylim()[1]
     y_base = y_max * 0.90
@@ -121,34 +217,29 @@ def compare_conditions(root_dir,
     plt.close(fig)
 
     # ---- Boxplot of replicate median D_fit (linear) ----
-    med_records = []
-    rep_rx = re.compile(r'(.+)_\d+$')
-    for sub in os.listdir(root_dir):
-        m = rep_rx.match(sub)
-        if m:
-            cond = m.group(1)
-            path = os.path.join(root_dir, sub, 'msd_results.csv')
-            if os.path.isfile(path):
-                dfr = pd.read_csv(path, usecols=['D_fit'])
-                dfr = dfr.query('D_fit>=@filter_D_min & D_fit<=@filter_D_max')
-                med_records.append({'condition': cond,
-                                    'median_D': dfr['D_fit'].median()})
-    med_df = pd.DataFrame(med_records)
+    med_df = pd.DataFrame([
+        {'condition': c, 'replicate': r, 'median_D': m}
+        for c in sorted(conds)
+        for r, m in zip(summaries[c]['replicates'], summaries[c].get('median_D', []))
+    ], columns=['condition', 'replicate', 'median_D']).dropna()
 
     fig, ax = plt.subplots(figsize=(8, 6))
     sns.boxplot(x='condition', y='median_D', data=med_df, ax=ax,
                 showfliers=False, palette=colors)
     sns.stripplot(x='condition', y='median_D', data=med_df,
                   color='black', size=6, jitter=True, ax=ax)
+    # condition-level median with its bootstrap CI, beside each box
+    for x, tick in enumerate(ax.get_xticklabels()):
+        ci = _ci(boot, 'D_fit', 'median', tick.get_text())
+        if ci:
+            _ci_errorbar(ax, ci, x + 0.3, 'firebrick', horizontal=False)
     ax.set_xlabel('Condition')
     ax.set_ylabel('Median D_fit (μm²/s)')
     ax.set_title('Replicate Median D_fit by Condition')
 
     # Mann–Whitney U test bracket
     # KS‐test on the full pooled D_fit (so box‐plot reflects distribution significance)
-    d1 = cond_map[conds[0]]['D_fit']
-    d2 = cond_map[conds[1]]['D_fit']
-    p = ks_2samp(d1, d2).pvalue
+    p = _ks_p(summaries, rows, conds, 'D_fit')
     stars = _p_to_asterisks(p)
     y_max = med_df['median_D'].max()
     y_base = y_max * 1.05
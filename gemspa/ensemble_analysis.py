@@ -3,59 +3,142 @@
 ensemble_analysis.py
 
 Optimized ensemble grouping and filtering for replicate MSD results.
-Parallelized per-condition processing for speed.
+Parallelized per-condition processing for speed. Track results are
+queried from the columnar results store (see results_store.py); ensemble
+MSD curves are merged from the replicates' ensemble_msd statistics (see
+ensemble_msd.py).
+
+Runs are incremental per condition: a condition's manifest.json keys its
+outputs on its replicates' partitions and MSD statistics (plus the
+filters), so adding or rerunning a replicate only regroups its own
+condition. Per-replicate summaries (ensemble_summary.py) are built here
+for the comparison stage.
 """
 import os
 import re
 import pandas as pd
 from joblib import Parallel, delayed
-from .trajectory_analysis import trajectory_analysis
+from .plot_queue import plot_queue, results_plot_jobs, render_plot_jobs
+from .results_store import (
+    read_results, list_partitions, backfill_results, filter_bounds, write_query,
+    RESULTS_STORE_NAME, RESULTS_QUERY_NAME
+)
+from .ensemble_summary import condition_summary, replicate_means
+from .run_manifest import run_manifest, params_key, MANIFEST_NAME
+from .ensemble_msd import (
+    load_msd_stats, merge_msd_stats, filtered_msd_stats, save_msd_stats,
+    truncate_msd_stats, write_ensemble_msd, ENSEMBLE_MSD_DIR
+)
 
 
 def _process_condition(cond_dirs_tuple, root_dir,
                        filter_D_min, filter_D_max,
-                       filter_alpha_min, filter_alpha_max):
+                       filter_alpha_min, filter_alpha_max,
+                       plot_mode='inline', export_csv=True):
     cond, dirs = cond_dirs_tuple
-    # Load and concatenate raw results with minimal columns
-    paths = [os.path.join(d, 'msd_results.csv') for d in dirs]
-    dfs = [pd.read_csv(p, usecols=['track_id','D_fit','alpha_fit'])
-           for p in paths if os.path.isfile(p)]
-    if not dfs:
-        return
-    raw_ens = pd.concat(dfs, ignore_index=True)
-
-    # Write raw ensemble
+    store = os.path.join(root_dir, RESULTS_STORE_NAME)
+    reps = [os.path.basename(d) for d in dirs]
+    if not any(rep in reps for rep in list_partitions(store)):
+        return []
+
+    # Raw and filtered ensembles are queries on the results store; their
+    # plot jobs read results_query.json, msd_results.csv is a (default) export
     out_raw = os.path.join(root_dir, cond, 'grouped_raw')
-    os.makedirs(out_raw, exist_ok=True)
-    raw_ens.to_csv(os.path.join(out_raw, 'msd_results.csv'), index=False)
-    # Plot raw ensemble
-    ta = trajectory_analysis.__new__(trajectory_analysis)
-    ta.results_df = raw_ens
-    ta.condition = cond
-    ta.results_dir = out_raw
-    ta.results_df = raw_ens
-    ta.make_plot()
-    ta.make_scatter()
-
-    # Filter and write filtered ensemble
-    filt = raw_ens.query(
-        'D_fit >= @filter_D_min and D_fit <= @filter_D_max and '
-        'alpha_fit >= @filter_alpha_min and alpha_fit <= @filter_alpha_max'
-    )
     out_filt = os.path.join(root_dir, cond, 'grouped_filtered')
-    os.makedirs(out_filt, exist_ok=True)
-    filt.to_csv(os.path.join(out_filt, 'msd_results.csv'), index=False)
-    # Plot filtered
-    ta.results_df = filt
-    ta.results_dir = out_filt
-    ta.results_df = raw_ens
-    ta.make_plot()
-    ta.make_scatter()
+    bounds = filter_bounds(filter_D_min, filter_D_max, filter_alpha_min, filter_alpha_max)
+    for out_dir, out_bounds in ((out_raw, None), (out_filt, bounds)):
+        os.makedirs(out_dir, exist_ok=True)
+        write_query(out_dir, store, cond, reps, out_bounds)
+        if export_csv:
+            ens = read_results(store, conditions=[cond], replicates=reps, bounds=out_bounds)
+            ens[['track_id', 'D_fit', 'alpha_fit']].to_csv(
+                os.path.join(out_dir, 'msd_results.csv'), index=False)
+
+    # Merge ensemble MSD statistics: raw sums in O(lags) per replicate,
+    # filtered sums from the per-track rows that pass the bounds
+    raw_msd, filt_msd = _merge_condition_msd(
+        cond, dirs, filter_D_min, filter_D_max, filter_alpha_min, filter_alpha_max)
+
+    # Queue raw and filtered plots (drawn here for plot_mode 'inline')
+    jobs = []
+    for out_dir, msd_stats in ((out_raw, raw_msd), (out_filt, filt_msd)):
+        queue = plot_queue(out_dir)
+        results_plot_jobs(queue, os.path.join(out_dir, RESULTS_QUERY_NAME), cond)
+        if msd_stats is not None:
+            save_msd_stats(os.path.join(out_dir, 'ensemble_msd_stats.npz'), msd_stats)
+            write_ensemble_msd(out_dir, msd_stats, queue, cond,
+                               prefix='ensemble_', suffix=f'_{cond}')
+        queue.save()
+        jobs += queue.resolved()
+    if plot_mode == 'inline':
+        render_plot_jobs(jobs)
+
+    # Per-replicate summaries for compare_conditions (cached in the store)
+    summary = condition_summary(store, reps, bounds)
+    pd.DataFrame({
+        'replicate':  summary['replicates'],
+        'n_raw':      summary.get('n_raw', []),
+        'n_filtered': summary.get('n_filt', []),
+        'median_D':   summary.get('median_D', []),
+        'mean_D':     replicate_means(summary, 'D_fit'),
+        'mean_alpha': replicate_means(summary, 'alpha_fit'),
+    }).to_csv(os.path.join(out_filt, 'replicate_summary.csv'), index=False)
+    return jobs
+
+
+def _merge_condition_msd(cond, dirs, filter_D_min, filter_D_max,
+                         filter_alpha_min, filter_alpha_max):
+    """
+    Raw and filtered ensemble MSD statistics of a condition's replicates.
+    Replicates analysed with different MSD lag counts are pooled over the
+    lags they share; different time steps leave the condition without
+    pooled curves (None, None) instead of failing the whole ensemble.
+    """
+    raw, filt = [], []
+    for d in dirs:
+        msd_dir = os.path.join(d, ENSEMBLE_MSD_DIR)
+        if not os.path.isfile(os.path.join(msd_dir, 'stats.npz')):
+            continue
+        raw.append(load_msd_stats(os.path.join(msd_dir, 'stats.npz')))
+        filt.append(filtered_msd_stats(
+            msd_dir, filter_D_min, filter_D_max, filter_alpha_min, filter_alpha_max))
+    if not raw:
+        return None, None
+    n_lags = min(s['tamsd_sum'].size for s in raw)
+    if any(s['tamsd_sum'].size != n_lags for s in raw):
+        print(f"[ensemble] {cond}: replicates have different MSD lag counts; "
+              f"pooling tamsd/eamsd over the first {n_lags} lags")
+        raw = [truncate_msd_stats(s, n_lags) for s in raw]
+        filt = [truncate_msd_stats(s, n_lags) for s in filt]
+    raw_msd = filt_msd = None
+    try:
+        for r, f in zip(raw, filt):
+            raw_msd = merge_msd_stats(raw_msd, r)
+            filt_msd = merge_msd_stats(filt_msd, f)
+    except ValueError as e:
+        print(f"[ensemble] {cond}: {e}; skipping pooled tamsd/eamsd "
+              f"(rerun the condition's replicates with the same settings)")
+        return None, None
+    return raw_msd, filt_msd
+
+
+def _condition_key(root_dir, dirs, filters, export_csv):
+    """Hash of a condition's inputs: its replicates' results partitions and MSD statistics."""
+    store = os.path.join(root_dir, RESULTS_STORE_NAME)
+    stamps = []
+    for d in sorted(dirs):
+        rep = os.path.basename(d)
+        files = (os.path.join(store, rep, 'meta.json'),
+                 os.path.join(d, ENSEMBLE_MSD_DIR, 'stats.npz'))
+        stamps.append((rep, [os.stat(f).st_mtime_ns if os.path.isfile(f) else None
+                             for f in files]))
+    return params_key(stamps, filters, export_csv)
 
 
 def run_ensemble(root_dir,
                  filter_D_min=0.0, filter_D_max=float('inf'),
-                 filter_alpha_min=0.0, filter_alpha_max=float('inf')):
+                 filter_alpha_min=0.0, filter_alpha_max=float('inf'),
+                 n_jobs=-1, plot_mode='inline', export_csv=True, force=False):
     """
     Parallel grouping and filtering of replicate MSD results by condition.
 
@@ -67,7 +150,24 @@ def run_ensemble(root_dir,
         Bounds for Diffusion coefficient filtering applied to filtered ensemble.
     filter_alpha_min, filter_alpha_max : float
         Bounds for alpha filtering applied to filtered ensemble.
+    n_jobs : int
+        Processes for per-condition work (-1: all cores).
+    plot_mode : str
+        'inline' draws the ensemble plots in the workers; 'deferred' only
+        spools them (plot_jobs.json) for a plot_renderer.
+    export_csv : bool
+        Write grouped_raw/ and grouped_filtered/msd_results.csv (False:
+        results_query.json only; existing CSVs are left in place).
+    force : bool
+        Regroup every condition, not only those whose replicates changed.
+
+    Returns
+    -------
+    list of plot jobs queued by the regrouped conditions, with absolute paths.
     """
+    # Partitions for replicates analysed without a results store
+    backfill_results(root_dir)
+
     # Build condition-to-replicate map
     cond_map = {}
     for sub in os.listdir(root_dir):
@@ -75,10 +175,26 @@ def run_ensemble(root_dir,
         if os.path.isdir(path) and re.match(r'.+_[0-9]+$', sub):
             cond = re.sub(r'_[0-9]+$', '', sub)
             cond_map.setdefault(cond, []).append(path)
+    # Only conditions whose replicates changed since their last grouping
+    filters = [filter_D_min, filter_D_max, filter_alpha_min, filter_alpha_max]
+    todo = {}
+    for cond, dirs in cond_map.items():
+        key = _condition_key(root_dir, dirs, filters, export_csv)
+        manifest = run_manifest(os.path.join(root_dir, cond, MANIFEST_NAME))
+        if force or not manifest.is_current('ensemble', key):
+            todo[cond] = (dirs, key)
+
     # Parallel processing
-    Parallel(n_jobs=-1)(
-        delayed(_process_condition)(item, root_dir,
+    jobs = Parallel(n_jobs=n_jobs)(
+        delayed(_process_condition)((cond, dirs), root_dir,
                                     filter_D_min, filter_D_max,
-                                    filter_alpha_min, filter_alpha_max)
-        for item in cond_map.items()
+                                    filter_alpha_min, filter_alpha_max,
+                                    plot_mode, export_csv)
+        for cond, (dirs, _) in todo.items()
     )
+    for cond, (_, key) in todo.items():
+        out = [os.path.join(g, f) for g in ('grouped_raw', 'grouped_filtered')
+               for f in (RESULTS_QUERY_NAME, 'msd_results.csv')]
+        run_manifest(os.path.join(root_dir, cond, MANIFEST_NAME)).record(
+            'ensemble', key, out + [os.path.join('grouped_filtered', 'replicate_summary.csv')])
+    return [job for cond_jobs in jobs for job in cond_jobs]
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+ensemble_msd.py
+
+Mergeable ensemble MSD curves. Two per-lag averages over tracks are kept:
+    tamsd  mean of each track's time-averaged MSD (msd_batch rows)
+    eamsd  ensemble-averaged MSD, <|r(t0 + lag) - r(t0)|^2> from each
+           track's first frame
+as sufficient statistics (sum, sum of squares, count per lag), which add
+across batches, replicates and conditions in O(lags).
+
+Each replicate writes <replicate>/ensemble_msd/: stats.npz with the sums
+and the per-track rows behind them (tamsd.bin, eamsd.bin: n_tracks x
+n_lags float64, NaN past track length; D_fit.bin, alpha_fit.bin) in
+msd_results.csv order. run_ensemble sums stats.npz for the raw ensemble
+and re-sums only the rows of tracks within the D/alpha bounds for the
+filtered one; neither re-reads trajectories. The merged curves are fitted
+to MSD = 4*D*t^alpha like single tracks.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+ENSEMBLE_MSD_DIR = 'ensemble_msd'
+ENSEMBLE_MSD_VERSION = 1
+CURVES = ('tamsd', 'eamsd')
+_ROW_FILES = ('tamsd', 'eamsd', 'D_fit', 'alpha_fit')
+
+
+def eamsd_rows(x, y, offsets, n_lags):
+    """
+    (n_tracks x n_lags) squared displacements from each track's first
+    point, NaN where the track is too short; positions CSR-indexed.
+    """
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    lags = np.arange(1, n_lags + 1)
+    valid = lags[None, :] < lengths[:, None]
+    idx = np.where(valid, starts[:, None] + lags[None, :], starts[:, None])
+    dx = x[idx] - x[starts][:, None]
+    dy = y[idx] - y[starts][:, None]
+    return np.where(valid, dx * dx + dy * dy, np.nan)
+
+
+def empty_msd_stats(n_lags, time_step, tlag_cutoff):
+    stats = {'n_tracks': np.int64(0), 'time_step': np.float64(time_step),
+             'tlag_cutoff': np.int64(tlag_cutoff)}
+    for c in CURVES:
+        stats[f'{c}_sum'] = np.zeros(n_lags)
+        stats[f'{c}_sumsq'] = np.zeros(n_lags)
+        stats[f'{c}_count'] = np.zeros(n_lags, dtype=np.int64)
+    return stats
+
+
+def add_rows(stats, tamsd, eamsd):
+    """Add per-track curve rows (NaN = no data) to the sufficient statistics."""
+    for c, rows in zip(CURVES, (tamsd, eamsd)):
+        ok = ~np.isnan(rows)
+        vals = np.where(ok, rows, 0.0)
+        stats[f'{c}_sum'] += vals.sum(axis=0)
+        stats[f'{c}_sumsq'] += (vals * vals).sum(axis=0)
+        stats[f'{c}_count'] += ok.sum(axis=0)
+    stats['n_tracks'] += len(tamsd)
+    return stats
+
+
+def merge_msd_stats(a, b):
+    """
+    Sum of two statistics. Raises ValueError unless both share a lag axis:
+    the same time_step and number of lags.
+    """
+    if a is None:
+        return b
+    if not np.isclose(a['time_step'], b['time_step'], rtol=1e-9, atol=0.0):
+        raise ValueError(f"cannot merge ensemble MSD statistics with time steps "
+                         f"{float(a['time_step'])} and {float(b['time_step'])}")
+    if a['tamsd_sum'].size != b['tamsd_sum'].size:
+        raise ValueError(f"cannot merge ensemble MSD statistics with {a['tamsd_sum'].size} "
+                         f"and {b['tamsd_sum'].size} lags")
+    out = dict(a, n_tracks=a['n_tracks'] + b['n_tracks'])
+    for c in CURVES:
+        for part in ('sum', 'sumsq', 'count'):
+            key = f'{c}_{part}'
+            out[key] = a[key] + b[key]
+    return out
+
+
+def truncate_msd_stats(stats, n_lags):
+    """Statistics restricted to their first n_lags lags."""
+    out = dict(stats)
+    for c in CURVES:
+        for part in ('sum', 'sumsq', 'count'):
+            out[f'{c}_{part}'] = stats[f'{c}_{part}'][:n_lags]
+    return out
+
+
+class msd_accumulator:
+    """
+    Statistics and per-track rows of one replicate, written batch by batch
+    to <path>/; stats.npz is written on close. Use as a context manager.
+    """
+
+    def __init__(self, path, n_lags, time_step, tlag_cutoff):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.stats = empty_msd_stats(n_lags, time_step, tlag_cutoff)
+        self.files = {name: open(os.path.join(path, f'{name}.bin'), 'wb')
+                      for name in _ROW_FILES}
+
+    def add(self, tamsd, eamsd, D, alpha):
+        """Add one batch of tracks: curve rows and their fitted D/alpha."""
+        add_rows(self.stats, tamsd, eamsd)
+        for name, arr in zip(_ROW_FILES, (tamsd, eamsd, D, alpha)):
+            np.ascontiguousarray(arr, dtype='<f8').tofile(self.files[name])
+
+    def close(self):
+        for fh in self.files.values():
+            fh.close()
+        save_msd_stats(os.path.join(self.path, 'stats.npz'), self.stats)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_msd_stats(path, stats):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, version=ENSEMBLE_MSD_VERSION, **stats)
+
+
+def load_msd_stats(path):
+    with np.load(path) as z:
+        if int(z['version']) != ENSEMBLE_MSD_VERSION:
+            raise ValueError(f"Unsupported ensemble MSD version in {path}")
+        return {k: z[k] for k in z.files if k != 'version'}
+
+
+def filtered_msd_stats(rep_dir, filter_D_min, filter_D_max,
+                       filter_alpha_min, filter_alpha_max):
+    """Statistics of a replicate's tracks within the D/alpha bounds, from its per-track rows."""
+    stats = load_msd_stats(os.path.join(rep_dir, 'stats.npz'))
+    n, n_lags = int(stats['n_tracks']), stats['tamsd_sum'].size
+    out = empty_msd_stats(n_lags, stats['time_step'], stats['tlag_cutoff'])
+    if n == 0:
+        return out
+    rows = {}
+    for name in _ROW_FILES:
+        shape = (n, n_lags) if name in CURVES else (n,)
+        rows[name] = np.memmap(os.path.join(rep_dir, f'{name}.bin'), dtype='<f8',
+                               mode='r', shape=shape)
+    D, a = rows['D_fit'], rows['alpha_fit']
+    keep = (D >= filter_D_min) & (D <= filter_D_max) & \
+           (a >= filter_alpha_min) & (a <= filter_alpha_max)
+    return add_rows(out, rows['tamsd'][keep], rows['eamsd'][keep])
+
+
+def msd_table(stats):
+    """Per-lag mean, SEM and track count of both curves."""
+    n_lags = stats['tamsd_sum'].size
+    table = {'tau': np.arange(1, n_lags + 1) * float(stats['time_step'])}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for c in CURVES:
+            n = stats[f'{c}_count']
+            mean = stats[f'{c}_sum'] / n
+            var = np.clip(stats[f'{c}_sumsq'] / n - mean**2, 0.0, None)
+            table[c] = mean
+            table[f'{c}_sem'] = np.sqrt(var / n)
+            table[f'{c}_n'] = n
+    return pd.DataFrame(table)
+
+
+def fit_curves(table, tlag_cutoff):
+    """
+    Fit MSD = 4*D*t^alpha to the mean curves over their first tlag_cutoff
+    lags (tau starts at one frame). Returns (fit DataFrame, fitted curves).
+    """
+    from .msd_diffusion import msd_diffusion
+    time_step = float(table['tau'].iloc[0])
+    n_fit = min(int(tlag_cutoff), len(table))
+    rows, curves = [], {}
+    for c in CURVES:
+        y = table[c].to_numpy()[:n_fit]
+        D = alpha = r2 = np.nan
+        if n_fit >= 2 and np.isfinite(y).all():
+            D, alpha, r2 = (v[0] for v in msd_diffusion().fit_msd_batch(
+                np.ascontiguousarray(y[None, :]), time_step))
+        rows.append({'curve': c, 'D_fit': D, 'alpha_fit': alpha, 'r2_fit': r2,
+                     'lags_fitted': n_fit})
+        curves[f'{c}_fit'] = 4 * D * np.power(table['tau'].to_numpy(), alpha)
+    return pd.DataFrame(rows), curves
+
+
+def write_ensemble_msd(out_dir, stats, queue, condition, prefix='', suffix=''):
+    """
+    Write <prefix>msd_vs_tau.csv (curves, SEMs, counts and fitted curves)
+    and <prefix>msd_fit.csv (D/alpha of each mean curve) to out_dir, and
+    queue the linear and log-log plots on `queue`. Returns the fit table.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    table = msd_table(stats)
+    fits, curves = fit_curves(table, stats['tlag_cutoff'])
+    for name, vals in curves.items():
+        table[name] = vals
+    data_file = os.path.join(out_dir, f'{prefix}msd_vs_tau.csv')
+    table.to_csv(data_file, index=False)
+    fits.insert(0, 'condition', condition)
+    fits.to_csv(os.path.join(out_dir, f'{prefix}msd_fit.csv'), index=False)
+    for loglog, tag in ((False, ''), (True, '_loglog')):
+        queue.add('msd_vs_tau', data_file,
+                  os.path.join(out_dir, f'{prefix}msd_vs_tau{tag}{suffix}.png'),
+                  condition=condition, loglog=loglog)
+    return fits
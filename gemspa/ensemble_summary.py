@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+ensemble_summary.py
+
+Per-replicate summaries of the fitted tracks, so the ensemble and
+comparison stages cost what changed, not the total track count. For one
+set of D/alpha filter bounds a replicate's summary holds
+    n_raw, n_filt           tracks before / within the bounds
+    median_D                median D_fit within the D bounds (boxplot)
+    D_*, alpha_*            counts, sums and sums of squares of the filtered
+                            tracks on fixed grids - log10 D in steps of 0.01
+                            decades, alpha in steps of 0.01 - plus an
+                            underflow and an overflow bin, and their range
+It is cached in the replicate's results store partition as
+summary_<bounds key>.npz; the partition is replaced whenever the replicate
+is rerun, which drops the cache with it.
+
+A condition summary stacks its replicates' summaries. Sums over the grid
+give histograms, means and medians, two-sample KS statistics on the grid
+CDFs, and the per-replicate bins that bootstrap.bootstrap_binned resamples.
+"""
+import os
+import hashlib
+import numpy as np
+
+from .run_manifest import params_key
+from .step_store import read_step_store, read_store_meta
+from .results_store import list_partitions
+
+SUMMARY_VERSION = 1
+QUANTITIES = ('D_fit', 'alpha_fit')
+
+# fixed bin edges: D (um^2/s) log-spaced over 1e-6..1e3, alpha linear over -1..4
+GRID_EDGES = {
+    'D_fit':     10.0 ** np.round(np.linspace(-6.0, 3.0, 901), 2),
+    'alpha_fit': np.round(np.linspace(-1.0, 4.0, 501), 2),
+}
+
+
+def _binned(values, edges):
+    """Counts, sums and sums of squares in [under, grid bins..., over]."""
+    idx = np.searchsorted(edges, values, side='right')
+    n = edges.size + 1
+    return (np.bincount(idx, minlength=n),
+            np.bincount(idx, weights=values, minlength=n),
+            np.bincount(idx, weights=values * values, minlength=n))
+
+
+def summarise(D, alpha, bounds):
+    """Summary (see module docstring) of per-track D_fit / alpha_fit arrays."""
+    (d_lo, d_hi), (a_lo, a_hi) = bounds['D_fit'], bounds['alpha_fit']
+    in_D = (D >= d_lo) & (D <= d_hi)
+    filt = in_D & (alpha >= a_lo) & (alpha <= a_hi)
+    out = {
+        'n_raw':    np.int64(D.size),
+        'n_filt':   np.int64(filt.sum()),
+        'median_D': np.median(D[in_D]) if in_D.any() else np.nan,
+    }
+    for col, v in (('D_fit', D[filt]), ('alpha_fit', alpha[filt])):
+        counts, sums, sumsq = _binned(v, GRID_EDGES[col])
+        out[f'{col}_counts'] = counts
+        out[f'{col}_sums'] = sums
+        out[f'{col}_sumsq'] = sumsq
+        out[f'{col}_range'] = np.array([v.min(), v.max()]) if v.size else np.full(2, np.nan)
+    return out
+
+
+def replicate_summary(part_path, bounds):
+    """Summary of a results store partition for filter `bounds`, cached in the partition."""
+    key = params_key(SUMMARY_VERSION, {k: [float(v) for v in b] for k, b in bounds.items()})
+    path = os.path.join(part_path, f'summary_{key[:12]}.npz')
+    if os.path.isfile(path) and \
+            os.path.getmtime(path) >= os.path.getmtime(os.path.join(part_path, 'meta.json')):
+        with np.load(path) as z:
+            return dict(z)
+    if read_store_meta(part_path)['rows']:
+        data = read_step_store(part_path, columns=list(QUANTITIES))
+        out = summarise(data['D_fit'].to_numpy(), data['alpha_fit'].to_numpy(), bounds)
+    else:
+        out = summarise(np.empty(0), np.empty(0), bounds)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fh:
+        np.savez(fh, **out)
+    os.replace(tmp, path)
+    return out
+
+
+def condition_summary(store, replicates, bounds):
+    """
+    Summaries of the condition's replicates with a partition in `store`,
+    stacked in sorted replicate order (field -> R x ... array), plus
+    'replicates' and a content 'key'.
+    """
+    parts = list_partitions(store)
+    reps = [r for r in sorted(replicates) if r in parts]
+    rows = [replicate_summary(parts[r], bounds) for r in reps]
+    out = {k: np.stack([row[k] for row in rows]) for k in (rows[0] if rows else {})}
+    sha = hashlib.sha1(params_key(reps, bounds).encode('utf-8'))
+    for k in sorted(out):
+        sha.update(np.ascontiguousarray(out[k]).tobytes())
+    out['replicates'] = np.array(reps, dtype=str)
+    out['key'] = sha.hexdigest()
+    return out
+
+
+def value_edges(summary, col):
+    """Edges of the grid bins with the under/overflow bins closed at the data range."""
+    grid = GRID_EDGES[col]
+    rng = summary[f'{col}_range']
+    lo = np.nanmin(rng[:, 0], initial=grid[0]) if rng.size else grid[0]
+    hi = np.nanmax(rng[:, 1], initial=grid[-1]) if rng.size else grid[-1]
+    return np.concatenate([[min(lo, grid[0])], grid, [max(hi, grid[-1])]])
+
+
+def pooled_counts(summary, col):
+    """Condition-wide counts over [under, grid bins..., over]."""
+    return summary[f'{col}_counts'].sum(axis=0)
+
+
+def pooled_mean(summary, col):
+    n = summary[f'{col}_counts'].sum()
+    return summary[f'{col}_sums'].sum() / n if n else np.nan
+
+
+def replicate_means(summary, col):
+    """Mean of the filtered values per replicate (NaN where none passed)."""
+    if f'{col}_counts' not in summary:
+        return np.empty(0)
+    n = summary[f'{col}_counts'].sum(axis=1)
+    return np.divide(summary[f'{col}_sums'].sum(axis=1), n,
+                     out=np.full(n.shape, np.nan), where=n > 0)
+
+
+def binned_ks(counts_a, counts_b):
+    """
+    Two-sample KS statistic on the grid CDFs and its p-value from the
+    asymptotic distribution of ks_2samp (kstwo at the effective sample size).
+    """
+    from scipy.stats import kstwo
+    n_a, n_b = counts_a.sum(), counts_b.sum()
+    if not (n_a and n_b):
+        return np.nan, np.nan
+    d = np.abs(np.cumsum(counts_a) / n_a - np.cumsum(counts_b) / n_b).max()
+    return d, kstwo.sf(d, np.round(n_a * n_b / (n_a + n_b)))
+
+
+def rebin(edges, counts, factor, lo=None, hi=None):
+    """Grid bins merged `factor` at a time, restricted to [lo, hi]: (edges, counts)."""
+    n = (counts.size // factor) * factor
+    merged = counts[:n].reshape(-1, factor).sum(axis=1)
+    edges = edges[:n + 1:factor]
+    keep = np.ones(merged.size, dtype=bool)
+    if lo is not None:
+        keep &= edges[1:] > lo
+    if hi is not None:
+        keep &= edges[:-1] < hi
+    idx = np.flatnonzero(keep)
+    if not idx.size:
+        return edges[:1], merged[:0]
+    return edges[idx[0]:idx[-1] + 2], merged[idx[0]:idx[-1] + 1]
+
+
+def condition_bootstrap(summary, cond, columns=QUANTITIES, n_boot=10000, n_bins=128, seed=0,
+                        cache_path=None):
+    """
+    Hierarchical bootstrap of one condition from its summary, as the
+    {(column, stat): (distribution, estimate, n_replicates, n_tracks)} input
+    of bootstrap.ci_table. Estimates are the binned median and exact mean.
+    With cache_path the distributions are kept in an .npz keyed by the
+    summary, so unchanged conditions are not resampled again.
+    """
+    from .bootstrap import coarsen_bins, bootstrap_binned, condition_seed, _median_from_counts
+    key = params_key(summary['key'], list(columns), n_boot, n_bins, seed)
+    cached = {}
+    if cache_path and os.path.isfile(cache_path):
+        with np.load(cache_path) as z:
+            if str(z['key']) == key:
+                cached = {k: z[k] for k in z.files if k != 'key'}
+    results, dists = {}, {}
+    for qi, col in enumerate(columns):
+        if col not in QUANTITIES or f'{col}_counts' not in summary:
+            continue
+        counts = summary[f'{col}_counts'].astype(np.int64)
+        n_tracks = int(counts.sum())
+        if not n_tracks:
+            continue
+        edges = value_edges(summary, col)
+        estimate = {'median': float(_median_from_counts(counts.sum(axis=0)[None], edges)[0]),
+                    'mean':   float(pooled_mean(summary, col))}
+        if f'{col}_median' in cached:
+            dist = {stat: cached[f'{col}_{stat}'] for stat in estimate}
+        else:
+            dist = bootstrap_binned(*coarsen_bins(edges, counts, summary[f'{col}_sums'],
+                                                  summary[f'{col}_sumsq'], n_bins),
+                                    n_boot=n_boot, seed=condition_seed(seed, cond, qi))
+        n_reps = int((counts.sum(axis=1) > 0).sum())
+        for stat in estimate:
+            results[(col, stat)] = (dist[stat], estimate[stat], n_reps, n_tracks)
+            dists[f'{col}_{stat}'] = dist[stat]
+    if cache_path and not cached:
+        np.savez(cache_path, key=key, **dists)
+    return results
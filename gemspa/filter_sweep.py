@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+filter_sweep.py
+
+Filter-bound sweeps without rerunning the ensemble. Each condition's
+tracks are indexed once, from the results store, as D_fit sorted ascending
+with alpha_fit and the replicate alongside (<condition>/filter_index.npz,
+rebuilt only when one of its partitions changes). A D range is then a
+contiguous slice found by binary search, and the alpha bounds a mask on
+that slice. Every bound combination of the sweep grid is answered from the
+index:
+    filter_sweep.csv        per bounds and condition: tracks kept (and the
+                            fraction of all tracks), replicates, median and
+                            mean D / alpha, mean and SD of replicate medians
+    filter_sweep_ks.csv     per bounds and pair of conditions: two-sample KS
+                            statistics and p-values of D and alpha
+    filter_sweep_hist.csv   per bounds and condition: non-empty histogram
+                            bins (log10 D in 0.05 decades, alpha in 0.05)
+in <work_dir>/comparison/.
+"""
+import os
+import itertools
+import numpy as np
+import pandas as pd
+
+from .run_manifest import params_key
+from .results_store import list_partitions, read_results, RESULTS_STORE_NAME
+from .step_store import read_store_meta
+from .ensemble_summary import GRID_EDGES
+
+FILTER_INDEX_NAME = 'filter_index.npz'
+SWEEP_TABLE_NAME = 'filter_sweep.csv'
+SWEEP_KS_NAME = 'filter_sweep_ks.csv'
+SWEEP_HIST_NAME = 'filter_sweep_hist.csv'
+BOUND_NAMES = ('filter_D_min', 'filter_D_max', 'filter_alpha_min', 'filter_alpha_max')
+
+
+def store_conditions(store):
+    """Condition -> replicates with a non-empty partition in the results store."""
+    conds = {}
+    for rep, path in list_partitions(store).items():
+        meta = read_store_meta(path)
+        if meta['rows']:
+            conds.setdefault(meta['categories']['group'][0], []).append(rep)
+    return conds
+
+
+class filter_index:
+    """One condition's tracks sorted by D_fit, with alpha_fit and replicate codes alongside."""
+
+    def __init__(self, D, alpha, rep, replicates):
+        self.D, self.alpha, self.rep = D, alpha, rep
+        self.replicates = list(replicates)
+
+    @classmethod
+    def build(cls, store, cond, replicates):
+        df = read_results(store, ('D_fit', 'alpha_fit'), conditions=[cond],
+                          replicates=replicates)
+        D = df['D_fit'].to_numpy(dtype=np.float64)
+        ok = ~np.isnan(D)
+        order = np.argsort(D[ok], kind='stable')
+        codes = df['replicate'].cat.codes.to_numpy()[ok][order].astype(np.int32)
+        return cls(D[ok][order], df['alpha_fit'].to_numpy(dtype=np.float64)[ok][order],
+                   codes, df['replicate'].cat.categories.astype(str))
+
+    @classmethod
+    def cached(cls, root_dir, cond, replicates):
+        """Index of cond, loaded from <cond>/filter_index.npz while its partitions are unchanged."""
+        store = os.path.join(root_dir, RESULTS_STORE_NAME)
+        key = params_key(sorted(
+            (rep, os.stat(os.path.join(store, rep, 'meta.json')).st_mtime_ns)
+            for rep in replicates
+        ))
+        path = os.path.join(root_dir, cond, FILTER_INDEX_NAME)
+        if os.path.isfile(path):
+            with np.load(path) as z:
+                if str(z['key']) == key:
+                    return cls(z['D'], z['alpha'], z['rep'], z['replicates'])
+        index = cls.build(store, cond, replicates)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, key=key, D=index.D, alpha=index.alpha, rep=index.rep,
+                 replicates=np.array(index.replicates, dtype=str))
+        return index
+
+    def select(self, D_min, D_max, alpha_min, alpha_max):
+        """(D, alpha, replicate code) of the tracks within the bounds, D still sorted."""
+        lo = np.searchsorted(self.D, D_min, side='left')
+        hi = np.searchsorted(self.D, D_max, side='right')
+        a = self.alpha[lo:hi]
+        keep = (a >= alpha_min) & (a <= alpha_max)
+        return self.D[lo:hi][keep], a[keep], self.rep[lo:hi][keep]
+
+
+def sweep_grid(D_min, D_max, alpha_min, alpha_max):
+    """Every combination of the bound lists, as filter_* dicts."""
+    return [dict(zip(BOUND_NAMES, combo))
+            for combo in itertools.product(D_min, D_max, alpha_min, alpha_max)]
+
+
+def _replicate_medians(D, rep):
+    """Median D of each replicate present, from D sorted ascending."""
+    order = np.argsort(rep, kind='stable')
+    rep_sorted = rep[order]
+    starts = np.flatnonzero(np.diff(rep_sorted, prepend=-1))
+    ends = np.append(starts[1:], rep_sorted.size)
+    return np.array([np.median(D[order[s:e]]) for s, e in zip(starts, ends)])
+
+
+def _hist_rows(values, col, factor=5):
+    edges = GRID_EDGES[col][::factor]
+    counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=edges.size + 1)
+    rows = []
+    for i in np.flatnonzero(counts):
+        lo = edges[i - 1] if i > 0 else -np.inf
+        hi = edges[i] if i < edges.size else np.inf
+        rows.append({'quantity': col, 'bin_lo': lo, 'bin_hi': hi, 'count': int(counts[i])})
+    return rows
+
+
+def run_filter_sweep(root_dir, grid, out_dir=None):
+    """
+    Tabulate every bounds dict of `grid` (see sweep_grid) for each condition
+    of the results store, using the cached indexes. Writes the three tables
+    to out_dir (default <root_dir>/comparison) and returns them.
+    """
+    from scipy.stats import ks_2samp
+    store = os.path.join(root_dir, RESULTS_STORE_NAME)
+    conds = store_conditions(store)
+    indexes = {c: filter_index.cached(root_dir, c, reps) for c, reps in sorted(conds.items())}
+
+    rows, ks_rows, hist_rows = [], [], []
+    for combo_id, bounds in enumerate(grid):
+        sel = {}
+        for cond, index in indexes.items():
+            D, alpha, rep = sel[cond] = index.select(*(bounds[k] for k in BOUND_NAMES))
+            rep_med = _replicate_medians(D, rep)
+            rows.append({
+                'combo': combo_id, **bounds, 'condition': cond,
+                'n_tracks':          D.size,
+                'fraction_kept':     D.size / index.D.size if index.D.size else np.nan,
+                'n_replicates':      rep_med.size,
+                'median_D':          np.median(D) if D.size else np.nan,
+                'mean_D':            D.mean() if D.size else np.nan,
+                'median_alpha':      np.median(alpha) if D.size else np.nan,
+                'mean_alpha':        alpha.mean() if D.size else np.nan,
+                'rep_median_D_mean': rep_med.mean() if rep_med.size else np.nan,
+                'rep_median_D_sd':   rep_med.std(ddof=1) if rep_med.size > 1 else np.nan,
+            })
+            for col, values in (('D_fit', D), ('alpha_fit', alpha)):
+                hist_rows += [{'combo': combo_id, 'condition': cond, **r}
+                              for r in _hist_rows(values, col)]
+        names = list(sel)
+        for i, a in enumerate(names):
+            for b in names[i + 1:]:
+                rec = {'combo': combo_id, **bounds, 'condition_a': a, 'condition_b': b}
+                for k, col in ((0, 'D'), (1, 'alpha')):
+                    if sel[a][k].size and sel[b][k].size:
+                        res = ks_2samp(sel[a][k], sel[b][k])
+                        rec[f'ks_{col}'], rec[f'p_{col}'] = res.statistic, res.pvalue
+                    else:
+                        rec[f'ks_{col}'] = rec[f'p_{col}'] = np.nan
+                ks_rows.append(rec)
+
+    out_dir = out_dir or os.path.join(root_dir, 'comparison')
+    os.makedirs(out_dir, exist_ok=True)
+    table = pd.DataFrame(rows)
+    ks = pd.DataFrame(ks_rows, columns=['combo', *BOUND_NAMES, 'condition_a', 'condition_b',
+                                        'ks_D', 'p_D', 'ks_alpha', 'p_alpha'])
+    hist = pd.DataFrame(hist_rows, columns=['combo', 'condition', 'quantity', 'bin_lo',
+                                            'bin_hi', 'count'])
+    table.to_csv(os.path.join(out_dir, SWEEP_TABLE_NAME), index=False)
+    ks.to_csv(os.path.join(out_dir, SWEEP_KS_NAME), index=False)
+    hist.to_csv(os.path.join(out_dir, SWEEP_HIST_NAME), index=False)
+    return table, ks, hist
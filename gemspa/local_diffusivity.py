@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+local_diffusivity.py
+
+Sliding-window D/alpha along trajectories, for tracks that switch between
+mobility states. Every window of `window` consecutive points of a track is
+fitted to MSD = 4*D*t^alpha over lags 1..max_lag by the rolling-sum kernel
+of msd_diffusion.local_diffusivity_batch (O(N * max_lag) per track).
+
+Per replicate:
+    local_D.store            one row per window (group, replicate, track_id,
+                             start_frame, D_local, alpha_local), in the step
+                             store layout
+    local_D_summary.csv      per-track variability of D_local: window count,
+                             mean, median, std, coefficient of variation,
+                             min and max
+Each point is also given the D_local of the window centred on it (clamped
+at the track ends), which draw_rainbow_tracks can use as its colour.
+"""
+import numpy as np
+import pandas as pd
+
+from .msd_diffusion import local_diffusivity_batch, track_offsets
+from .step_store import step_store_writer, ID_DTYPE
+
+LOCAL_STORE_NAME = 'local_D.store'
+LOCAL_SUMMARY_NAME = 'local_D_summary.csv'
+
+LOCAL_COLUMNS = {
+    'group':       '<u2',
+    'replicate':   '<u2',
+    'track_id':    ID_DTYPE,
+    'start_frame': '<i4',
+    'D_local':     '<f8',
+    'alpha_local': '<f8',
+}
+
+
+def local_windows(df, micron_per_px, time_step, window=10, max_lag=3):
+    """
+    Sliding-window fits of df's tracks (track_id, frame, x, y in px).
+    Returns (windows, point_D): a dict of per-window arrays (track_id,
+    start_frame, D_local, alpha_local) and a Series of per-point D_local on
+    df's index, NaN on tracks shorter than `window`.
+    """
+    df = df[['track_id', 'frame', 'x', 'y']].sort_values(['track_id', 'frame'],
+                                                         kind='mergesort')
+    ids = df['track_id'].to_numpy()
+    frames = df['frame'].to_numpy()
+    offsets = track_offsets(ids)
+    x = df['x'].to_numpy(dtype=np.float64) * micron_per_px
+    y = df['y'].to_numpy(dtype=np.float64) * micron_per_px
+    win_offsets, D, alpha = local_diffusivity_batch(x, y, offsets, window, max_lag, time_step)
+
+    # window rows -> first point of each window
+    n_win = np.diff(win_offsets)
+    first = np.repeat(offsets[:-1] - win_offsets[:-1], n_win) + np.arange(D.size)
+    windows = {'track_id': ids[first], 'start_frame': frames[first],
+               'D_local': D, 'alpha_local': alpha}
+
+    # point j of a track -> the window centred on it, clamped to the track
+    lengths = np.diff(offsets)
+    track = np.repeat(np.arange(lengths.size), lengths)
+    j = np.arange(ids.size) - offsets[:-1][track]
+    w = np.clip(j - window // 2, 0, np.maximum(n_win[track] - 1, 0))
+    has = n_win[track] > 0
+    point = np.full(ids.size, np.nan)
+    point[has] = D[win_offsets[:-1][track[has]] + w[has]]
+    return windows, pd.Series(point, index=df.index, name='D_local')
+
+
+def track_summary(windows):
+    """Per-track D_local variability from the per-window arrays of local_windows."""
+    D = pd.Series(windows['D_local'])
+    g = D.groupby(windows['track_id'], sort=False)
+    out = pd.DataFrame({
+        'n_windows':      g.size(),
+        'D_local_mean':   g.mean(),
+        'D_local_median': g.median(),
+        'D_local_std':    g.std(),
+        'D_local_min':    g.min(),
+        'D_local_max':    g.max(),
+    })
+    out.insert(4, 'D_local_cv', out['D_local_std'] / out['D_local_mean'])
+    out.index.name = 'track_id'
+    return out.reset_index()
+
+
+def local_store_writer(path):
+    return step_store_writer(path, columns=LOCAL_COLUMNS)
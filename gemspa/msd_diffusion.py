@@ -6,41 +6,524 @@ Optimized MSD and diffusion analysis routines with Numba JIT and parallelism.
 Also includes step-size & angle export helpers.
 """
 import os
+import time
+import types
 import numpy as np
 import pandas as pd
-from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
-from scipy.stats import kurtosis
-from joblib import Parallel, delayed
-import numba
-from numba import njit, prange
-
-@njit(parallel=True)
-def _msd2d_jit(x, y, max_lag):
-    """Compute MSD for each lag up to max_lag."""
-    n = x.shape[0]
-    msd = np.zeros(max_lag)
-    for lag in prange(1, max_lag + 1):
-        total = 0.0
-        count = 0
-        for i in range(n - lag):
-            dx = x[i + lag] - x[i]
-            dy = y[i + lag] - y[i]
-            total += dx*dx + dy*dy
-            count += 1
-        msd[lag - 1] = total / count if count > 0 else 0.0
+from numba import njit, prange, float64, int64
+
+from .resources import use_parallel
+
+# Kernels are compiled for these explicit signatures and cached on disk
+# (cache=True, next to this file or in NUMBA_CACHE_DIR), so only the first
+# process after an install or code change pays the compile cost. Each is
+# built (or loaded from the cache) on its first call, or by warmup_kernels,
+# not at import: loading machine code brings up Numba's CPU target, which
+# imports scipy.linalg.
+_MSD_SIG = (float64[::1], float64[::1], int64[::1], int64)
+_FIT_SIG = (float64[:, ::1], float64[::1], float64, float64, int64)
+_STEP_COUNT_SIG = (float64[::1], float64[::1], int64[::1], int64)
+_STEP_FILL_SIG = (float64[::1], float64[::1], int64[::1], int64[:, ::1], int64[:, ::1],
+                  float64[:, ::1], float64[:, ::1], float64[:, ::1], float64[:, ::1])
+_LOCAL_SIG = (float64[::1], float64[::1], int64[::1], int64[::1], int64, int64, float64,
+              float64[::1], float64[::1])
+
+
+class _lazy_kernel:
+    """njit(sig, cache=True, **options) of py_func, built on first call."""
+
+    def __init__(self, py_func, sig, options):
+        self.py_func, self.sig, self.options = py_func, sig, options
+        self.__doc__ = py_func.__doc__
+        self._dispatcher = None
+
+    def __call__(self, *args):
+        if self._dispatcher is None:
+            self._dispatcher = njit(self.sig, cache=True, **self.options)(self.py_func)
+        return self._dispatcher(*args)
+
+
+def lazy_njit(sig, **options):
+    """Decorator: a cached kernel for `sig`, compiled or loaded on first call."""
+    return lambda py_func: _lazy_kernel(py_func, sig, options)
+
+
+def _serial_twin(kernel, name, sig):
+    """
+    Serial copy of a parallel kernel for calls too small to amortise the
+    thread pool. It gets its own name so its cache entry is kept separate
+    from the parallel build.
+    """
+    f = kernel.py_func
+    twin = types.FunctionType(f.__code__, f.__globals__, name, f.__defaults__, f.__closure__)
+    twin.__qualname__ = name
+    twin.__doc__ = f.__doc__
+    return lazy_njit(sig)(twin)
+
+
+def track_offsets(track_ids):
+    """
+    CSR-style offsets for a track_id column already sorted by (track_id, frame):
+    track k occupies rows offsets[k]:offsets[k+1].
+    """
+    track_ids = np.asarray(track_ids)
+    if track_ids.size == 0:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.flatnonzero(track_ids[1:] != track_ids[:-1]) + 1
+    return np.concatenate(([0], starts, [track_ids.size])).astype(np.int64)
+
+@lazy_njit(_MSD_SIG, parallel=True)
+def _msd_batch_jit(x, y, offsets, max_lag):
+    """
+    MSD for every track in one pass. Row k holds lags 1..min(max_lag, n_k-1)
+    of track k; unused lags are NaN.
+    """
+    n_tracks = offsets.shape[0] - 1
+    msd = np.full((n_tracks, max_lag), np.nan)
+    for k in prange(n_tracks):
+        start = offsets[k]
+        n = offsets[k + 1] - start
+        for lag in range(1, min(max_lag, n - 1) + 1):
+            total = 0.0
+            for i in range(start, start + n - lag):
+                dx = x[i + lag] - x[i]
+                dy = y[i + lag] - y[i]
+                total += dx*dx + dy*dy
+            msd[k, lag - 1] = total / (n - lag)
     return msd
 
-@njit(parallel=True)
-def _compute_step_sizes_jit(xs, ys):
-    """Compute step sizes between consecutive points."""
-    n = xs.shape[0]
-    steps = np.zeros(n - 1)
-    for i in prange(n - 1):
-        dx = xs[i + 1] - xs[i]
-        dy = ys[i + 1] - ys[i]
-        steps[i] = np.sqrt(dx*dx + dy*dy)
-    return steps
+_msd_batch_serial = _serial_twin(_msd_batch_jit, '_msd_batch_serial', _MSD_SIG)
+
+# Above this many lags the FFT path beats the direct O(N*L) loop
+FFT_LAG_THRESHOLD = 32
+# Bound on padded FFT buffer elements per bucket chunk (float64)
+_FFT_CHUNK_ELEMS = 1 << 22
+
+def _msd_fft_batch(x, y, offsets, max_lag):
+    """
+    Same output as _msd_batch_jit via the FFT/autocorrelation identity
+        MSD(m) = S1(m) - 2*S2(m)
+    with S2 the positional autocorrelation, O(N log N) per track. Tracks are
+    bucketed by padded FFT length so each bucket is one batched rfft call.
+    """
+    n_tracks = offsets.shape[0] - 1
+    msd = np.full((n_tracks, max_lag), np.nan)
+    lengths = np.diff(offsets)
+    lags = np.minimum(max_lag, lengths - 1)
+    active = np.flatnonzero(lags > 0)
+    if active.size == 0:
+        return msd
+    nfft = 1 << np.ceil(np.log2(2 * lengths[active])).astype(np.int64)
+
+    for size in np.unique(nfft):
+        bucket = active[nfft == size]
+        step = max(1, _FFT_CHUNK_ELEMS // int(size))
+        for c in range(0, bucket.size, step):
+            rows = bucket[c:c + step]
+            n = lengths[rows]
+            L = int(lags[rows].max())
+            width = int(n.max())
+            # gather tracks into zero-padded rows, centred for precision
+            idx = offsets[rows][:, None] + np.arange(width)[None, :]
+            valid = np.arange(width)[None, :] < n[:, None]
+            idx = np.where(valid, idx, 0)
+            px = np.where(valid, x[idx], 0.0)
+            py = np.where(valid, y[idx], 0.0)
+            px -= np.where(valid, (px.sum(axis=1) / n)[:, None], 0.0)
+            py -= np.where(valid, (py.sum(axis=1) / n)[:, None], 0.0)
+
+            fx = np.fft.rfft(px, n=int(size), axis=1)
+            fy = np.fft.rfft(py, n=int(size), axis=1)
+            acf = np.fft.irfft(fx * fx.conj() + fy * fy.conj(), n=int(size), axis=1)
+            m = np.arange(1, L + 1)
+            denom = n[:, None] - m[None, :]
+            s2 = acf[:, 1:L + 1]
+
+            # S1(m) = (sum_{i<N-m} r_i^2 + sum_{i>=m} r_i^2) / (N - m)
+            r2 = px * px + py * py
+            csum = np.concatenate((np.zeros((rows.size, 1)), np.cumsum(r2, axis=1)), axis=1)
+            r = np.arange(rows.size)[:, None]
+            tail = np.clip(n[:, None] - m[None, :], 0, width)
+            s1 = csum[r, tail] + csum[r, n[:, None]] - csum[r, np.minimum(m[None, :], width)]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                block = (s1 - 2.0 * s2) / denom
+            block[m[None, :] > lags[rows][:, None]] = np.nan
+            msd[rows, :L] = block
+    return msd
+
+@lazy_njit(_FIT_SIG, parallel=True)
+def _fit_msd_batch_jit(msd, t, D0, alpha0, max_iter):
+    """
+    Fit MSD = 4*D*t^alpha to every row of msd (NaN-padded on the right).
+    Seed from a log-log least-squares line, then refine with bounded
+    Levenberg-Marquardt (D, alpha >= 0) on the linear-space residuals, the
+    same objective curve_fit minimises. ok[k] is False when the row needs
+    the per-track fallback.
+    """
+    n_tracks, n_lags = msd.shape
+    D_out = np.full(n_tracks, np.nan)
+    a_out = np.full(n_tracks, np.nan)
+    r2_out = np.zeros(n_tracks)
+    ok = np.zeros(n_tracks, dtype=np.bool_)
+    logt = np.log(t)
+    for k in prange(n_tracks):
+        n = 0
+        while n < n_lags and not np.isnan(msd[k, n]):
+            n += 1
+        if n < 2:
+            continue
+
+        # closed-form log-log seed
+        D = D0
+        a = alpha0
+        positive = True
+        for i in range(n):
+            if msd[k, i] <= 0.0:
+                positive = False
+                break
+        if positive:
+            sx = 0.0
+            sy = 0.0
+            sxx = 0.0
+            sxy = 0.0
+            for i in range(n):
+                ly = np.log(msd[k, i])
+                sx += logt[i]
+                sy += ly
+                sxx += logt[i] * logt[i]
+                sxy += logt[i] * ly
+            den = n * sxx - sx * sx
+            if den != 0.0:
+                a = max((n * sxy - sx * sy) / den, 0.0)
+                D = np.exp((sy - a * sx) / n) / 4.0
+
+        cost = 0.0
+        for i in range(n):
+            r = msd[k, i] - 4.0 * D * t[i] ** a
+            cost += r * r
+
+        # bounded Levenberg-Marquardt
+        lam = 1e-3
+        converged = False
+        for it in range(max_iter):
+            jdd = 0.0
+            jda = 0.0
+            jaa = 0.0
+            gd = 0.0
+            ga = 0.0
+            for i in range(n):
+                ta = t[i] ** a
+                f = 4.0 * D * ta
+                r = msd[k, i] - f
+                dD = 4.0 * ta
+                da = f * logt[i]
+                jdd += dD * dD
+                jda += dD * da
+                jaa += da * da
+                gd += dD * r
+                ga += da * r
+            # a parameter sitting on its bound with the gradient pushing
+            # outwards is held fixed (active set)
+            fix_D = D <= 0.0 and gd <= 0.0
+            fix_a = a <= 0.0 and ga <= 0.0
+            if fix_D and fix_a:
+                converged = True
+                break
+            accepted = False
+            while lam < 1e12:
+                m11 = jdd * (1.0 + lam)
+                m22 = jaa * (1.0 + lam)
+                if fix_a:
+                    stepD = gd / m11 if m11 > 0.0 else 0.0
+                    stepa = 0.0
+                elif fix_D:
+                    stepD = 0.0
+                    stepa = ga / m22 if m22 > 0.0 else 0.0
+                else:
+                    det = m11 * m22 - jda * jda
+                    if det <= 0.0:
+                        lam *= 10.0
+                        continue
+                    stepD = (m22 * gd - jda * ga) / det
+                    stepa = (m11 * ga - jda * gd) / det
+                Dn = max(D + stepD, 0.0)
+                an = max(a + stepa, 0.0)
+                new_cost = 0.0
+                for i in range(n):
+                    r = msd[k, i] - 4.0 * Dn * t[i] ** an
+                    new_cost += r * r
+                if new_cost <= cost:
+                    accepted = True
+                    break
+                lam *= 10.0
+            if not accepted:
+                # no downhill step at any damping: local minimum
+                converged = True
+                break
+            small = (abs(Dn - D) <= 1e-10 * (abs(D) + 1e-12)
+                     and abs(an - a) <= 1e-10 * (abs(a) + 1e-12))
+            flat = cost - new_cost <= 1e-14 * cost
+            D = Dn
+            a = an
+            cost = new_cost
+            lam = max(lam * 0.1, 1e-12)
+            if small or flat:
+                converged = True
+                break
+
+        if not converged or not np.isfinite(D) or not np.isfinite(a) or D <= 0.0:
+            continue
+
+        mean = 0.0
+        for i in range(n):
+            mean += msd[k, i]
+        mean /= n
+        ss_tot = 0.0
+        for i in range(n):
+            ss_tot += (msd[k, i] - mean) ** 2
+        D_out[k] = D
+        a_out[k] = a
+        r2_out[k] = 1.0 - cost / ss_tot if ss_tot > 0.0 else 0.0
+        ok[k] = True
+    return D_out, a_out, r2_out, ok
+
+_fit_msd_batch_serial = _serial_twin(_fit_msd_batch_jit, '_fit_msd_batch_serial', _FIT_SIG)
+
+@lazy_njit(_STEP_COUNT_SIG, parallel=True)
+def _step_angle_counts_jit(x, y, offsets, max_lag):
+    """
+    Per-track output counts for lags 1..max_lag: steps[k, lag-1] step sizes
+    (n - lag, for lag < n) and angles[k, lag-1] turning angles between
+    consecutive non-overlapping lag displacements (lag <= (n-1)//2), less
+    pairs with a zero-length displacement.
+    """
+    n_tracks = offsets.shape[0] - 1
+    steps = np.zeros((n_tracks, max_lag), dtype=np.int64)
+    angles = np.zeros((n_tracks, max_lag), dtype=np.int64)
+    for k in prange(n_tracks):
+        start = offsets[k]
+        n = offsets[k + 1] - start
+        max_angles = min(max_lag, (n - 1) // 2)
+        for lag in range(1, min(max_lag, n - 1) + 1):
+            steps[k, lag - 1] = n - lag
+            if lag > max_angles:
+                continue
+            c = 0
+            for j in range(0, n - 2 * lag, lag):
+                i = start + j
+                dx1 = x[i + lag] - x[i]
+                dy1 = y[i + lag] - y[i]
+                dx2 = x[i + 2 * lag] - x[i + lag]
+                dy2 = y[i + 2 * lag] - y[i + lag]
+                if np.sqrt(dx1*dx1 + dy1*dy1) == 0 or np.sqrt(dx2*dx2 + dy2*dy2) == 0:
+                    continue
+                c += 1
+            angles[k, lag - 1] = c
+    return steps, angles
+
+@lazy_njit(_STEP_FILL_SIG, parallel=True)
+def _step_angle_fill_jit(x, y, offsets, step_pos, angle_pos,
+                         step_sizes, deltaX, deltaY, angles):
+    """
+    Fill (max_lag x width) step_sizes/deltaX/deltaY and angle cosines in one pass
+    over the tracks; track k writes lag row lag-1 from column step_pos[k, lag-1]
+    (angle_pos for angles), the prefix sums of _step_angle_counts_jit.
+    """
+    max_lag = step_sizes.shape[0]
+    n_tracks = offsets.shape[0] - 1
+    for k in prange(n_tracks):
+        start = offsets[k]
+        n = offsets[k + 1] - start
+        max_angles = min(max_lag, (n - 1) // 2)
+        for lag in range(1, min(max_lag, n - 1) + 1):
+            row = lag - 1
+            p = step_pos[k, row]
+            for i in range(n - lag):
+                dx = x[start + i + lag] - x[start + i]
+                dy = y[start + i + lag] - y[start + i]
+                step_sizes[row, p + i] = np.sqrt(dx*dx + dy*dy)
+                deltaX[row, p + i] = dx
+                deltaY[row, p + i] = dy
+            if lag > max_angles:
+                continue
+            q = angle_pos[k, row]
+            for j in range(0, n - 2 * lag, lag):
+                i = start + j
+                dx1 = x[i + lag] - x[i]
+                dy1 = y[i + lag] - y[i]
+                dx2 = x[i + 2 * lag] - x[i + lag]
+                dy2 = y[i + 2 * lag] - y[i + lag]
+                norm1 = np.sqrt(dx1*dx1 + dy1*dy1)
+                norm2 = np.sqrt(dx2*dx2 + dy2*dy2)
+                if norm1 == 0 or norm2 == 0:
+                    continue
+                cosang = (dx1*dx2 + dy1*dy2) / (norm1 * norm2)
+                # arccos/degrees are applied afterwards with numpy's ufuncs,
+                # whose results differ from libm's acos in the last bit
+                angles[row, q] = min(max(cosang, -1.0), 1.0)
+                q += 1
+
+_step_angle_counts_serial = _serial_twin(
+    _step_angle_counts_jit, '_step_angle_counts_serial', _STEP_COUNT_SIG)
+_step_angle_fill_serial = _serial_twin(
+    _step_angle_fill_jit, '_step_angle_fill_serial', _STEP_FILL_SIG)
+
+def _exclusive_cumsum(counts):
+    """Column-wise exclusive prefix sums: output position of each track per lag."""
+    pos = np.zeros_like(counts)
+    np.cumsum(counts[:-1], axis=0, out=pos[1:])
+    return pos
+
+def step_sizes_angles_batch(x, y, offsets, max_lag, steps_width=None, angles_width=None):
+    """
+    Step sizes, dX, dY (max_lag x steps_width) and turning angles
+    (max_lag x angles_width) for every track of CSR-indexed positions, in the
+    layout of msd_diffusion.step_sizes_and_angles: per lag row, tracks in
+    order, unused cells NaN. Widths default to sum(max(n-1, 0)) and
+    sum(max(n-2, 0)).
+    """
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    if steps_width is None:
+        steps_width = int(np.sum(np.maximum(lengths - 1, 0)))
+    if angles_width is None:
+        angles_width = int(np.sum(np.maximum(lengths - 2, 0)))
+    parallel = use_parallel(x.size * max_lag)
+    count = _step_angle_counts_jit if parallel else _step_angle_counts_serial
+    fill = _step_angle_fill_jit if parallel else _step_angle_fill_serial
+
+    step_counts, angle_counts = count(x, y, offsets, np.int64(max_lag))
+    step_sizes = np.full((max_lag, steps_width), np.nan)
+    deltaX = np.full((max_lag, steps_width), np.nan)
+    deltaY = np.full((max_lag, steps_width), np.nan)
+    angles = np.full((max_lag, angles_width), np.nan)
+    fill(x, y, offsets, _exclusive_cumsum(step_counts), _exclusive_cumsum(angle_counts),
+         step_sizes, deltaX, deltaY, angles)
+    np.degrees(np.arccos(angles, out=angles), out=angles)
+    return step_sizes, deltaX, deltaY, angles
+
+@lazy_njit(_LOCAL_SIG, parallel=True)
+def _local_diffusivity_jit(x, y, offsets, win_pos, window, max_lag, time_step,
+                           D_out, a_out):
+    """
+    Sliding-window D/alpha along each track. The window of `window` points
+    starting at point w has MSD(lag) = mean of |r(i+lag) - r(i)|^2 over
+    w <= i <= w + window - 1 - lag; these per-lag sums roll along the track
+    (one pair added, one dropped per lag and step), O(N * max_lag) per track.
+    Each window is fitted to log MSD = log(4D) + alpha*log(t) over lags
+    1..max_lag in closed form. Track k writes windows from win_pos[k].
+    """
+    n_tracks = offsets.shape[0] - 1
+    # log-time regressors are the same for every window
+    lt = np.empty(max_lag)
+    for l in range(max_lag):
+        lt[l] = np.log((l + 1) * time_step)
+    lt_mean = lt.mean()
+    sxx = 0.0
+    for l in range(max_lag):
+        sxx += (lt[l] - lt_mean) ** 2
+    for k in prange(n_tracks):
+        start = offsets[k]
+        n = offsets[k + 1] - start
+        n_win = n - window + 1
+        if n_win <= 0:
+            continue
+        sums = np.zeros(max_lag)
+        for l in range(1, max_lag + 1):
+            s = 0.0
+            for i in range(start, start + window - l):
+                dx = x[i + l] - x[i]
+                dy = y[i + l] - y[i]
+                s += dx*dx + dy*dy
+            sums[l - 1] = s
+        out = win_pos[k]
+        for w in range(n_win):
+            if w > 0:
+                for l in range(1, max_lag + 1):
+                    i_new = start + w + window - 1 - l
+                    i_old = start + w - 1
+                    dx_n = x[i_new + l] - x[i_new]
+                    dy_n = y[i_new + l] - y[i_new]
+                    dx_o = x[i_old + l] - x[i_old]
+                    dy_o = y[i_old + l] - y[i_old]
+                    sums[l - 1] += (dx_n*dx_n + dy_n*dy_n) - (dx_o*dx_o + dy_o*dy_o)
+            ly_mean = 0.0
+            ok = True
+            for l in range(max_lag):
+                m = sums[l] / (window - 1 - l)
+                if not m > 0.0:
+                    ok = False
+                    break
+                ly_mean += np.log(m)
+            if not ok:
+                D_out[out + w] = np.nan
+                a_out[out + w] = np.nan
+                continue
+            ly_mean /= max_lag
+            sxy = 0.0
+            for l in range(max_lag):
+                sxy += (lt[l] - lt_mean) * (np.log(sums[l] / (window - 1 - l)) - ly_mean)
+            alpha = sxy / sxx
+            D_out[out + w] = np.exp(ly_mean - alpha * lt_mean) / 4.0
+            a_out[out + w] = alpha
+
+_local_diffusivity_serial = _serial_twin(
+    _local_diffusivity_jit, '_local_diffusivity_serial', _LOCAL_SIG)
+
+def local_diffusivity_batch(x, y, offsets, window, max_lag, time_step):
+    """
+    Sliding-window D/alpha for every track of CSR-indexed positions (um).
+    Returns (window_offsets, D, alpha): track k's n_k - window + 1 windows
+    (none if shorter than window) are rows window_offsets[k]:window_offsets[k+1],
+    window w covering the track's points w .. w + window - 1.
+    """
+    if not 2 <= max_lag <= window - 1:
+        raise ValueError(f"need 2 <= max_lag <= window - 1 (got {max_lag}, {window})")
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_win = np.clip(np.diff(offsets) - window + 1, 0, None)
+    win_offsets = np.concatenate(([0], np.cumsum(n_win))).astype(np.int64)
+    D = np.empty(win_offsets[-1])
+    alpha = np.empty(win_offsets[-1])
+    kernel = _local_diffusivity_jit if use_parallel(x.size * max_lag) \
+        else _local_diffusivity_serial
+    kernel(x, y, offsets, win_offsets[:-1].copy(), np.int64(window), np.int64(max_lag),
+           float(time_step), D, alpha)
+    return win_offsets, D, alpha
+
+def warmup_kernels():
+    """
+    Load every kernel (compiling into the on-disk cache if needed) and run
+    each once on a tiny input so the threading layer is up. Call once in the
+    parent before starting a worker pool; workers then load cached machine
+    code instead of compiling concurrently. Returns seconds spent.
+    """
+    t0 = time.perf_counter()
+    x = np.arange(8, dtype=np.float64)
+    offsets = np.array([0, 4, 8], dtype=np.int64)
+    for kernel in (_msd_batch_jit, _msd_batch_serial):
+        msd = kernel(x, x, offsets, 3)
+    t = np.arange(1, 4, dtype=np.float64)
+    for kernel in (_fit_msd_batch_jit, _fit_msd_batch_serial):
+        kernel(msd, t, 0.2, 1.0, 5)
+    for count, fill in ((_step_angle_counts_jit, _step_angle_fill_jit),
+                        (_step_angle_counts_serial, _step_angle_fill_serial)):
+        steps, angs = count(x, x, offsets, 3)
+        out = np.full((3, 6), np.nan)
+        fill(x, x, offsets, _exclusive_cumsum(steps), _exclusive_cumsum(angs),
+             out, out.copy(), out.copy(), out.copy())
+    # each 4-point track has one window of 4: rows 0 and 1
+    win_pos = np.array([0, 1], dtype=np.int64)
+    for kernel in (_local_diffusivity_jit, _local_diffusivity_serial):
+        kernel(x, x, offsets, win_pos, 4, 2, 0.01, np.empty(2), np.empty(2))
+    # rainbow overlay kernels (track_raster imports this module)
+    from .track_raster import warmup_raster
+    warmup_raster()
+    return time.perf_counter() - t0
 
 class msd_diffusion:
     """
@@ -60,8 +543,30 @@ class msd_diffusion:
         self.max_tlag_step_size = 5
         self.min_track_len_step_size = 3
 
+    def msd_batch(self, x, y, offsets, max_lag, method='auto'):
+        """
+        MSD matrix (n_tracks x max_lag) for positions sorted by (track_id, frame)
+        and the matching CSR offsets from track_offsets().
+
+        method='direct' runs the O(N*L) lag loop, 'fft' the O(N log N)
+        autocorrelation path; 'auto' picks fft when max_lag > FFT_LAG_THRESHOLD.
+        """
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        y = np.ascontiguousarray(y, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        max_lag = int(max_lag)
+        if method == 'auto':
+            method = 'fft' if max_lag > FFT_LAG_THRESHOLD else 'direct'
+        if method == 'fft':
+            return _msd_fft_batch(x, y, offsets, max_lag)
+        if method == 'direct':
+            kernel = _msd_batch_jit if use_parallel(x.size * max_lag) else _msd_batch_serial
+            return kernel(x, y, offsets, np.int64(max_lag))
+        raise ValueError(f"Unknown MSD method {method!r}; expected 'auto', 'direct' or 'fft'")
+
     def fit_msd(self, msd_vals, time_step=None):
         """Fit MSD to power-law: MSD = 4*D*t^alpha."""
+        from scipy.optimize import curve_fit
         t = np.arange(1, len(msd_vals) + 1) * (time_step or self.time_step)
         def model(t, D, alpha):
             return 4 * D * np.power(t, alpha)
@@ -82,8 +587,49 @@ class msd_diffusion:
         r2 = 1 - ss_res/ss_tot if ss_tot > 0 else 0.0
         return D_fit, alpha_fit, r2
 
+    def fit_msd_batch(self, msd, time_step=None, mode='fast', n_jobs=1, max_iter=100):
+        """
+        Fit MSD = 4*D*t^alpha to every row of an (n_tracks x n_lags) MSD matrix.
+        Rows may be NaN-padded on the right for short tracks.
+
+        mode='fast' fits all rows in one compiled pass (log-log seed + bounded
+        Levenberg-Marquardt); rows it cannot fit go through fit_msd.
+        mode='scipy-exact' runs fit_msd (curve_fit) for every row.
+        Returns (D, alpha, r2) arrays.
+        """
+        msd = np.ascontiguousarray(msd, dtype=np.float64)
+        n_tracks, n_lags = msd.shape
+        if mode == 'fast':
+            t = np.arange(1, n_lags + 1) * (time_step or self.time_step)
+            kernel = _fit_msd_batch_jit if use_parallel(msd.size * 20) else _fit_msd_batch_serial
+            D, alpha, r2, ok = kernel(
+                msd, t, float(self.initial_guess_D),
+                float(self.initial_guess_alpha), int(max_iter)
+            )
+            redo = np.flatnonzero(~ok)
+        elif mode == 'scipy-exact':
+            D = np.full(n_tracks, np.nan)
+            alpha = np.full(n_tracks, np.nan)
+            r2 = np.zeros(n_tracks)
+            redo = np.arange(n_tracks)
+        else:
+            raise ValueError(f"Unknown fit mode {mode!r}; expected 'fast' or 'scipy-exact'")
+
+        if redo.size:
+            from joblib import Parallel, delayed
+            def _fit_row(k):
+                row = msd[k][~np.isnan(msd[k])]
+                return self.fit_msd(row, time_step)
+            fits = Parallel(n_jobs=n_jobs, prefer='threads')(
+                delayed(_fit_row)(k) for k in redo
+            )
+            for k, (d, a, r) in zip(redo, fits):
+                D[k], alpha[k], r2[k] = d, a, r
+        return D, alpha, r2
+
     def fit_msd_linear(self, msd_vals, time_step=None):
         """Linear MSD fit: MSD = 4*D*t."""
+        from scipy.optimize import curve_fit
         t = np.arange(1, len(msd_vals) + 1) * (time_step or self.time_step)
         def lin_fn(t, D):
             return 4 * D * t
@@ -104,67 +650,52 @@ class msd_diffusion:
         self.track_lengths = np.vstack((ids, counts)).T
 
     def step_sizes_and_angles(self):
-        """Compute step sizes and angles for export."""
+        """
+        Compute step sizes, deltaX/deltaY and turning angles for export:
+        (max_tlag_step_size x n) matrices, one row per lag, tracks of at least
+        min_track_len_step_size points in track_id order, NaN-padded.
+        One compiled pass over CSR track offsets fills all lags; the offsets
+        of the kept tracks are left in step_offsets.
+        """
         valid = self.track_lengths[self.track_lengths[:,1] >= self.min_track_len_step_size]
-        ids = valid[:,0].astype(int)
-        if ids.size == 0:
+        if valid.shape[0] == 0:
             self.step_sizes = np.empty((0,0))
+            self.deltaX = np.empty((0,0))
+            self.deltaY = np.empty((0,0))
             self.angles = np.empty((0,0))
+            self.step_offsets = np.zeros(1, dtype=np.int64)
             return
 
-        lengths = valid[:,1].astype(int)
-        total_steps_t1 = int(np.sum(lengths - 1))
-        M = self.max_tlag_step_size
-        self.step_sizes = np.full((M, total_steps_t1), np.nan)
-        self.deltaX = np.full((M, total_steps_t1), np.nan)
-        self.deltaY = np.full((M, total_steps_t1), np.nan)
-        total_angles = int(np.sum(lengths - 2))
-        self.angles = np.full((M, total_angles), np.nan)
-
-        pos_steps = np.zeros(M, dtype=int)
-        pos_angles = np.zeros(M, dtype=int)
-
-        for tid, length in zip(ids, lengths):
-            track = self.tracks[self.tracks[:,0] == tid]
-            x = track[:,2]
-            y = track[:,3]
-            max_shifts = min(M, len(x) - 1)
-            max_angles = min(M, (len(x) - 1) // 2)
-            for lag in range(1, max_shifts + 1):
-                dx = x[lag:] - x[:-lag]
-                dy = y[lag:] - y[:-lag]
-                steps = np.sqrt(dx*dx + dy*dy)
-                count = steps.size
-                i = lag - 1
-                self.step_sizes[i, pos_steps[i]:pos_steps[i]+count] = steps
-                self.deltaX[i, pos_steps[i]:pos_steps[i]+count] = dx
-                self.deltaY[i, pos_steps[i]:pos_steps[i]+count] = dy
-                pos_steps[i] += count
-                if lag <= max_angles:
-                    angles = []
-                    for j in range(0, len(dx) - lag, lag):
-                        v1 = np.array([dx[j], dy[j]])
-                        v2 = np.array([dx[j+lag], dy[j+lag]])
-                        norm1 = np.linalg.norm(v1)
-                        norm2 = np.linalg.norm(v2)
-                        if norm1 == 0 or norm2 == 0:
-                            continue
-                        cosang = np.dot(v1, v2) / (norm1 * norm2)
-                        cosang = np.clip(cosang, -1, 1)
-                        angles.append(np.degrees(np.arccos(cosang)))
-                    ang_arr = np.array(angles)
-                    cnta = ang_arr.size
-                    self.angles[lag-1, pos_angles[lag-1]:pos_angles[lag-1]+cnta] = ang_arr
-                    pos_angles[lag-1] += cnta
-
-    def save_step_sizes(self, file_name='step_sizes.txt'):
-        """Write the step_sizes array to a tab-delimited file and return a DataFrame."""
+        # rows of a track must be contiguous; keep their order within a track
+        ids = self.tracks[:,0]
+        order = None
+        if np.any(ids[1:] < ids[:-1]):
+            order = np.argsort(ids, kind='stable')
+            ids = ids[order]
+        offsets = track_offsets(ids)
+        lengths = np.diff(offsets)
+        keep = lengths >= self.min_track_len_step_size
+        rows = np.repeat(keep, lengths)
+        if order is not None:
+            rows = order[rows]
+        x = self.tracks[rows, 2].astype(np.float64)
+        y = self.tracks[rows, 3].astype(np.float64)
+        offsets = np.concatenate(([0], np.cumsum(lengths[keep]))).astype(np.int64)
+        self.step_offsets = offsets
+
+        (self.step_sizes, self.deltaX,
+         self.deltaY, self.angles) = step_sizes_angles_batch(x, y, offsets,
+                                                             self.max_tlag_step_size)
+
+    def save_step_sizes(self, file_name='step_sizes.txt', write=True):
+        """
+        Legacy wide table of the step_sizes array (t, then one column per step),
+        written tab-delimited unless write=False; returns the DataFrame.
+        """
         M, N = self.step_sizes.shape
-        data = {'t': np.arange(1, M+1)}
-        for col in range(N):
-            data[str(col)] = self.step_sizes[:,col]
-        df = pd.DataFrame(data)
-        path = os.path.join(self.save_dir, file_name)
-        df.to_csv(path, sep='\t', index=False)
+        df = pd.DataFrame(self.step_sizes, columns=[str(col) for col in range(N)])
+        df.insert(0, 't', np.arange(1, M+1))
+        if write:
+            df.to_csv(os.path.join(self.save_dir, file_name), sep='\t', index=False)
         return df
 
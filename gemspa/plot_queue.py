@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+plot_queue.py
+
+Decoupled plot rendering. Analysis stages no longer draw figures inline:
+they add plot jobs (plot kind, the saved results file the plot is drawn
+from - a CSV, or a results_query.json on the results store - output path
+and labels) to a plot_queue, which is spooled next to
+the results as plot_jobs.json. Jobs are rendered by a process pool with
+the Agg backend, either alongside the run or later (--plots-only) from
+the saved results alone.
+"""
+import os
+import json
+import glob
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+PLOT_JOBS_NAME = 'plot_jobs.json'
+
+
+# ---- plot kinds: each draws one figure from a results table ----
+
+def plot_D_distribution(df, out_path, condition):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(8,5))
+
+    # pick log-spaced bin edges between your min and max D
+    d = df['D_fit']
+    lo, hi = d[d>0].min(), d.max()
+    bins = np.logspace(np.log10(lo), np.log10(hi), 30)
+
+    ax.hist(d, bins=bins, edgecolor='black')
+    ax.set_xscale('log')
+    ax.set_xlabel('D_fit (μm²/s), log scale')
+    ax.set_title(f"D_fit Distribution ({condition})")
+    fig.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
+
+
+def plot_alpha_vs_logD(df, out_path, condition):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(8,5))
+    ax.scatter(np.log10(df['D_fit']), df['alpha_fit'], alpha=0.6)
+    ax.set_xlabel('log10(D_fit)')
+    ax.set_ylabel('alpha_fit')
+    ax.set_title(f"alpha vs log D ({condition})")
+    fig.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
+
+
+def plot_angle_histograms(df, out_path, condition):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(8,5))
+    lags = sorted(df['tlag'].unique())
+    for i, (t, sub) in enumerate(df.groupby('tlag')):
+        centers = 0.5 * (sub['bin_lo'] + sub['bin_hi'])
+        ax.plot(centers, sub['density'], marker='o', label=f"tlag {t}",
+                color=plt.cm.viridis(i / max(1, len(lags) - 1)))
+    ax.set_xlim(0, 180)
+    ax.set_xlabel('turning angle (deg)')
+    ax.set_ylabel('density')
+    ax.set_title(f"Turning angles ({condition})")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
+
+
+def plot_mean_cos(df, out_path, condition):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(8,5))
+    ax.plot(df['tlag'], df['mean_cos'], marker='o')
+    ax.axhline(0, color='gray', lw=0.8)
+    ax.set_xlabel('tlag (frames)')
+    ax.set_ylabel('<cos θ>')
+    ax.set_title(f"Mean cos θ vs lag ({condition})")
+    fig.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
+
+
+def plot_displacement_autocorr(df, out_path, condition):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(8,5))
+    ax.plot(df['tau'], df['C'], marker='o')
+    ax.axhline(0, color='gray', lw=0.8)
+    ax.set_xlabel('τ (frames)')
+    ax.set_ylabel('C(τ) = <Δr(t)·Δr(t+τ)> / <|Δr|²>')
+    ax.set_title(f"Displacement autocorrelation ({condition})")
+    fig.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
+
+
+def plot_msd_vs_tau(df, out_path, condition, loglog=False):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(8,5))
+    for curve, label in (('tamsd', 'time-averaged'), ('eamsd', 'ensemble-averaged')):
+        line = ax.errorbar(df['tau'], df[curve], yerr=df[f'{curve}_sem'],
+                           marker='o', ms=4, capsize=3, label=label)
+        if f'{curve}_fit' in df:
+            ax.plot(df['tau'], df[f'{curve}_fit'], ls='--', color=line[0].get_color())
+    if loglog:
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+    ax.set_xlabel('τ (s)')
+    ax.set_ylabel('MSD (μm²)')
+    ax.set_title(f"MSD vs τ ({condition})")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
+
+
+PLOT_KINDS = {
+    'D_fit_distribution':    plot_D_distribution,
+    'alpha_vs_logD':         plot_alpha_vs_logD,
+    'angle_histograms':      plot_angle_histograms,
+    'mean_cos':              plot_mean_cos,
+    'displacement_autocorr': plot_displacement_autocorr,
+    'msd_vs_tau':            plot_msd_vs_tau,
+}
+
+
+def results_plot_jobs(queue, data_file, condition):
+    """Queue the two standard plots of an msd_results.csv table in its folder."""
+    out_dir = os.path.dirname(data_file)
+    queue.add('D_fit_distribution', data_file,
+              os.path.join(out_dir, 'D_fit_distribution.png'), condition=condition)
+    queue.add('alpha_vs_logD', data_file,
+              os.path.join(out_dir, 'alpha_vs_logD.png'), condition=condition)
+
+
+class plot_queue:
+    """
+    Plot jobs for one output folder, spooled to <folder>/plot_jobs.json.
+    Paths are stored relative to the folder so results can be moved.
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.path = os.path.join(out_dir, PLOT_JOBS_NAME)
+        self.jobs = []
+
+    def add(self, kind, data_file, out_path, **labels):
+        if kind not in PLOT_KINDS:
+            raise ValueError(f"Unknown plot kind {kind!r}")
+        self.jobs.append({
+            'kind':      kind,
+            'data_file': os.path.relpath(data_file, self.out_dir),
+            'out':       os.path.relpath(out_path, self.out_dir),
+            'labels':    labels,
+        })
+
+    def save(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(self.path, 'w') as fh:
+            json.dump({'jobs': self.jobs}, fh, indent=1)
+        return self.path
+
+    def resolved(self):
+        """Jobs with absolute paths, ready for render_job."""
+        return [_resolve(job, self.out_dir) for job in self.jobs]
+
+
+def _resolve(job, base_dir):
+    return dict(job,
+                data_file=os.path.join(base_dir, job['data_file']),
+                out=os.path.join(base_dir, job['out']))
+
+
+def load_plot_jobs(root_dir, recursive=True):
+    """Spooled plot jobs in root_dir (and below, if recursive), with absolute paths."""
+    pattern = os.path.join(root_dir, '**', PLOT_JOBS_NAME) if recursive \
+        else os.path.join(root_dir, PLOT_JOBS_NAME)
+    jobs = []
+    for spool in sorted(glob.glob(pattern, recursive=recursive)):
+        try:
+            with open(spool) as fh:
+                saved = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        base = os.path.dirname(spool)
+        jobs.extend(_resolve(job, base) for job in saved.get('jobs', []))
+    return jobs
+
+
+def stale_jobs(jobs):
+    """Jobs whose figure is missing or older than its data file."""
+    out = []
+    for job in jobs:
+        try:
+            if os.path.getmtime(job['out']) >= os.path.getmtime(job['data_file']):
+                continue
+        except OSError:
+            pass
+        out.append(job)
+    return out
+
+
+def render_job(job):
+    """Draw one job; returns (output path, error message or None)."""
+    try:
+        if job['data_file'].endswith('.json'):
+            from .results_store import read_query
+            df = read_query(job['data_file'])
+        else:
+            df = pd.read_csv(job['data_file'])
+        PLOT_KINDS[job['kind']](df, job['out'], **job.get('labels', {}))
+        return job['out'], None
+    except Exception as e:
+        return job['out'], f"{type(e).__name__}: {e}"
+
+
+def _init_render_worker():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+class plot_renderer:
+    """
+    Process pool (Agg backend) rendering plot jobs while the caller keeps
+    computing; submit() returns at once, wait() collects the results.
+    """
+
+    def __init__(self, n_workers):
+        self.pool = ProcessPoolExecutor(
+            max_workers=max(1, n_workers),
+            mp_context=mp.get_context('spawn'),
+            initializer=_init_render_worker,
+        )
+        self.futures = []
+
+    def submit(self, jobs):
+        self.futures += [self.pool.submit(render_job, job) for job in jobs]
+
+    def wait(self):
+        """Block until all submitted jobs are drawn; returns [(out, error)]."""
+        results = [f.result() for f in self.futures]
+        self.pool.shutdown()
+        self.futures = []
+        return results
+
+
+def render_plot_jobs(jobs, n_workers=1):
+    """Render jobs now: in this process for n_workers <= 1, else in a pool."""
+    if n_workers <= 1 or len(jobs) <= 1:
+        return [render_job(job) for job in jobs]
+    renderer = plot_renderer(min(n_workers, len(jobs)))
+    renderer.submit(jobs)
+    return renderer.wait()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+rainbow_movie.py
+
+Time-resolved rainbow overlays: tracks grow frame by frame, coloured by
+D_fit or by a per-point D (e.g. the sliding-window D_local).
+
+Segments are sorted once by the frame of their end point, so the segments
+of frame f are one contiguous slice. Frames are composed incrementally:
+    trail=0   a persistent label plane; each frame rasterises only the
+              segments ending at that frame (track_raster kernel).
+    trail=n   only the last n frames' segments are kept: a window sliding
+              over the frame-sorted segments serves as the ring buffer. The
+              plane is redrawn from that window each frame, and colours fade
+              linearly with age.
+Either way a frame costs its own segments (or the trail's) plus one pass
+over the source-resolution image, never all segments.
+
+Frames are generated one at a time and consumed by the writer chosen by
+the output extension:
+    .gif            Pillow >= 9.1 (extra 'movie'), one fast-octree palette
+                    per frame, through Image.save(save_all=True); Pillow
+                    keeps the palettised (1 byte/pixel) frames until saved
+    .tif / .tiff    tifffile, one RGB page per frame
+    .mp4            H.264 through imageio-ffmpeg (extra 'mp4'; it bundles
+                    its own ffmpeg binary)
+TIFF and MP4 hold one frame in memory.
+"""
+import os
+import numpy as np
+
+from .track_raster import track_segments, pixel_coords, draw_labels
+from .rainbow_tiles import base_image, _rgb
+
+MOVIE_FORMATS = {'gif': '.gif', 'mp4': '.mp4', 'tiff': '.tif'}
+
+
+def _write_gif(path, frames, fps):
+    try:
+        from PIL import Image
+        octree = Image.Quantize.FASTOCTREE
+    except (ImportError, AttributeError):
+        raise ImportError("GIF movies need Pillow >= 9.1 (pip install 'gemspa_cli[movie]'); "
+                          "TIFF-stack output works without it") from None
+    images = (Image.fromarray(frame).quantize(256, method=octree) for frame in frames)
+    first = next(images, None)
+    if first is not None:
+        first.save(path, save_all=True, append_images=images,
+                   duration=int(round(1000.0 / fps)), loop=0)
+
+
+def _write_tiff(path, frames, fps):
+    import tifffile
+    with tifffile.TiffWriter(path, bigtiff=True) as tw:
+        for frame in frames:
+            tw.write(frame, photometric='rgb', contiguous=True, metadata={'fps': fps})
+
+
+def _write_mp4(path, frames, fps):
+    try:
+        import imageio_ffmpeg
+    except ImportError:
+        raise ImportError("MP4 movies need imageio-ffmpeg (pip install 'gemspa_cli[mp4]'); "
+                          "GIF and TIFF-stack output work without it") from None
+    gen = None
+    try:
+        for frame in frames:
+            if gen is None:
+                h, w = frame.shape[:2]
+                # yuv420p needs even dimensions; ffmpeg rescales by at most one pixel
+                gen = imageio_ffmpeg.write_frames(path, (w, h), fps=fps,
+                                                  codec='libx264', macro_block_size=2)
+                gen.send(None)
+            gen.send(np.ascontiguousarray(frame))
+    finally:
+        if gen is not None:
+            gen.close()
+
+
+def write_movie(path, frames, fps=10):
+    """Write an iterable of RGB uint8 frames to path (.gif, .mp4, .tif/.tiff)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.gif':
+        return _write_gif(path, frames, fps)
+    if ext in ('.tif', '.tiff'):
+        return _write_tiff(path, frames, fps)
+    if ext == '.mp4':
+        return _write_mp4(path, frames, fps)
+    raise ValueError(f"Unsupported movie format: {ext} (use .gif, .mp4 or .tif)")
+
+
+def render_rainbow_movie(
+    image_path,
+    raw_df,
+    results_df,
+    output_path,
+    id_col='track_id',
+    x_col='x',
+    y_col='y',
+    frame_col='frame',
+    D_col='D_fit',
+    point_D_col=None,
+    min_D=0.0,
+    max_D=2.0,
+    colormap='viridis',
+    line_px=1,
+    trail=0,
+    scale=1,
+    fps=10,
+    cache_dir=None
+):
+    """
+    Write a movie of the tracks growing over the base image, one movie frame
+    per acquisition frame from the first to the last segment end. trail > 0
+    fades segments out over that many frames; scale is an integer
+    nearest-neighbour upscale. Returns the number of frames written.
+    """
+    from matplotlib import cm
+    import matplotlib.pyplot as plt
+    x0, y0, x1, y1, seg_D, seg_f = track_segments(raw_df, results_df, id_col, x_col, y_col,
+                                                  D_col, point_D_col, frame_col)
+    norm = plt.Normalize(vmin=min_D, vmax=max_D)
+    cmap = cm.get_cmap(colormap)
+    colors = (cmap(norm(np.clip(seg_D, min_D, max_D)))[:, :3] * 255).astype(np.uint8)
+
+    # frame-sorted segments; the stable sort keeps the static overlay's order within a frame
+    order = np.argsort(seg_f, kind='stable')
+    seg_f, colors = seg_f[order], colors[order]
+    r0, c0, r1, c1 = (np.ascontiguousarray(a[order])
+                      for a in pixel_coords(x0, y0, x1, y1))
+
+    base = _rgb(base_image(image_path, cache_dir))
+    label = np.full(base.shape[:2], -1, dtype=np.int32)
+    frames = np.arange(seg_f[0], seg_f[-1] + 1) if seg_f.size else np.empty(0, dtype=np.int64)
+    ends = np.searchsorted(seg_f, frames, side='right')
+    starts = np.searchsorted(seg_f, frames - trail, side='right') if trail > 0 else None
+    scale = max(1, int(round(scale)))
+
+    def compose():
+        done = 0
+        for k, frame in enumerate(frames):
+            if trail > 0:
+                lo = starts[k]
+                label.fill(-1)
+            else:
+                lo = done
+            hi = ends[k]
+            draw_labels(label, r0[lo:hi], c0[lo:hi], r1[lo:hi], c1[lo:hi], line_px, first=lo)
+            done = hi
+
+            img = base.copy()
+            drawn = label >= 0
+            seg = label[drawn]
+            if trail > 0:
+                fade = (1.0 - (frame - seg_f[seg]) / trail)[:, None]
+                img[drawn] = (img[drawn] + fade * (colors[seg].astype(np.float64) -
+                                                   img[drawn])).astype(np.uint8)
+            else:
+                img[drawn] = colors[seg]
+            if scale > 1:
+                img = img.repeat(scale, axis=0).repeat(scale, axis=1)
+            yield img
+
+    write_movie(output_path, compose(), fps)
+    return len(frames)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+rainbow_tiles.py
+
+Direct, tiled output for rainbow overlays. Instead of a matplotlib figure
+of (w/100)*scale x (h/100)*scale inches at dpi (one output-sized pixel
+buffer, plus the figure's own), the overlay is upscaled by nearest
+neighbour, factor scale * dpi / 100 as in the figure path, and written
+tile by tile:
+    .png            streamed PNG, bands of rows compressed as they are made
+    .tif / .tiff    tiled, zlib-compressed BigTIFF with a 2x pyramid in SubIFDs
+
+The base image is memory-mapped with tifffile. Images that cannot be
+mapped as uint8 (compressed, 16-bit or float) are converted once to a
+uint8 .npy in cache_dir, keyed by file name, size and mtime, and mapped
+from there. Replicates sharing MAX_<cond>.tif reuse that copy. Peak memory
+is one output band or tile, plus a source-resolution int32 plane of
+segment labels.
+"""
+import os
+import zlib
+import struct
+import numpy as np
+
+from .track_raster import label_segments, rasterize_segments
+
+RAINBOW_CACHE_DIR = '.rainbow_cache'
+
+
+def _to_uint8(img):
+    """Display range of imshow for RGB data: ints clipped to 0-255, floats to 0-1."""
+    if img.dtype == np.uint8:
+        return img
+    if img.dtype.kind == 'f':
+        return (np.clip(img, 0.0, 1.0) * 255).astype(np.uint8)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def base_image(image_path, cache_dir=None):
+    """Memory-mapped uint8 base image, (h, w) or (h, w, channels)."""
+    import tifffile
+    try:
+        img = tifffile.memmap(image_path, mode='r')
+    except ValueError:
+        # compressed or non-contiguous pages cannot be mapped
+        img = None
+    if img is not None and img.dtype == np.uint8:
+        return img
+    if cache_dir is None:
+        return _to_uint8(img if img is not None else tifffile.imread(image_path))
+    st = os.stat(image_path)
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    path = os.path.join(cache_dir, f'{stem}_{st.st_size}_{st.st_mtime_ns}.npy')
+    if not os.path.isfile(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        data = _to_uint8(img if img is not None else tifffile.imread(image_path))
+        # concurrent replicates may both convert; the rename keeps the file whole
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as fh:
+            np.save(fh, data)
+        os.replace(tmp, path)
+    return np.load(path, mmap_mode='r')
+
+
+def _rgb(block):
+    if block.ndim == 2:
+        return np.repeat(block[:, :, None], 3, axis=2)
+    return np.array(block[:, :, :3])
+
+
+class _overlay:
+    """RGB blocks of the source-resolution overlay: base image + segment colours."""
+
+    def __init__(self, base, label=None, colors=None):
+        self.base, self.label, self.colors = base, label, colors
+        self.h, self.w = base.shape[:2]
+
+    def block(self, rows, cols):
+        """Overlay at the source pixels rows x cols (non-decreasing index arrays)."""
+        r0, r1 = rows[0], rows[-1] + 1
+        c0, c1 = cols[0], cols[-1] + 1
+        rgb = _rgb(self.base[r0:r1, c0:c1])
+        if self.label is not None:
+            lab = self.label[r0:r1, c0:c1]
+            drawn = lab >= 0
+            rgb[drawn] = self.colors[lab[drawn]]
+        return rgb.take(rows - r0, axis=0).take(cols - c0, axis=1)
+
+
+def _src_index(n_out, n_src, lo, hi):
+    """Nearest source pixel of output pixels lo..hi-1 for an n_src -> n_out upscale."""
+    return np.arange(lo, hi) * n_src // n_out
+
+
+def _png_chunk(fh, tag, data):
+    fh.write(struct.pack('>I', len(data)) + tag + data)
+    fh.write(struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+
+def write_png(path, overlay, H, W, tile_size=1024):
+    """Stream the H x W upscaled overlay to an RGB PNG, about tile_size**2 pixels per band."""
+    band = max(1, tile_size * tile_size // W)
+    cols = _src_index(W, overlay.w, 0, W)
+    comp = zlib.compressobj(6)
+    with open(path, 'wb') as fh:
+        fh.write(b'\x89PNG\r\n\x1a\n')
+        _png_chunk(fh, b'IHDR', struct.pack('>IIBBBBB', W, H, 8, 2, 0, 0, 0))
+        for lo in range(0, H, band):
+            rows = _src_index(H, overlay.h, lo, min(lo + band, H))
+            rgb = overlay.block(rows, cols).reshape(len(rows), -1)
+            # filter byte 0 (None) in front of every scanline
+            raw = np.concatenate([np.zeros((len(rows), 1), np.uint8), rgb], axis=1)
+            data = comp.compress(raw.tobytes())
+            if data:
+                _png_chunk(fh, b'IDAT', data)
+        _png_chunk(fh, b'IDAT', comp.flush())
+        _png_chunk(fh, b'IEND', b'')
+
+
+def _tiles(overlay, H, W, tile_size):
+    """Row-major, zero-padded tile_size tiles of the H x W upscaled overlay."""
+    for r_lo in range(0, H, tile_size):
+        rows = _src_index(H, overlay.h, r_lo, min(r_lo + tile_size, H))
+        for c_lo in range(0, W, tile_size):
+            cols = _src_index(W, overlay.w, c_lo, min(c_lo + tile_size, W))
+            tile = np.zeros((tile_size, tile_size, 3), dtype=np.uint8)
+            tile[:len(rows), :len(cols)] = overlay.block(rows, cols)
+            yield tile
+
+
+def write_tiff(path, overlay, H, W, tile_size=1024):
+    """
+    Tiled BigTIFF of the H x W upscaled overlay with half-size levels in
+    SubIFDs down to one tile; every level is sampled from the source.
+    """
+    import tifffile
+    levels = [(H, W)]
+    while max(levels[-1]) > tile_size:
+        h, w = levels[-1]
+        levels.append(((h + 1) // 2, (w + 1) // 2))
+    opts = dict(dtype=np.uint8, tile=(tile_size, tile_size), photometric='rgb',
+                compression='zlib')
+    with tifffile.TiffWriter(path, bigtiff=True) as tw:
+        for i, (h, w) in enumerate(levels):
+            level_opts = dict(subifds=len(levels) - 1) if i == 0 else dict(subfiletype=1)
+            tw.write(_tiles(overlay, h, w, tile_size), shape=(h, w, 3), **opts, **level_opts)
+
+
+def render_tiled(image_path, x0, y0, x1, y1, colors, output_path, upscale,
+                 line_px=1, antialias=False, tile_size=1024, cache_dir=None):
+    """
+    Draw the segments (source pixel coordinates, uint8 colours) over the
+    base image and write it upscaled by `upscale` to output_path (.png, or
+    .tif/.tiff for a pyramid). Anti-aliased lines are blended into a
+    source-resolution copy of the base; exact lines only keep a label plane.
+    """
+    base = base_image(image_path, cache_dir)
+    h, w = base.shape[:2]
+    if antialias:
+        canvas = rasterize_segments(_rgb(base), x0, y0, x1, y1, colors,
+                                    line_px=line_px, antialias=True)
+        overlay = _overlay(canvas)
+    else:
+        overlay = _overlay(base, label_segments((h, w), x0, y0, x1, y1, line_px),
+                           np.ascontiguousarray(colors, dtype=np.uint8))
+    H, W = max(1, round(h * upscale)), max(1, round(w * upscale))
+    if os.path.splitext(output_path)[1].lower() in ('.tif', '.tiff'):
+        write_tiff(output_path, overlay, H, W, tile_size)
+    else:
+        write_png(output_path, overlay, H, W, tile_size)
+    return H, W
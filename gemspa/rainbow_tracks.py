@@ -5,7 +5,9 @@ import os
 import numpy as np
 from matplotlib import cm
 import matplotlib.pyplot as plt
-from skimage import io, draw
+from skimage import io
+
+from .track_raster import track_segments, rasterize_segments
 
 def draw_rainbow_tracks(
     image_path,
@@ -16,18 +18,48 @@ def draw_rainbow_tracks(
     x_col='x',
     y_col='y',
     D_col='D_fit',
+    point_D_col=None,
     min_D=0.0,
     max_D=2.0,
     line_width=0.01,
     colormap='viridis',
     scale=4.0,
-    dpi=1000
+    dpi=1000,
+    line_px=1,
+    antialias=False,
+    tiled=False,
+    tile_size=1024,
+    cache_dir=None
 ):
     """
     Overlay tracks on the background image, color-coded by diffusion coefficient,
     zoomed in by `scale` and clamped to [min_D, max_D] for the LUT.
+    With point_D_col (a per-point column of raw_df, e.g. local D), each
+    segment takes the colour of its first point instead, falling back to
+    the track's D where that is NaN.
+    Segments are drawn in one compiled pass (track_raster); by default the
+    pixels match skimage.draw.line. line_px widens the lines (in image
+    pixels) and antialias blends their edges.
+    tiled=True skips the figure: the memory-mapped TIFF is upscaled by
+    scale * dpi / 100 and written tile by tile to output_path (.png, or
+    .tif/.tiff as a tiled pyramid), base images cached in cache_dir (see
+    rainbow_tiles).
     """
-    # 1) Load image and build RGB canvas
+    # 1) Segments in drawing order, colored through the LUT
+    x0, y0, x1, y1, seg_D = track_segments(raw_df, results_df, id_col, x_col, y_col,
+                                           D_col, point_D_col)
+    norm = plt.Normalize(vmin=min_D, vmax=max_D)
+    cmap = cm.get_cmap(colormap)
+    colors = (cmap(norm(np.clip(seg_D, min_D, max_D)))[:, :3] * 255).astype(np.uint8)
+
+    if tiled:
+        from .rainbow_tiles import render_tiled
+        render_tiled(image_path, x0, y0, x1, y1, colors, output_path, scale * dpi / 100.0,
+                     line_px=line_px, antialias=antialias, tile_size=tile_size,
+                     cache_dir=cache_dir)
+        return
+
+    # 2) Load image and build RGB canvas
     img = io.imread(image_path)
     if img.ndim == 2:
         canvas = np.stack([img]*3, axis=-1)
@@ -35,26 +67,8 @@ def draw_rainbow_tracks(
         canvas = img.copy()
     h, w = canvas.shape[:2]
 
-    # 2) Normalize & colormap
-    D_vals = np.clip(results_df[D_col].astype(float), min_D, max_D)
-    norm = plt.Normalize(vmin=min_D, vmax=max_D)
-    cmap = cm.get_cmap(colormap)
-
     # 3) Draw tracks
-    raw_df[id_col]   = raw_df[id_col].astype(str)
-    results_df[id_col] = results_df[id_col].astype(str)
-
-    for _, row in results_df.iterrows():
-        tid   = str(row[id_col])
-        D_val = np.clip(float(row[D_col]), min_D, max_D)
-        color = cmap(norm(D_val))[:3]
-        track = raw_df[raw_df[id_col] == tid]
-        coords = track[[x_col, y_col]].to_numpy()
-        for i in range(len(coords)-1):
-            y0, x0 = coords[i,1], coords[i,0]
-            y1, x1 = coords[i+1,1], coords[i+1,0]
-            rr, cc = draw.line(int(y0), int(x0), int(y1), int(x1))
-            canvas[rr, cc] = (np.array(color)*255).astype(np.uint8)
+    rasterize_segments(canvas, x0, y0, x1, y1, colors, line_px=line_px, antialias=antialias)
 
     # 4) Create a big figure via subplots
     fig_w = (w / 100.0) * scale
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+resources.py
+
+Central CPU budget for the three layers of parallelism in a run: replicate
+processes (--n-jobs), per-replicate joblib threads (--threads-per-rep) and
+Numba / BLAS / OpenMP thread pools inside each worker. The plan keeps
+n_jobs x threads <= available cores; workers pin their pools to the plan
+and small kernel calls run serially. Plot rendering that overlaps the
+compute stages gets only the cores the replicate workers leave free.
+"""
+import os
+from multiprocessing import cpu_count
+
+# thread-count environment variables read by BLAS/OpenMP runtimes at import
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS', 'NUMBA_NUM_THREADS',
+)
+
+# below this many inner-loop iterations a parallel kernel's thread start-up
+# costs more than it saves
+PARALLEL_MIN_WORK = 200_000
+
+
+def available_cores():
+    """Cores this process may run on (CPU affinity aware)."""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, cpu_count())
+
+
+def plan_resources(n_jobs=None, threads_per_rep=None, n_tasks=None):
+    """
+    Split the available cores between replicate processes and per-replicate
+    threads so that n_jobs * threads_per_rep <= cores, and give concurrent
+    plot rendering the remainder (at least one worker).
+    Returns a dict with cores, n_jobs, threads_per_rep, plot_workers and notes.
+    """
+    cores = available_cores()
+    notes = []
+    n_jobs = cores if not n_jobs or n_jobs < 1 else n_jobs
+    if n_tasks is not None and n_jobs > n_tasks:
+        notes.append(f"n_jobs {n_jobs} -> {max(1, n_tasks)} (only {n_tasks} replicates)")
+        n_jobs = max(1, n_tasks)
+    if n_jobs > cores:
+        notes.append(f"n_jobs {n_jobs} -> {cores} (cores available)")
+        n_jobs = cores
+
+    fair = max(1, cores // n_jobs)
+    if threads_per_rep is None:
+        threads_per_rep = fair
+    elif threads_per_rep > fair:
+        notes.append(f"threads_per_rep {threads_per_rep} -> {fair} (n_jobs x threads <= {cores})")
+        threads_per_rep = fair
+    threads_per_rep = max(1, threads_per_rep)
+    return {
+        'cores': cores,
+        'n_jobs': n_jobs,
+        'threads_per_rep': threads_per_rep,
+        'plot_workers': max(1, cores - n_jobs * threads_per_rep),
+        'notes': notes,
+    }
+
+
+def export_thread_env(threads):
+    """
+    Set BLAS/OpenMP/Numba thread variables so that worker processes started
+    afterwards size their pools to `threads`.
+    """
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+
+
+def configure_worker_threads(threads):
+    """
+    Pin this process's Numba pool (and BLAS pools, when threadpoolctl is
+    installed) to `threads`. Returns a short description for logs.
+    """
+    import numba
+    threads = max(1, min(int(threads), numba.config.NUMBA_NUM_THREADS))
+    numba.set_num_threads(threads)
+    blas = 'env'
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+        blas = 'threadpoolctl'
+    except ImportError:
+        pass
+    return f"numba_threads={threads} blas_limit={blas}"
+
+
+def use_parallel(work):
+    """True if a kernel with `work` inner iterations should use its parallel variant."""
+    import numba
+    return work >= PARALLEL_MIN_WORK and numba.get_num_threads() > 1
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+results_store.py
+
+One columnar store for the per-track fit results of every replicate:
+<work_dir>/results.store/<replicate>/ is a partition in the step store
+layout (raw column files + meta.json) with columns
+    group (the condition), replicate, track_id, length, D_fit, alpha_fit, r2_fit
+Each replicate writes only its own partition, into a temporary folder
+renamed into place on close, so parallel replicates never share files.
+
+read_results concatenates partitions with
+    column projection     only the requested columns are memory-mapped
+    partition pruning     conditions / replicates matched on meta.json alone
+    predicate filtering   inclusive bounds on any column, on the mapped columns
+Ensemble and comparison stages query the store instead of re-reading CSVs;
+msd_results.csv stays as the per-replicate export. Grouped ensemble
+folders keep a results_query.json (store, condition, replicates, bounds) as
+the data source of their plot jobs instead of a copy of the tracks.
+"""
+import os
+import re
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from .step_store import (
+    step_store_writer, read_step_store, read_store_meta, is_step_store, ID_DTYPE
+)
+
+RESULTS_STORE_NAME = 'results.store'
+RESULTS_QUERY_NAME = 'results_query.json'
+
+
+RESULT_COLUMNS = {
+    'group':     '<u2',
+    'replicate': '<u2',
+    'track_id':  ID_DTYPE,
+    'length':    '<i4',
+    'D_fit':     '<f8',
+    'alpha_fit': '<f8',
+    'r2_fit':    '<f8',
+}
+
+
+class results_writer:
+    """
+    Writer of one replicate's partition; track_id is stored as int64,
+    float64 or, for non-numeric ids, a categorical (see step_store.ID_DTYPE).
+    Use as a context manager.
+    """
+
+    def __init__(self, root, condition, replicate):
+        self.condition, self.replicate = str(condition), str(replicate)
+        self.path = os.path.join(root, self.replicate)
+        self.tmp = os.path.join(root, f'.{self.replicate}.{os.getpid()}.tmp')
+        self.store = None
+
+    def _open(self):
+        self.store = step_store_writer(self.tmp, columns=RESULT_COLUMNS)
+
+    def append(self, track_id, length, D_fit, alpha_fit, r2_fit):
+        if self.store is None:
+            self._open()
+        self.store.append(self.condition, self.replicate, track_id=track_id, length=length,
+                          D_fit=D_fit, alpha_fit=alpha_fit, r2_fit=r2_fit)
+
+    @property
+    def rows(self):
+        return self.store.rows if self.store else 0
+
+    def close(self):
+        if self.store is None:
+            self._open()
+        self.store.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.rename(self.tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def list_partitions(root):
+    """Replicate -> partition path of every complete partition under root."""
+    if not os.path.isdir(root):
+        return {}
+    return {name: os.path.join(root, name) for name in sorted(os.listdir(root))
+            if not name.startswith('.') and is_step_store(os.path.join(root, name))}
+
+
+def read_results(root, columns=('track_id', 'D_fit', 'alpha_fit'), conditions=None,
+                 replicates=None, bounds=None):
+    """
+    DataFrame of condition, replicate (categoricals) and `columns` over the
+    store's partitions, restricted to `conditions` / `replicates` and to
+    rows within `bounds` ({column: (lo, hi)}, inclusive; NaN never passes).
+    """
+    columns = list(columns)
+    bounds = bounds or {}
+    frames = []
+    for rep, path in list_partitions(root).items():
+        if replicates is not None and rep not in replicates:
+            continue
+        meta = read_store_meta(path)
+        if not meta['rows']:
+            continue
+        cond = meta['categories']['group'][0]
+        if conditions is not None and cond not in conditions:
+            continue
+        data = read_step_store(path, columns=sorted(set(columns) | set(bounds)))
+        keep = None
+        for col, (lo, hi) in bounds.items():
+            v = data[col].to_numpy()
+            ok = (v >= lo) & (v <= hi)
+            keep = ok if keep is None else keep & ok
+        df = pd.DataFrame({c: (data[c].to_numpy()[keep] if keep is not None
+                               else np.array(data[c].to_numpy())) for c in columns})
+        df.insert(0, 'replicate', rep)
+        df.insert(0, 'condition', cond)
+        frames.append(df)
+    if not frames:
+        out = pd.DataFrame({c: pd.Series(dtype=np.float64) for c in columns})
+        out.insert(0, 'replicate', pd.Categorical([]))
+        out.insert(0, 'condition', pd.Categorical([]))
+        return out
+    out = pd.concat(frames, ignore_index=True)
+    out['condition'] = out['condition'].astype('category')
+    out['replicate'] = out['replicate'].astype('category')
+    return out
+
+
+def filter_bounds(filter_D_min=0.0, filter_D_max=float('inf'),
+                  filter_alpha_min=0.0, filter_alpha_max=float('inf')):
+    """read_results bounds of the ensemble D/alpha filter."""
+    return {'D_fit': (filter_D_min, filter_D_max),
+            'alpha_fit': (filter_alpha_min, filter_alpha_max)}
+
+
+def backfill_results(root_dir):
+    """
+    Write partitions for <condition>_<n> replicate folders whose
+    msd_results.csv is newer than their partition (or has none, e.g. runs
+    without a results store). Track lengths are not in the CSV: -1.
+    Returns the replicates written.
+    """
+    store = os.path.join(root_dir, RESULTS_STORE_NAME)
+    parts = list_partitions(store)
+    written = []
+    for sub in sorted(os.listdir(root_dir)):
+        csv = os.path.join(root_dir, sub, 'msd_results.csv')
+        if not re.match(r'.+_[0-9]+$', sub) or not os.path.isfile(csv):
+            continue
+        part = parts.get(sub)
+        if part and os.path.getmtime(os.path.join(part, 'meta.json')) >= os.path.getmtime(csv):
+            continue
+        df = pd.read_csv(csv)
+        cond = df['condition'].iloc[0] if len(df) and 'condition' in df \
+            else re.sub(r'_[0-9]+$', '', sub)
+        os.makedirs(store, exist_ok=True)
+        with results_writer(store, cond, sub) as w:
+            if len(df):
+                w.append(df['track_id'].to_numpy(), np.full(len(df), -1),
+                         df['D_fit'].to_numpy(), df['alpha_fit'].to_numpy(),
+                         df['r2_fit'].to_numpy() if 'r2_fit' in df else np.full(len(df), np.nan))
+        written.append(sub)
+    return written
+
+
+def write_query(out_dir, store_root, condition, replicates=None, bounds=None):
+    """Save the selection of out_dir's tracks as results_query.json."""
+    path = os.path.join(out_dir, RESULTS_QUERY_NAME)
+    with open(path, 'w') as fh:
+        json.dump({'store':      os.path.relpath(store_root, out_dir),
+                   'condition':  condition,
+                   'replicates': sorted(replicates) if replicates is not None else None,
+                   'bounds':     bounds or {}}, fh, indent=1)
+    return path
+
+
+def read_query(path, columns=('track_id', 'D_fit', 'alpha_fit')):
+    """Tracks selected by a results_query.json."""
+    with open(path) as fh:
+        q = json.load(fh)
+    root = os.path.join(os.path.dirname(path), q['store'])
+    bounds = {k: tuple(v) for k, v in q['bounds'].items()}
+    return read_results(root, columns, conditions=[q['condition']],
+                        replicates=q['replicates'], bounds=bounds)
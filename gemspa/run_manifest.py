@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+run_manifest.py
+
+Parameter-hash manifests for incremental, resumable batch runs.
+
+Each replicate folder holds a manifest.json recording the input file's
+digest and, per stage, a key hashed from the inputs and parameters plus
+the outputs the stage wrote. A stage is up to date when its key matches
+and all recorded outputs still exist. Run-level stages (ensemble,
+comparison) use a manifest in the work directory.
+"""
+import os
+import json
+import hashlib
+import datetime
+
+MANIFEST_NAME = 'manifest.json'
+RUN_MANIFEST_NAME = 'gemspa_manifest.json'
+
+
+def params_key(*parts):
+    """Stable hash of JSON-serialisable parameters."""
+    blob = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+class run_manifest:
+    """
+    Stage records for one replicate (or the whole run), stored as JSON at `path`.
+    Output paths are stored relative to the manifest's folder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        try:
+            with open(path) as fh:
+                self.data = json.load(fh)
+        except (OSError, ValueError):
+            self.data = {}
+        self.data.setdefault('stages', {})
+
+    def input_digest(self, src):
+        """
+        Content digest of src. It is reused from the manifest while size and mtime are
+        unchanged and recomputed otherwise.
+        """
+        st = os.stat(src)
+        rec = self.data.get('input')
+        if (rec and rec.get('source') == os.path.basename(src)
+                and rec.get('size') == st.st_size
+                and rec.get('mtime_ns') == st.st_mtime_ns):
+            return rec['digest']
+        from .trajectory_io import file_digest
+        digest = file_digest(src)
+        self.data['input'] = {
+            'source':   os.path.basename(src),
+            'size':     st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'digest':   digest,
+        }
+        self.save()
+        return digest
+
+    def is_current(self, stage, key):
+        entry = self.data['stages'].get(stage)
+        if not entry or entry.get('key') != key:
+            return False
+        return all(
+            os.path.exists(os.path.join(self.base_dir, o))
+            for o in entry.get('outputs', [])
+        )
+
+    def record(self, stage, key, outputs, params=None):
+        """Mark stage done with `key`; only outputs that exist are recorded."""
+        rel = []
+        for o in outputs:
+            full = o if os.path.isabs(o) else os.path.join(self.base_dir, o)
+            if os.path.exists(full):
+                rel.append(os.path.relpath(full, self.base_dir))
+        self.data['stages'][stage] = {
+            'key':      key,
+            'params':   params,
+            'outputs':  rel,
+            'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        self.save()
+
+    def save(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.data, fh, indent=1, default=str)
+        os.replace(tmp, self.path)
@@ -9,14 +9,19 @@ import seaborn as sns
 from matplotlib.colors import to_rgba
 from scipy.stats import ks_2samp
 
+from .step_store import is_step_store, read_step_store, STEP_STORE_NAME
+
 plt.rcParams['font.size'] = 16
 
 def load_step_data(path):
     """
-    Load the tab-delimited step-size file.  
-    Expect columns [group, tlag, <step-col>], where <step-col> is any name.
-    Rename that third column to 'step_size'.
+    Load step sizes as a long (group, tlag, step_size) table.
+    A step store (step_sizes.store) is memory-mapped. A legacy tab-delimited
+    file is expected with columns [group, tlag, <step-col>], where <step-col>
+    is any name; that third column is renamed to 'step_size'.
     """
+    if is_step_store(path):
+        return read_step_store(path, columns=['group', 'tlag', 'step_size'])
     df = pd.read_csv(path, sep='\t')
     # drop any rows missing group or tlag
     df = df.dropna(subset=['group','tlag'])
@@ -40,7 +45,7 @@ def plot_step_kde(df, results_dir):
     """
     For each group and each tlag, plot a log-scaled KDE of step_size.
     """
-    for group, gdf in df.groupby('group'):
+    for group, gdf in df.groupby('group', observed=True):
         fig, ax = plt.subplots(figsize=(8,6))
         plotted = False
         alpha2_vals = {}
@@ -122,7 +127,9 @@ def ks_comparison(df, g1, g2, results_dir):
     print(f"[step_size] → wrote KS volcano to {out}")
 
 def run_step_size_analysis_if_requested(results_dir):
-    step_file = os.path.join(results_dir, "all_data_step_sizes.txt")
+    step_file = os.path.join(results_dir, STEP_STORE_NAME)
+    if not is_step_store(step_file):
+        step_file = os.path.join(results_dir, "all_data_step_sizes.txt")
     if not os.path.exists(step_file):
         print(f"[step_size] file not found: {step_file}")
         return
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+step_store.py
+
+Compact long-format step-size store: one row per step with columns
+(group, replicate, tlag, step_size, dx, dy), kept as a folder of raw
+little-endian column files plus meta.json (dtypes, row count and the
+group/replicate categories). Columns are appended batch by batch while
+writing and memory-mapped when read, so step tables of any size load
+without parsing or copying. Other long tables (e.g. turning angles) use
+the same layout with their own column set. A column declared ID_DTYPE
+(track ids) takes its type from the first batch: int64, float64, or for
+non-numeric ids int32 codes into a category list kept in meta.json.
+"""
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+STEP_STORE_NAME = 'step_sizes.store'
+STEP_STORE_VERSION = 1
+
+STEP_COLUMNS = {
+    'group':     '<u2',
+    'replicate': '<u2',
+    'tlag':      '<i4',
+    'step_size': '<f8',
+    'dx':        '<f8',
+    'dy':        '<f8',
+}
+CATEGORY_COLUMNS = ('group', 'replicate')
+ID_DTYPE = 'id'
+
+
+def long_steps(step_sizes, deltaX, deltaY):
+    """
+    Long-format (tlag, step_size, dx, dy) arrays from the (max_tlag x n)
+    NaN-padded matrices of msd_diffusion.step_sizes_and_angles, lag by lag.
+    """
+    mask = ~np.isnan(step_sizes)
+    return {
+        'tlag':      (np.nonzero(mask)[0] + 1).astype(np.int32),
+        'step_size': step_sizes[mask],
+        'dx':        deltaX[mask],
+        'dy':        deltaY[mask],
+    }
+
+
+class step_store_writer:
+    """
+    Append-only writer for `columns` (name -> dtype, default STEP_COLUMNS);
+    meta.json is written on close, so a store without it is incomplete.
+    Use as a context manager.
+    """
+
+    def __init__(self, path, columns=STEP_COLUMNS):
+        self.path = path
+        self.columns = dict(columns)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        self.rows = 0
+        self.categories = {c: [] for c in CATEGORY_COLUMNS}
+        self._codes = {}
+        self.files = {
+            col: open(os.path.join(path, f'{col}.bin'), 'wb') for col in columns
+        }
+
+    def _code(self, col, value):
+        cats = self.categories[col]
+        if value not in cats:
+            cats.append(value)
+        return cats.index(value)
+
+    def _resolve_id(self, col, values):
+        """Fix an ID_DTYPE column's stored type from its first batch."""
+        kind = np.asarray(values).dtype.kind
+        if kind in 'iub':
+            self.columns[col] = '<i8'
+        elif kind == 'f':
+            self.columns[col] = '<f8'
+        else:
+            self.columns[col] = '<i4'
+            self.categories[col] = []
+            self._codes[col] = {}
+
+    def _id_codes(self, col, values):
+        """Codes of non-numeric ids, extending the column's categories."""
+        index, cats = self._codes[col], self.categories[col]
+        uniq, inv = np.unique(np.asarray(values).astype(str), return_inverse=True)
+        for u in uniq:
+            if u not in index:
+                index[u] = len(cats)
+                cats.append(str(u))
+        return np.array([index[u] for u in uniq], dtype=np.int32)[inv]
+
+    def append(self, group, replicate, **values):
+        """Append one batch of rows sharing a group and replicate."""
+        n = len(next(iter(values.values())))
+        if n == 0:
+            return
+        values['group'] = np.full(n, self._code('group', str(group)))
+        values['replicate'] = np.full(n, self._code('replicate', str(replicate)))
+        for col, dtype in self.columns.items():
+            if dtype == ID_DTYPE:
+                self._resolve_id(col, values[col])
+            if col in self._codes:
+                values[col] = self._id_codes(col, values[col])
+            np.asarray(values[col], dtype=self.columns[col]).tofile(self.files[col])
+        self.rows += n
+
+    def append_matrices(self, group, replicate, step_sizes, deltaX, deltaY):
+        self.append(group, replicate, **long_steps(step_sizes, deltaX, deltaY))
+
+    def close(self):
+        for fh in self.files.values():
+            fh.close()
+        # no rows: unresolved id columns are empty int64 columns
+        self.columns = {c: '<i8' if t == ID_DTYPE else t for c, t in self.columns.items()}
+        meta = {
+            'version':    STEP_STORE_VERSION,
+            'rows':       self.rows,
+            'columns':    self.columns,
+            'categories': self.categories,
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as fh:
+            json.dump(meta, fh, indent=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_step_store(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def read_store_meta(path):
+    """meta.json of a store: version, rows, column dtypes and categories."""
+    with open(os.path.join(path, 'meta.json')) as fh:
+        meta = json.load(fh)
+    if meta.get('version') != STEP_STORE_VERSION:
+        raise ValueError(f"Unsupported step store version in {path}")
+    return meta
+
+
+def read_step_store(path, columns=None):
+    """
+    DataFrame over the memory-mapped columns of a step store; group,
+    replicate and coded id columns come back as categoricals. `columns`
+    limits what is mapped.
+    """
+    meta = read_store_meta(path)
+    rows = meta['rows']
+    data = {}
+    for col in (columns or meta['columns']):
+        dtype = np.dtype(meta['columns'][col])
+        if rows:
+            arr = np.memmap(os.path.join(path, f'{col}.bin'), dtype=dtype, mode='r', shape=(rows,))
+        else:
+            arr = np.empty(0, dtype=dtype)
+        if col in meta['categories']:
+            arr = pd.Categorical.from_codes(arr.astype(np.int32), meta['categories'][col])
+        data[col] = arr
+    return pd.DataFrame(data, copy=False)
+
+
+def write_wide_steps(path, out_path, group, max_tlag):
+    """
+    Legacy wide all_data_step_sizes.txt table (tlag, group, then one column
+    per lag-1 step; each lag's steps packed left and NaN-padded) of a step
+    store, written lag by lag from the mapped columns.
+    """
+    data = read_step_store(path, columns=['tlag', 'step_size'])
+    tlag = data['tlag'].to_numpy()
+    steps = data['step_size'].to_numpy()
+    width = int(np.count_nonzero(tlag == 1))
+    cols = [str(c) for c in range(width)]
+    with open(out_path, 'w') as fh:
+        pd.DataFrame(columns=['tlag', 'group'] + cols).to_csv(fh, sep='\t', index=False)
+        for lag in range(1, max_tlag + 1) if width else ():
+            row = np.full((1, width), np.nan)
+            vals = steps[tlag == lag]
+            row[0, :vals.size] = vals
+            df = pd.DataFrame(row, columns=cols)
+            df.insert(0, 'group', group)
+            df.insert(0, 'tlag', lag)
+            df.to_csv(fh, sep='\t', header=False, index=False)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+synthetic.py
+
+Synthetic trajectory generator for benchmarks and accuracy checks.
+Writes Traj_<condition>_<rep>.csv files of Brownian (alpha = 1) or
+fractional Brownian (alpha != 1) tracks with known D and alpha, so that
+MSD = 4*D*t^alpha holds in expectation, plus controllable track-length
+distributions and frame gaps.
+
+Usage:
+    python -m gemspa.synthetic -o /tmp/synth --tracks 10000 --replicates 2 \
+        --condition ctrl:0.2:1.0 --condition drug:0.05:0.7
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+# rows x padded-length elements generated per batch
+_BATCH_ELEMS = 1 << 22
+
+
+def track_lengths(n_tracks, rng, min_len=11, mean_len=30, max_len=200, dist='geometric'):
+    """Track lengths (frames): 'fixed' (all mean_len) or 'geometric' above min_len."""
+    if dist == 'fixed':
+        return np.full(n_tracks, int(mean_len), dtype=np.int64)
+    if dist != 'geometric':
+        raise ValueError(f"Unknown length distribution {dist!r}")
+    extra = rng.geometric(1.0 / max(1.0, mean_len - min_len + 1), size=n_tracks) - 1
+    return np.minimum(min_len + extra, max_len).astype(np.int64)
+
+
+def _fgn_batch(n_rows, n, hurst, rng):
+    """
+    Unit-variance fractional Gaussian noise, shape (n_rows, n), by circulant
+    embedding (Davies-Harte); hurst = 0.5 gives white noise.
+    """
+    if abs(hurst - 0.5) < 1e-12:
+        return rng.standard_normal((n_rows, n))
+    k = np.arange(n + 1, dtype=np.float64)
+    gamma = 0.5 * (np.abs(k + 1) ** (2 * hurst) - 2 * k ** (2 * hurst)
+                   + np.abs(k - 1) ** (2 * hurst))
+    row = np.concatenate((gamma, gamma[-2:0:-1]))
+    lam = np.clip(np.fft.fft(row).real, 0.0, None)
+    m = row.size
+    w = rng.standard_normal((n_rows, m)) + 1j * rng.standard_normal((n_rows, m))
+    z = np.fft.fft(np.sqrt(lam / m) * w, axis=1)
+    return z.real[:, :n]
+
+
+def _place_in_image(pos, valid, image_size, rng):
+    """Translate each track (row) to a random spot with its whole extent inside the image."""
+    lo = np.where(valid, pos, np.inf).min(axis=1, keepdims=True)
+    hi = np.where(valid, pos, -np.inf).max(axis=1, keepdims=True)
+    room = np.clip(image_size - 1 - (hi - lo), 0, None)
+    return pos - lo + rng.uniform(0, 1, size=lo.shape) * room
+
+
+def simulate_tracks(n_tracks, D=0.2, alpha=1.0, time_step=0.010, micron_per_px=0.11,
+                    min_len=11, mean_len=30, max_len=200, length_dist='geometric',
+                    gap_prob=0.0, D_spread=0.0, image_size=512, seed=0):
+    """
+    Simulate n_tracks 2-D tracks as a DataFrame (track_id, frame, x, y) in pixels,
+    each placed wholly inside an image_size x image_size field.
+
+    Per-axis displacements follow fBm with Hurst alpha/2 scaled so that
+    MSD(t) = 4*D*t^alpha. D_spread > 0 draws per-track D log-normally around D.
+    gap_prob drops each interior frame with that probability (frame numbers
+    keep the gap). Returns (df, truth) with truth holding per-track D/alpha.
+    """
+    rng = np.random.default_rng(seed)
+    hurst = min(max(alpha, 0.02), 1.98) / 2.0
+    lengths = track_lengths(n_tracks, rng, min_len, mean_len, max_len, length_dist)
+    D_tr = D * np.exp(D_spread * rng.standard_normal(n_tracks)) if D_spread > 0 \
+        else np.full(n_tracks, float(D))
+    step_scale = np.sqrt(2.0 * D_tr * time_step ** alpha) / micron_per_px
+
+    ids, frames, xs, ys = [], [], [], []
+    order = np.argsort(lengths, kind='stable')
+    start = 0
+    while start < n_tracks:
+        n = int(lengths[order[start]])
+        # batch tracks of similar length: pad to the longest in the batch
+        rows = max(1, _BATCH_ELEMS // (2 * n))
+        sel = order[start:start + rows]
+        n = int(lengths[sel].max())
+        fx = _fgn_batch(sel.size, n - 1, hurst, rng)
+        fy = _fgn_batch(sel.size, n - 1, hurst, rng)
+        zero = np.zeros((sel.size, 1))
+        px = np.concatenate((zero, np.cumsum(fx * step_scale[sel, None], axis=1)), axis=1)
+        py = np.concatenate((zero, np.cumsum(fy * step_scale[sel, None], axis=1)), axis=1)
+        valid = np.arange(n)[None, :] < lengths[sel][:, None]
+        px = _place_in_image(px, valid, image_size, rng)
+        py = _place_in_image(py, valid, image_size, rng)
+        if gap_prob > 0:
+            drop = rng.random(valid.shape) < gap_prob
+            drop[:, 0] = False
+            valid &= ~drop
+        r, c = np.nonzero(valid)
+        ids.append(sel[r] + 1)
+        frames.append(c)
+        xs.append(px[r, c])
+        ys.append(py[r, c])
+        start += sel.size
+
+    df = pd.DataFrame({
+        'track_id': np.concatenate(ids),
+        'frame':    np.concatenate(frames).astype(np.int32),
+        'x':        np.concatenate(xs),
+        'y':        np.concatenate(ys),
+    }).sort_values(['track_id', 'frame'], kind='mergesort').reset_index(drop=True)
+    truth = pd.DataFrame({'track_id': np.arange(1, n_tracks + 1),
+                          'D_true': D_tr, 'alpha_true': float(alpha)})
+    return df, truth
+
+
+def write_synthetic_dataset(out_dir, conditions, n_tracks, replicates=1, seed=0,
+                            image_size=512, write_images=False, **track_kwargs):
+    """
+    Write Traj_<cond>_<rep>.csv for each condition (name -> (D, alpha)) and
+    replicate; optionally a MAX_<cond>.tif background per condition.
+    Returns a list of dicts describing the files written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for ci, (cond, (D, alpha)) in enumerate(sorted(conditions.items())):
+        for r in range(1, replicates + 1):
+            df, _ = simulate_tracks(n_tracks, D=D, alpha=alpha, image_size=image_size,
+                                    seed=seed + 1000 * ci + r, **track_kwargs)
+            path = os.path.join(out_dir, f"Traj_{cond}_{r:03d}.csv")
+            df.to_csv(path, index=False, float_format='%.4f')
+            written.append({'path': path, 'condition': cond, 'replicate': r,
+                            'D': D, 'alpha': alpha, 'tracks': n_tracks, 'rows': len(df),
+                            'bytes': os.path.getsize(path)})
+        if write_images:
+            from tifffile import imwrite
+            rng = np.random.default_rng(seed + ci)
+            img = rng.integers(0, 4096, size=(image_size, image_size), dtype=np.uint16)
+            imwrite(os.path.join(out_dir, f"MAX_{cond}.tif"), img)
+    return written
+
+
+def _parse_condition(text):
+    name, D, alpha = text.split(':')
+    return name, (float(D), float(alpha))
+
+
+def main():
+    p = argparse.ArgumentParser(description="Write synthetic Traj_<cond>_<rep>.csv files")
+    p.add_argument('-o', '--out-dir', required=True)
+    p.add_argument('--condition', action='append', type=_parse_condition,
+                   help="name:D:alpha (repeatable; default ctrl:0.2:1.0 and slow:0.05:0.7)")
+    p.add_argument('--tracks', type=int, default=10000)
+    p.add_argument('--replicates', type=int, default=1)
+    p.add_argument('--min-len', type=int, default=11)
+    p.add_argument('--mean-len', type=float, default=30)
+    p.add_argument('--max-len', type=int, default=200)
+    p.add_argument('--length-dist', choices=['geometric', 'fixed'], default='geometric')
+    p.add_argument('--gap-prob', type=float, default=0.0)
+    p.add_argument('--D-spread', type=float, default=0.0)
+    p.add_argument('--images', action='store_true', help="Also write MAX_<cond>.tif backgrounds")
+    p.add_argument('--seed', type=int, default=0)
+    args = p.parse_args()
+
+    conditions = dict(args.condition or [('ctrl', (0.2, 1.0)), ('slow', (0.05, 0.7))])
+    for rec in write_synthetic_dataset(
+            args.out_dir, conditions, args.tracks, args.replicates, args.seed,
+            write_images=args.images, min_len=args.min_len, mean_len=args.mean_len,
+            max_len=args.max_len, length_dist=args.length_dist,
+            gap_prob=args.gap_prob, D_spread=args.D_spread):
+        print(f"wrote {rec['path']} ({rec['rows']} rows, {rec['bytes'] / 2**20:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
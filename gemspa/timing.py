@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+timing.py
+
+Lightweight per-stage instrumentation: wall time, CPU time, peak RSS and
+item counts (tracks, points, steps, ...) for each pipeline stage, written
+as machine-readable JSON. Optional cProfile capture for --profile runs, and
+cold import cost of the package and of each stage's module.
+"""
+import io
+import os
+import sys
+import json
+import time
+import subprocess
+import pstats
+import cProfile
+import datetime
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# module each pipeline stage imports on first use
+STAGE_MODULES = {
+    'package':            'gemspa',
+    'trajectory_io':      'gemspa.trajectory_io',
+    'msd_fit':            'gemspa.msd_diffusion',
+    'replicate':          'gemspa.trajectory_analysis',
+    'plots':              'matplotlib.pyplot',
+    'rainbow_tracks':     'gemspa.rainbow_tracks',
+    'step_size_analysis': 'gemspa.step_size_analysis',
+    'run_ensemble':       'gemspa.ensemble_analysis',
+    'compare_conditions': 'gemspa.compare_conditions',
+}
+# third-party packages worth reporting when an import pulls them in
+HEAVY_MODULES = ('numba', 'scipy', 'matplotlib', 'seaborn', 'skimage', 'tifffile', 'joblib')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (None if unavailable)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+class stage_timer:
+    """
+    Collects one record per stage:
+        with timer.stage('msd') as st:
+            ...
+            st['tracks'] = n
+    """
+
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, **counts):
+        rec = dict(counts)
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        try:
+            yield rec
+        finally:
+            rec.update({
+                'stage':       name,
+                'wall_s':      time.perf_counter() - wall0,
+                'cpu_s':       time.process_time() - cpu0,
+                'peak_rss_mb': peak_rss_mb(),
+            })
+            self.records.append(rec)
+
+    def total_wall(self):
+        return sum(r['wall_s'] for r in self.records)
+
+    def to_dict(self, **meta):
+        return {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            **meta,
+            'total_wall_s': self.total_wall(),
+            'stages': self.records,
+        }
+
+    def write_json(self, path, **meta):
+        with open(path, 'w') as fh:
+            json.dump(self.to_dict(**meta), fh, indent=1)
+
+
+def rollup(replicate_timings):
+    """
+    Combine per-replicate timing dicts (as from stage_timer.to_dict) into
+    per-stage totals: calls, wall/cpu sums, max wall, max peak RSS and
+    summed item counts.
+    """
+    stages = {}
+    for rep in replicate_timings:
+        for rec in rep.get('stages', []):
+            agg = stages.setdefault(rec['stage'], {
+                'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                'max_wall_s': 0.0, 'max_peak_rss_mb': None,
+            })
+            agg['calls'] += 1
+            agg['wall_s'] += rec['wall_s']
+            agg['cpu_s'] += rec['cpu_s']
+            agg['max_wall_s'] = max(agg['max_wall_s'], rec['wall_s'])
+            if rec.get('peak_rss_mb') is not None:
+                agg['max_peak_rss_mb'] = max(agg['max_peak_rss_mb'] or 0.0, rec['peak_rss_mb'])
+            for k, v in rec.items():
+                if k in ('stage', 'wall_s', 'cpu_s', 'peak_rss_mb'):
+                    continue
+                if isinstance(v, (int, float)):
+                    agg[k] = agg.get(k, 0) + v
+    return stages
+
+
+@contextmanager
+def profiled(prof_path, top=40):
+    """
+    cProfile the enclosed block; write stats to prof_path and a text summary
+    (top functions by cumulative time) next to it with a .txt suffix.
+    """
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield prof
+    finally:
+        prof.disable()
+        prof.dump_stats(prof_path)
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats('cumulative').print_stats(top)
+        with open(prof_path.rsplit('.', 1)[0] + '.txt', 'w') as fh:
+            fh.write(buf.getvalue())
+
+
+def import_time(module):
+    """
+    Cold import of `module` in a fresh interpreter.
+    Returns (seconds, heavy third-party packages it loaded).
+    """
+    code = (
+        "import sys, time\n"
+        "t = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - t)\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    pkg_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        p for p in (pkg_root, os.environ.get('PYTHONPATH')) if p))
+    out = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                         capture_output=True, text=True).stdout.splitlines()
+    return float(out[0]), [m for m in out[1].split(',') if m]
+
+
+def import_report(modules=None):
+    """Cold import time and heavy dependencies for each stage in STAGE_MODULES."""
+    report = {}
+    for stage, module in (modules or STAGE_MODULES).items():
+        seconds, loads = import_time(module)
+        report[stage] = {'module': module, 'seconds': seconds, 'loads': loads}
+    return report
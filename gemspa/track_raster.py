@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+track_raster.py
+
+Compiled rasterisation of track segments for the rainbow overlays.
+
+Points are joined to their track's D once: a stable sort by track_id and
+np.searchsorted replace the per-track boolean scans, and segment colours
+come from one vectorised colormap lookup. All segments are then drawn in
+a single serial kernel pass, in the order the per-track loop drew them
+(results_df rows, then points), so later segments still overwrite earlier
+ones. The default mode reproduces skimage.draw.line pixel for pixel,
+including int() truncation of the coordinates and numpy's wrap of
+negative indices; line_px > 1 widens each line to a square pen and
+antialias=True blends distance-based coverage of a line line_px wide.
+"""
+import numpy as np
+from numba import njit, float64, int64, int32, uint8
+
+from .msd_diffusion import track_offsets, lazy_njit
+
+_LABEL_SIG = (int64[::1], int64[::1], int64[::1], int64[::1], int64, int64, int32[:, ::1])
+_AA_SIG = (float64[::1], float64[::1], float64[::1], float64[::1], float64,
+           uint8[:, ::1], float64[:, :, ::1])
+
+
+@njit(cache=True)
+def _put(label, r, c, k):
+    h, w = label.shape
+    # numpy indexing: negative indices wrap once, anything else is off-image
+    if r < 0:
+        r += h
+    if c < 0:
+        c += w
+    if 0 <= r < h and 0 <= c < w:
+        label[r, c] = k
+
+
+@njit(cache=True)
+def _stamp(label, r, c, k, half):
+    for dr in range(-half, half + 1):
+        for dc in range(-half, half + 1):
+            _put(label, r + dr, c + dc, k)
+
+
+@lazy_njit(_LABEL_SIG)
+def _label_segments(r0, c0, r1, c1, half, first, label):
+    """
+    Bresenham line of every segment k (the algorithm of skimage.draw.line),
+    writing first + k into label; the last segment over a pixel owns it.
+    half > 0 stamps a (2*half + 1)^2 square at each line pixel.
+    """
+    for i in range(r0.shape[0]):
+        k = first + i
+        r = r0[i]
+        c = c0[i]
+        dr = abs(r1[i] - r)
+        dc = abs(c1[i] - c)
+        sc = 1 if c1[i] - c > 0 else -1
+        sr = 1 if r1[i] - r > 0 else -1
+        steep = dr > dc
+        if steep:
+            r, c = c, r
+            dr, dc = dc, dr
+            sr, sc = sc, sr
+        d = 2 * dr - dc
+        for _ in range(dc):
+            if steep:
+                _stamp(label, c, r, k, half)
+            else:
+                _stamp(label, r, c, k, half)
+            while d >= 0:
+                r += sr
+                d -= 2 * dc
+            c += sc
+            d += 2 * dr
+        _stamp(label, r1[i], c1[i], k, half)
+
+
+@lazy_njit(_AA_SIG)
+def _blend_segments(x0, y0, x1, y1, width, colors, canvas):
+    """
+    Anti-aliased segments of `width` pixels: each pixel within reach is
+    blended toward the segment colour by its coverage, clip(width/2 + 0.5
+    - distance from the pixel centre to the segment, 0, 1).
+    """
+    h, w = canvas.shape[0], canvas.shape[1]
+    reach = width / 2.0 + 0.5
+    for k in range(x0.shape[0]):
+        ax, ay, bx, by = x0[k], y0[k], x1[k], y1[k]
+        vx, vy = bx - ax, by - ay
+        vv = vx * vx + vy * vy
+        c_lo = max(int(np.floor(min(ax, bx) - reach)), 0)
+        c_hi = min(int(np.ceil(max(ax, bx) + reach)), w - 1)
+        r_lo = max(int(np.floor(min(ay, by) - reach)), 0)
+        r_hi = min(int(np.ceil(max(ay, by) + reach)), h - 1)
+        for r in range(r_lo, r_hi + 1):
+            py = r + 0.5
+            for c in range(c_lo, c_hi + 1):
+                px = c + 0.5
+                t = 0.0
+                if vv > 0.0:
+                    t = min(max(((px - ax) * vx + (py - ay) * vy) / vv, 0.0), 1.0)
+                ex = px - (ax + t * vx)
+                ey = py - (ay + t * vy)
+                a = reach - np.sqrt(ex * ex + ey * ey)
+                if a <= 0.0:
+                    continue
+                a = min(a, 1.0)
+                for ch in range(3):
+                    canvas[r, c, ch] += a * (colors[k, ch] - canvas[r, c, ch])
+
+
+def warmup_raster():
+    """Load the raster kernels (see msd_diffusion.warmup_kernels)."""
+    seg = np.array([0, 1], dtype=np.int64)
+    _label_segments(seg, seg, seg[::-1].copy(), seg, 0, 0, np.full((2, 2), -1, dtype=np.int32))
+    pos = seg.astype(np.float64)
+    _blend_segments(pos, pos, pos, pos, 1.0, np.zeros((2, 3), dtype=np.uint8),
+                    np.zeros((2, 2, 3)))
+
+
+def _match_ids(raw_ids, res_ids):
+    """Comparable id arrays: numeric ids by value, anything else as strings."""
+    if raw_ids.dtype.kind in 'iuf' and res_ids.dtype.kind in 'iuf':
+        return raw_ids, res_ids
+    return raw_ids.astype(str), res_ids.astype(str)
+
+
+def track_segments(raw_df, results_df, id_col='track_id', x_col='x', y_col='y',
+                   D_col='D_fit', point_D_col=None, frame_col=None):
+    """
+    Segments of every results_df track, in drawing order: results_df rows,
+    then consecutive raw_df rows of that track. Returns (x0, y0, x1, y1, D)
+    arrays; D is the track's D, or the segment's first point_D_col value
+    where that is not NaN. With frame_col, the frame of each segment's end
+    point is appended.
+    """
+    raw_ids, res_ids = _match_ids(raw_df[id_col].to_numpy(), results_df[id_col].to_numpy())
+    order = np.argsort(raw_ids, kind='stable')
+    sorted_ids = raw_ids[order]
+    offsets = track_offsets(sorted_ids)
+    uniq = sorted_ids[offsets[:-1]]
+
+    pos = np.minimum(np.searchsorted(uniq, res_ids), max(uniq.size - 1, 0))
+    found = uniq[pos] == res_ids if uniq.size else np.zeros(res_ids.size, dtype=bool)
+    rows = np.nonzero(found)[0]
+    start = offsets[pos[rows]]
+    n_seg = np.maximum(offsets[pos[rows] + 1] - start - 1, 0)
+    first = np.repeat(start - np.cumsum(n_seg) + n_seg, n_seg) + np.arange(n_seg.sum())
+    p0 = order[first]
+    p1 = order[first + 1]
+
+    x = raw_df[x_col].to_numpy(dtype=np.float64)
+    y = raw_df[y_col].to_numpy(dtype=np.float64)
+    D = np.repeat(results_df[D_col].to_numpy(dtype=np.float64)[rows], n_seg)
+    if point_D_col is not None:
+        pD = raw_df[point_D_col].to_numpy(dtype=np.float64)[p0]
+        D = np.where(np.isnan(pD), D, pD)
+    if frame_col is not None:
+        return x[p0], y[p0], x[p1], y[p1], D, raw_df[frame_col].to_numpy()[p1]
+    return x[p0], y[p0], x[p1], y[p1], D
+
+
+def pixel_coords(x0, y0, x1, y1):
+    """int() truncation of segment coordinates, as (r0, c0, r1, c1)."""
+    return tuple(np.asarray(a, dtype=np.float64).astype(np.int64) for a in (y0, x0, y1, x1))
+
+
+def draw_labels(label, r0, c0, r1, c1, line_px=1, first=0):
+    """Draw segments (pixel_coords) into label in place, segment i as first + i."""
+    _label_segments(r0, c0, r1, c1, int(line_px) // 2, first, label)
+    return label
+
+
+def label_segments(shape, x0, y0, x1, y1, line_px=1):
+    """(h, w) int32 plane holding the index of the segment drawn last at each pixel, or -1."""
+    label = np.full(shape[:2], -1, dtype=np.int32)
+    return draw_labels(label, *pixel_coords(x0, y0, x1, y1), line_px)
+
+
+def rasterize_segments(canvas, x0, y0, x1, y1, colors, line_px=1, antialias=False):
+    """
+    Draw segments (pixel coordinates, x = column) with uint8 RGB `colors`
+    into canvas (h x w x >= 3) in place.
+    """
+    colors = np.ascontiguousarray(colors, dtype=np.uint8)
+    if antialias:
+        rgb = np.ascontiguousarray(canvas[..., :3], dtype=np.float64)
+        _blend_segments(*(np.ascontiguousarray(a, dtype=np.float64) for a in (x0, y0, x1, y1)),
+                        float(line_px), colors, rgb)
+        if canvas.dtype.kind in 'iu':
+            info = np.iinfo(canvas.dtype)
+            rgb = np.clip(np.rint(rgb), info.min, info.max)
+        canvas[..., :3] = rgb
+        return canvas
+    label = label_segments(canvas.shape, x0, y0, x1, y1, line_px)
+    drawn = label >= 0
+    canvas[drawn, :3] = colors[label[drawn]]
+    return canvas
@@ -4,23 +4,50 @@
 import os
 import re
 import glob
+import shutil
 import datetime
+import tempfile
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import ndimage
-from tifffile import imread
-from joblib import Parallel, delayed, parallel_backend
-import numba
-from numba import njit, prange
-from multiprocessing import cpu_count
 
-from .msd_diffusion import msd_diffusion
-from .rainbow_tracks import draw_rainbow_tracks
+from .msd_diffusion import msd_diffusion, track_offsets
+from .trajectory_io import (
+    load_trajectories, CACHE_DIR_NAME, UnsortedTracksError, rows_for_budget,
+    iter_trajectory_chunks, iter_complete_tracks, iter_spilled_tracks
+)
+from .step_store import step_store_writer, write_wide_steps, STEP_STORE_NAME
+from .angle_analysis import (
+    angle_store_writer, long_angles, processor_stats, empty_stats, merge_stats,
+    save_stats, write_angle_tables, ANGLE_STORE_NAME, ANGLE_DIR_NAME, ANGLE_STATS_NAME
+)
+from .ensemble_msd import msd_accumulator, eamsd_rows, write_ensemble_msd, ENSEMBLE_MSD_DIR
+from .results_store import results_writer
+from .local_diffusivity import (
+    local_windows, track_summary, local_store_writer, LOCAL_STORE_NAME, LOCAL_SUMMARY_NAME
+)
+from .plot_queue import (
+    plot_queue, results_plot_jobs, render_plot_jobs, plot_D_distribution, plot_alpha_vs_logD
+)
+from .resources import configure_worker_threads, available_cores
+from .timing import stage_timer
+
+def analysis_params(condition, time_step, micron_per_px, min_track_len_linfit,
+                    tlag_cutoff_linfit, fit_mode='fast', max_msd_lag=None):
+    """Per-replicate analysis parameters as written to params_log.csv."""
+    return {
+        'condition':             condition,
+        'time_step':             time_step,
+        'micron_per_px':         micron_per_px,
+        'min_track_len_linfit':  min_track_len_linfit,
+        'tlag_cutoff_linfit':    tlag_cutoff_linfit,
+        'fit_mode':              fit_mode,
+        'max_msd_lag':           max_msd_lag
+    }
 
 class trajectory_analysis:
     """
-    MSD, diffusion, rainbow overlay, and step-size export for single-particle tracking.
+    MSD, diffusion, rainbow overlay, step-size, turning-angle and
+    sliding-window (local) diffusivity export for single-particle tracking.
     """
 
     def __init__(
@@ -33,6 +60,8 @@ class trajectory_analysis:
         ts_resolution=0.005,
         min_track_len_linfit=11,
         tlag_cutoff_linfit=10,
+        fit_mode='fast',
+        max_msd_lag=None,
         make_rainbow_tracks=False,
         img_file_prefix='MAX_',
         rainbow_min_D=0.0,
@@ -40,14 +69,34 @@ class trajectory_analysis:
         rainbow_colormap='viridis',
         rainbow_scale=1.0,
         rainbow_dpi=200,
+        rainbow_color_by='track',
+        rainbow_line_px=1,
+        rainbow_antialias=False,
+        rainbow_tiled=False,
+        rainbow_format='png',
+        rainbow_tile_size=1024,
+        rainbow_cache_dir=None,
+        rainbow_movie=None,
+        rainbow_movie_fps=10,
+        rainbow_trail=0,
         n_jobs=1,
         threads_per_rep=None,
-        log_file=None
+        log_file=None,
+        use_cache=True,
+        stream=False,
+        memory_budget_mb=1024,
+        plot_mode='inline',
+        legacy_step_tsv=False,
+        angle_bins=18,
+        angle_max_tau=10,
+        local_window=10,
+        local_max_lag=3,
+        results_store=None
     ):
         # decide processes & threads per replicate
         self.n_jobs = n_jobs
         if threads_per_rep is None:
-            self.threads_per_rep = max(1, cpu_count() // max(1, self.n_jobs))
+            self.threads_per_rep = max(1, available_cores() // max(1, self.n_jobs))
         else:
             self.threads_per_rep = threads_per_rep
 
@@ -56,11 +105,14 @@ class trajectory_analysis:
         self.results_dir          = results_dir
         base = os.path.splitext(os.path.basename(self.data_file))[0]
         self.condition            = condition or re.sub(r'_[0-9]+$', '', base)
+        self.replicate            = base[len('Traj_'):] if base.startswith('Traj_') else base
         self.time_step            = time_step
         self.micron_per_px        = micron_per_px
         self.ts_resolution        = ts_resolution
         self.min_track_len_linfit = min_track_len_linfit
         self.tlag_cutoff_linfit   = tlag_cutoff_linfit
+        self.fit_mode             = fit_mode
+        self.max_msd_lag          = max_msd_lag
         self.make_rainbow_tracks  = make_rainbow_tracks
         self.img_prefix           = img_file_prefix
         self.rainbow_min_D        = rainbow_min_D
@@ -69,69 +121,119 @@ class trajectory_analysis:
         self.rainbow_scale        = rainbow_scale
         self.rainbow_dpi          = rainbow_dpi
         self.rainbow_line_width   = 0.1
+        self.rainbow_color_by     = rainbow_color_by
+        self.rainbow_line_px      = rainbow_line_px
+        self.rainbow_antialias    = rainbow_antialias
+        self.rainbow_tiled        = rainbow_tiled
+        self.rainbow_format       = rainbow_format
+        self.rainbow_tile_size    = rainbow_tile_size
+        self.rainbow_cache_dir    = rainbow_cache_dir
+        self.rainbow_movie        = rainbow_movie
+        self.rainbow_movie_fps    = rainbow_movie_fps
+        self.rainbow_trail        = rainbow_trail
+        self.stream               = stream
+        self.memory_budget_mb     = memory_budget_mb
+        self.plot_mode            = plot_mode
+        self.legacy_step_tsv      = legacy_step_tsv
+        self.angle_bins           = angle_bins
+        self.angle_max_tau        = angle_max_tau
+        self.local_window         = local_window
+        self.local_max_lag        = local_max_lag
+        self.results_store        = results_store
+        self._steps_computed      = False
+        self.ensemble_stats       = None
+        self._local               = None
 
-        # prepare output & logging
+        # prepare output, logging & per-stage timings
+        self.timer = stage_timer()
         os.makedirs(self.results_dir, exist_ok=True)
         ts = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
         logn = log_file or f"{base}_{ts}.log"
         self.log = open(os.path.join(self.results_dir, logn), 'w')
 
-        # load & sanitize input CSV
-        sep = '\t' if '\t' in open(data_file).read(1000) else ','
-        df = pd.read_csv(data_file, sep=sep)
-        df.columns = [c.strip().lower() for c in df.columns]
-        if 'trajectory' in df.columns:
-            df = df.rename(columns={'trajectory': 'track_id'})
-        for req in ('track_id', 'frame', 'x', 'y'):
-            if req not in df.columns:
-                raise KeyError(f"Input CSV missing required column '{req}'")
-        self.raw_df = df
-        self.raw_df['condition'] = self.condition
+        # size Numba/BLAS pools to this replicate's share of the cores
+        self.log.write(f"threads: {configure_worker_threads(self.threads_per_rep)}\n")
 
         # MSD / diffusion helper
         self.msd_processor = msd_diffusion(save_dir=self.results_dir)
 
+        if self.stream:
+            # rows are read chunk by chunk in run_streaming()
+            self.raw_df = None
+            return
 
-    @staticmethod
-    @njit(parallel=True)
-    def _compute_msd(coords, max_lag):
-        n = coords.shape[0]
-        out = np.zeros(max_lag)
-        for lag in prange(1, max_lag+1):
-            d = coords[lag:] - coords[:n-lag]
-            out[lag-1] = np.mean(d[:,0]**2 + d[:,1]**2) if d.size else 0.0
-        return out
+        # load & sanitize input CSV (delimiter sniffing, aliases, C engine),
+        # or memory-map the binary cache of a previous parse
+        cache_dir = os.path.join(self.results_dir, CACHE_DIR_NAME) if use_cache else None
+        with self.timer.stage('load') as st:
+            self.raw_df, load_info = load_trajectories(data_file, cache_dir)
+            st.update(rows=load_info['rows'], engine=load_info['engine'])
+        self.log.write(
+            f"loaded {load_info['rows']} rows from {os.path.basename(data_file)} "
+            f"in {load_info['seconds']:.3f}s (engine={load_info['engine']})\n"
+        )
+        self.raw_df['condition'] = self.condition
 
 
-    def _one_track(self, grp):
-        coords = grp[['x','y']].to_numpy() * self.micron_per_px
-        max_lag = min(self.tlag_cutoff_linfit, coords.shape[0]-1)
-        msd_v = self._compute_msd(coords, max_lag)
-        return self.msd_processor.fit_msd(msd_v, self.time_step)
+    def _track_msd_matrix(self, df=None, eamsd=False, track_lengths=False):
+        """
+        Sort once by (track_id, frame), keep tracks >= min_track_len_linfit and
+        compute every track's MSD in a single batched kernel call, up to
+        max(max_msd_lag, tlag_cutoff_linfit) lags (FFT path for long curves).
+        Returns (track ids, MSD matrix of shape n_tracks x n_lags), plus the
+        matching ensemble-averaged rows (eamsd_rows) with eamsd=True and the
+        track lengths in points with track_lengths=True.
+        """
+        if df is None:
+            df = self.raw_df
+        df = df.sort_values(['track_id', 'frame'], kind='mergesort')
+        ids = df['track_id'].to_numpy()
+        offsets = track_offsets(ids)
+        lengths = np.diff(offsets)
+        keep = lengths >= self.min_track_len_linfit
+        if not keep.all():
+            rows = np.repeat(keep, lengths)
+            df, ids = df[rows], ids[rows]
+            offsets = track_offsets(ids)
+
+        x = df['x'].to_numpy(dtype=np.float64) * self.micron_per_px
+        y = df['y'].to_numpy(dtype=np.float64) * self.micron_per_px
+        max_lag = max(self.max_msd_lag or 0, self.tlag_cutoff_linfit)
+        msd = self.msd_processor.msd_batch(x, y, offsets, max_lag)
+        out = (ids[offsets[:-1]], msd)
+        if eamsd:
+            out += (eamsd_rows(x, y, offsets, max_lag),)
+        if track_lengths:
+            out += (np.diff(offsets),)
+        return out
 
 
     def calculate_msd_and_diffusion(self):
         """
-        Parallel per-track MSD→D/alpha, save results & plots, and optional rainbow overlay.
+        Batched all-track MSD and D/alpha fits, save results, ensemble MSD
+        statistics & plots, and optional rainbow overlay.
         """
-        tracks = [
-            grp for _, grp in self.raw_df.groupby('track_id')
-            if len(grp) >= self.min_track_len_linfit
-        ]
+        with self.timer.stage('msd', points=len(self.raw_df)) as st:
+            track_ids, msd, eamsd, lengths = self._track_msd_matrix(eamsd=True, track_lengths=True)
+            st.update(tracks=len(track_ids), lags=msd.shape[1])
+        if msd.shape[1] > self.tlag_cutoff_linfit:
+            np.savez(
+                os.path.join(self.results_dir, 'msd_curves.npz'),
+                track_id=track_ids.astype(str) if track_ids.dtype == object else track_ids,
+                msd=msd,
+                time_step=self.time_step
+            )
 
-        # per-track fits using threads_per_rep threads
-        with parallel_backend('threading'):
-            results = Parallel(n_jobs=self.threads_per_rep)(
-                delayed(self._one_track)(grp) for grp in tracks
+        # batch fits; per-track fallbacks use threads_per_rep threads
+        with self.timer.stage('fit', tracks=len(track_ids), mode=self.fit_mode):
+            D_vals, alpha_vals, r2_vals = self.msd_processor.fit_msd_batch(
+                msd[:, :self.tlag_cutoff_linfit], self.time_step,
+                mode=self.fit_mode, n_jobs=self.threads_per_rep
             )
 
         # assemble results
-        ids, D_vals, alpha_vals, r2_vals = zip(
-            *[(grp['track_id'].iloc[0], *res)
-              for grp, res in zip(tracks, results)]
-        )
         self.results_df = pd.DataFrame({
-            'track_id':  ids,
+            'track_id':  track_ids,
             'condition': self.condition,
             'D_fit':     D_vals,
             'alpha_fit': alpha_vals,
@@ -142,11 +244,52 @@ class trajectory_analysis:
         self.results_df.to_csv(
             os.path.join(self.results_dir, 'msd_results.csv'), index=False
         )
-        self.make_plot()
-        self.make_scatter()
+        if self.results_store:
+            with self._results_writer() as rw:
+                rw.append(track_ids, lengths, D_vals, alpha_vals, r2_vals)
+        with self._ensemble_accumulator(msd.shape[1]) as acc:
+            acc.add(msd, eamsd, D_vals, alpha_vals)
+        self.ensemble_stats = acc.stats
+        self._queue_plots()
 
         # rainbow overlay
         if self.make_rainbow_tracks:
+            self._draw_rainbow()
+
+
+    def _results_writer(self):
+        """Writer of this replicate's partition of the results store."""
+        os.makedirs(self.results_store, exist_ok=True)
+        return results_writer(self.results_store, self.condition,
+                              os.path.basename(os.path.abspath(self.results_dir)))
+
+
+    def _ensemble_accumulator(self, n_lags):
+        return msd_accumulator(os.path.join(self.results_dir, ENSEMBLE_MSD_DIR), n_lags,
+                               self.time_step, self.tlag_cutoff_linfit)
+
+
+    def _queue_plots(self):
+        """
+        Write the replicate's msd_vs_tau.csv / msd_fit.csv and spool its plot
+        jobs to plot_jobs.json; plot_mode 'inline' also draws them now,
+        'deferred' leaves them to a plot_renderer.
+        """
+        queue = plot_queue(self.results_dir)
+        results_plot_jobs(queue, os.path.join(self.results_dir, 'msd_results.csv'),
+                          self.condition)
+        if self.ensemble_stats is not None:
+            write_ensemble_msd(self.results_dir, self.ensemble_stats, queue, self.condition)
+        queue.save()
+        if self.plot_mode == 'inline':
+            with self.timer.stage('plots', plots=len(queue.jobs)):
+                for out, err in render_plot_jobs(queue.resolved()):
+                    if err:
+                        self.log.write(f"WARNING: plot {os.path.basename(out)} failed: {err}\n")
+
+
+    def _draw_rainbow(self):
+        with self.timer.stage('rainbow_tracks', tracks=len(self.results_df)):
             base = os.path.splitext(os.path.basename(self.data_file))[0]
             rep  = base.replace('Traj_', '')
             cond = self.condition
@@ -164,78 +307,313 @@ class trajectory_analysis:
                 self.log.write(f"WARNING: no TIFF matching any of {patterns}\n")
                 return
 
+            # skimage/matplotlib load only when overlays are requested
+            from .rainbow_tracks import draw_rainbow_tracks
             img_path = matches[0]
+            raw_df, point_D_col = self.raw_df, None
+            if self.rainbow_color_by == 'local':
+                raw_df = raw_df.assign(D_local=self.local_point_D())
+                point_D_col = 'D_local'
             draw_rainbow_tracks(
                 image_path=img_path,
-                raw_df=self.raw_df,
+                raw_df=raw_df,
                 results_df=self.results_df,
-                output_path=os.path.join(self.results_dir, 'rainbow_tracks.png'),
+                point_D_col=point_D_col,
+                output_path=os.path.join(self.results_dir, self.rainbow_output_name()),
                 min_D=self.rainbow_min_D,
                 max_D=self.rainbow_max_D,
                 colormap=self.rainbow_colormap,
                 scale=self.rainbow_scale,
                 dpi=self.rainbow_dpi,
-                line_width=self.rainbow_line_width
+                line_width=self.rainbow_line_width,
+                line_px=self.rainbow_line_px,
+                antialias=self.rainbow_antialias,
+                tiled=self.rainbow_tiled,
+                tile_size=self.rainbow_tile_size,
+                cache_dir=self.rainbow_cache_dir
             )
 
+        if self.rainbow_movie:
+            from .rainbow_movie import render_rainbow_movie
+            with self.timer.stage('rainbow_movie', tracks=len(self.results_df)) as st:
+                st['frames'] = render_rainbow_movie(
+                    image_path=img_path,
+                    raw_df=raw_df,
+                    results_df=self.results_df,
+                    output_path=os.path.join(self.results_dir, self.rainbow_movie_name()),
+                    point_D_col=point_D_col,
+                    min_D=self.rainbow_min_D,
+                    max_D=self.rainbow_max_D,
+                    colormap=self.rainbow_colormap,
+                    line_px=self.rainbow_line_px,
+                    trail=self.rainbow_trail,
+                    scale=self.rainbow_scale,
+                    fps=self.rainbow_movie_fps,
+                    cache_dir=self.rainbow_cache_dir
+                )
 
-    def export_step_sizes(self, max_tlag=None):
+
+    def rainbow_movie_name(self):
+        from .rainbow_movie import MOVIE_FORMATS
+        return 'rainbow_movie' + MOVIE_FORMATS[self.rainbow_movie]
+
+
+    def rainbow_output_name(self):
+        """rainbow_tracks.png, or rainbow_tracks.tif for tiled TIFF output."""
+        tiff = self.rainbow_tiled and self.rainbow_format == 'tiff'
+        return 'rainbow_tracks.tif' if tiff else 'rainbow_tracks.png'
+
+
+    def run_streaming(self, step_sizes=False, turning_angles=False, local=False):
         """
-        Export all_data_step_sizes.txt for step-size analysis.
+        Bounded-memory MSD→D/alpha (and optional step-size / turning-angle /
+        local diffusivity export): read the CSV in chunks, analyse tracks as
+        soon as they are complete and append to msd_results.csv, the
+        step/angle/local-D stores and local_D_summary.csv; angle
+        accumulators are summed batch by batch. Input not grouped by
+        track_id is re-read through spill-to-disk partitions.
+        Peak memory follows memory_budget_mb, not file size.
         """
-        df = self.raw_df[['track_id','frame','x','y']].copy()
-        df['x'] *= self.micron_per_px
-        df['y'] *= self.micron_per_px
-        arr = df.sort_values(['track_id','frame']).to_numpy()
+        budget = self.memory_budget_mb * 2**20
+        chunk_rows = rows_for_budget(budget)
+        with self.timer.stage('stream', chunk_rows=chunk_rows) as st:
+            try:
+                batches = iter_complete_tracks(iter_trajectory_chunks(self.data_file, chunk_rows))
+                n_tracks, n_rows = self._stream_batches(batches, step_sizes, turning_angles,
+                                                        local)
+            except UnsortedTracksError:
+                self.log.write("input not grouped by track_id; re-reading via spill partitions\n")
+                spill_dir = tempfile.mkdtemp(prefix='spill_', dir=self.results_dir)
+                try:
+                    batches = iter_spilled_tracks(self.data_file, chunk_rows, budget, spill_dir)
+                    n_tracks, n_rows = self._stream_batches(batches, step_sizes,
+                                                            turning_angles, local)
+                finally:
+                    shutil.rmtree(spill_dir, ignore_errors=True)
+            st.update(rows=n_rows, tracks=n_tracks)
+        self.log.write(f"streamed {n_rows} rows, fitted {n_tracks} tracks\n")
+
+        self.results_df = pd.read_csv(os.path.join(self.results_dir, 'msd_results.csv'))
+        self._queue_plots()
+        if self.make_rainbow_tracks:
+            self.log.write("WARNING: rainbow overlay needs the full table; skipped in streaming mode\n")
+
 
+    def _stream_batches(self, batches, step_sizes, turning_angles=False, local=False):
+        msd_path = os.path.join(self.results_dir, 'msd_results.csv')
+        n_tracks = n_rows = 0
+        store = step_store_writer(os.path.join(self.results_dir, STEP_STORE_NAME)) \
+            if step_sizes else None
+        angle_store = angle_store_writer(os.path.join(self.results_dir, ANGLE_STORE_NAME)) \
+            if turning_angles else None
+        local_store = local_store_writer(os.path.join(self.results_dir, LOCAL_STORE_NAME)) \
+            if local else None
+        summary_out = open(os.path.join(self.results_dir, LOCAL_SUMMARY_NAME), 'w') \
+            if local else None
+        stats = empty_stats(self.msd_processor.max_tlag_step_size,
+                            self.angle_bins, self.angle_max_tau)
+        acc = self._ensemble_accumulator(max(self.max_msd_lag or 0, self.tlag_cutoff_linfit))
+        results = self._results_writer() if self.results_store else None
+        try:
+            with open(msd_path, 'w') as out:
+                out.write('track_id,condition,D_fit,alpha_fit,r2_fit\n')
+                for batch in batches:
+                    n_rows += len(batch)
+                    track_ids, msd, eamsd, lengths = self._track_msd_matrix(
+                        batch, eamsd=True, track_lengths=True)
+                    if len(track_ids):
+                        D_vals, alpha_vals, r2_vals = self.msd_processor.fit_msd_batch(
+                            msd[:, :self.tlag_cutoff_linfit], self.time_step,
+                            mode=self.fit_mode, n_jobs=self.threads_per_rep
+                        )
+                        pd.DataFrame({
+                            'track_id':  track_ids,
+                            'condition': self.condition,
+                            'D_fit':     D_vals,
+                            'alpha_fit': alpha_vals,
+                            'r2_fit':    r2_vals
+                        }).to_csv(out, header=False, index=False)
+                        if results:
+                            results.append(track_ids, lengths, D_vals, alpha_vals, r2_vals)
+                        acc.add(msd, eamsd, D_vals, alpha_vals)
+                        n_tracks += len(track_ids)
+                    if store or angle_store:
+                        self._set_step_data(batch)
+                    if store:
+                        self._append_step_sizes(store)
+                    if angle_store:
+                        stats = merge_stats(stats, self._append_angles(angle_store))
+                    if local_store:
+                        windows, _ = self._append_local(local_store, batch)
+                        track_summary(windows).to_csv(summary_out, index=False,
+                                                      header=summary_out.tell() == 0)
+        finally:
+            acc.close()
+            if results:
+                results.close()
+            if store:
+                store.close()
+            if angle_store:
+                angle_store.close()
+            if local_store:
+                local_store.close()
+                summary_out.close()
+        if store and self.legacy_step_tsv:
+            self._write_legacy_steps()
+        if angle_store:
+            self._write_angle_stats(stats)
+        self.ensemble_stats = acc.stats
+        return n_tracks, n_rows
+
+
+    def _set_step_data(self, df):
+        """Step sizes, dX/dY and turning angles (um) of df's tracks on msd_processor."""
+        df = df[['track_id','frame','x','y']].sort_values(['track_id','frame'], kind='mergesort')
+        if df['track_id'].dtype.kind not in 'iuf':
+            # non-numeric ids: their sorted codes keep the same track order
+            df = df.assign(track_id=pd.factorize(df['track_id'], sort=True)[0])
+        arr = df.to_numpy(dtype=np.float64)
+        arr[:, 2:] *= self.micron_per_px
         self.msd_processor.set_track_data(arr)
+        self.msd_processor.step_sizes_and_angles()
+
+
+    def _append_step_sizes(self, store):
+        p = self.msd_processor
+        store.append_matrices(self.condition, self.replicate, p.step_sizes, p.deltaX, p.deltaY)
+
+
+    def _write_legacy_steps(self):
+        """Wide all_data_step_sizes.txt from the step store (same layout streamed or not)."""
+        write_wide_steps(os.path.join(self.results_dir, STEP_STORE_NAME),
+                         os.path.join(self.results_dir, 'all_data_step_sizes.txt'),
+                         self.condition, self.msd_processor.max_tlag_step_size)
+
+
+    def _append_angles(self, store):
+        """Append the processor's turning angles to store; returns their accumulators."""
+        p = self.msd_processor
+        store.append(self.condition, self.replicate, **long_angles(p.angles))
+        return processor_stats(p, self.angle_bins, self.angle_max_tau)
+
+
+    def _write_angle_stats(self, stats):
+        out_dir = os.path.join(self.results_dir, ANGLE_DIR_NAME)
+        save_stats(os.path.join(out_dir, ANGLE_STATS_NAME), stats)
+        write_angle_tables(out_dir, stats, self.condition, plots=False)
+
+
+    def _compute_step_arrays(self, max_tlag=None):
         if max_tlag is not None:
             self.msd_processor.max_tlag_step_size = max_tlag
-        self.msd_processor.step_sizes_and_angles()
+        if not self._steps_computed or max_tlag is not None:
+            self._set_step_data(self.raw_df)
+            self._steps_computed = True
+        return self.msd_processor
+
+
+    def export_step_sizes(self, max_tlag=None):
+        """
+        Export the step-size store (step_sizes.store: group, replicate, tlag,
+        step_size, dx, dy per step) for step-size analysis; with
+        legacy_step_tsv also the wide all_data_step_sizes.txt table.
+        """
+        with self.timer.stage('step_sizes', points=len(self.raw_df)) as st:
+            p = self._compute_step_arrays(max_tlag)
 
-        ss = self.msd_processor.save_step_sizes(file_name='all_data_step_sizes.txt')
-        ss = ss.rename(columns={'t': 'tlag'})
-        ss.insert(1, 'group', self.condition)
-        out = os.path.join(self.results_dir, 'all_data_step_sizes.txt')
-        ss.to_csv(out, sep='\t', index=False)
+            with step_store_writer(os.path.join(self.results_dir, STEP_STORE_NAME)) as store:
+                store.append_matrices(self.condition, self.replicate,
+                                      p.step_sizes, p.deltaX, p.deltaY)
+            st['steps'] = store.rows
 
+            if self.legacy_step_tsv:
+                self._write_legacy_steps()
+
+
+    def export_turning_angles(self):
+        """
+        Export turning angles (angles.store: group, replicate, tlag, angle)
+        and their per-lag histograms, mean cos θ and frame-to-frame
+        displacement autocorrelation (angle_analysis/); step arrays are
+        shared with export_step_sizes when both run.
+        """
+        with self.timer.stage('turning_angles', points=len(self.raw_df)) as st:
+            self._compute_step_arrays()
+            with angle_store_writer(os.path.join(self.results_dir, ANGLE_STORE_NAME)) as store:
+                stats = self._append_angles(store)
+            self._write_angle_stats(stats)
+            st['angles'] = store.rows
 
-    def make_plot(self):
-        fig, ax = plt.subplots(figsize=(8,5))
 
-        # pick log-spaced bin edges between your min and max D
-        d = self.results_df['D_fit']
-        lo, hi = d[d>0].min(), d.max()
-        bins = np.logspace(np.log10(lo), np.log10(hi), 30)
+    def _append_local(self, store, df):
+        """Append df's sliding-window fits to store; returns (windows, per-point D)."""
+        windows, point_D = local_windows(df, self.micron_per_px, self.time_step,
+                                         self.local_window, self.local_max_lag)
+        store.append(self.condition, self.replicate, **windows)
+        return windows, point_D
 
-        ax.hist(d, bins=bins, edgecolor='black')
-        ax.set_xscale('log')
-        ax.set_xlabel('D_fit (μm²/s), log scale')
-        ax.set_title(f"D_fit Distribution ({self.condition})")
-        fig.tight_layout()
-        fig.savefig(os.path.join(self.results_dir, 'D_fit_distribution.png'))
-        plt.close(fig)
+
+    def local_point_D(self):
+        """
+        Per-point D_local (raw_df index) of the sliding-window fits, kept in
+        memory; computed once and shared by the rainbow overlay and
+        local_diffusivity(), which is what writes them out.
+        """
+        if self._local is None:
+            with self.timer.stage('local_diffusivity', points=len(self.raw_df),
+                                  window=self.local_window) as st:
+                self._local = local_windows(self.raw_df, self.micron_per_px, self.time_step,
+                                            self.local_window, self.local_max_lag)
+                st['windows'] = len(self._local[0]['D_local'])
+        return self._local[1]
+
+
+    def local_diffusivity(self):
+        """
+        Sliding-window D/alpha (local_window points, lags 1..local_max_lag)
+        along every track: per-window table in local_D.store, per-track
+        D_local variability in local_D_summary.csv. Returns the per-point
+        D_local (see local_point_D).
+        """
+        point_D = self.local_point_D()
+        windows = self._local[0]
+        with local_store_writer(os.path.join(self.results_dir, LOCAL_STORE_NAME)) as store:
+            store.append(self.condition, self.replicate, **windows)
+        track_summary(windows).to_csv(
+            os.path.join(self.results_dir, LOCAL_SUMMARY_NAME), index=False)
+        return point_D
+
+
+    def make_plot(self):
+        plot_D_distribution(self.results_df,
+                            os.path.join(self.results_dir, 'D_fit_distribution.png'),
+                            self.condition)
 
 
     def make_scatter(self):
-        fig, ax = plt.subplots(figsize=(8,5))
-        ax.scatter(np.log10(self.results_df['D_fit']), self.results_df['alpha_fit'], alpha=0.6)
-        ax.set_xlabel('log10(D_fit)')
-        ax.set_ylabel('alpha_fit')
-        ax.set_title(f"alpha vs log D ({self.condition})")
-        fig.tight_layout()
-        fig.savefig(os.path.join(self.results_dir, 'alpha_vs_logD.png'))
-        plt.close(fig)
+        plot_alpha_vs_logD(self.results_df,
+                           os.path.join(self.results_dir, 'alpha_vs_logD.png'),
+                           self.condition)
+
+
+    def write_timings(self, **meta):
+        """Write this replicate's per-stage timings to timings.json and return them."""
+        meta = {'data_file': os.path.basename(self.data_file),
+                'condition': self.condition, **meta}
+        self.timer.write_json(os.path.join(self.results_dir, 'timings.json'), **meta)
+        for rec in self.timer.records:
+            self.log.write(f"timing {rec['stage']}: {rec['wall_s']:.3f}s wall, "
+                           f"{rec['cpu_s']:.3f}s cpu\n")
+        self.log.flush()
+        return self.timer.to_dict(**meta)
 
 
     def write_params_to_log_file(self):
-        params = {
-            'condition':             self.condition,
-            'time_step':             self.time_step,
-            'micron_per_px':         self.micron_per_px,
-            'min_track_len_linfit':  self.min_track_len_linfit,
-            'tlag_cutoff_linfit':    self.tlag_cutoff_linfit
-        }
+        params = analysis_params(
+            self.condition, self.time_step, self.micron_per_px,
+            self.min_track_len_linfit, self.tlag_cutoff_linfit,
+            self.fit_mode, self.max_msd_lag
+        )
         pd.Series(params).to_csv(
             os.path.join(self.results_dir,'params_log.csv'), header=False
         )
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+trajectory_io.py
+
+Fast trajectory CSV ingestion: sniff the delimiter from the header line,
+resolve column aliases before parsing, and read only track_id/frame/x/y
+with explicit dtypes on pandas' C engine. The python-engine sniffing
+parser is kept as a fallback for files the fast path cannot handle.
+
+Parsed tables can be cached as raw .npy columns next to the results and
+memory-mapped on later runs; the cache is keyed by the source file's size,
+mtime and content hash.
+"""
+import os
+import csv
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+REQUIRED_COLUMNS = ('track_id', 'frame', 'x', 'y')
+
+# canonical name -> accepted header names (lower-cased), in priority order
+COLUMN_ALIASES = {
+    'track_id': ('track_id', 'trajectory', 'track'),
+    'frame':    ('frame', 'spot_frame'),
+    'x':        ('x', 'position_x'),
+    'y':        ('y', 'position_y'),
+}
+
+COLUMN_DTYPES = {'frame': np.int32, 'x': np.float64, 'y': np.float64}
+
+_DELIMITERS = ('\t', ',', ';')
+# TrackMate exports add up to three rows (description, short name, units)
+# between the header and the data
+_MAX_EXTRA_HEADER_ROWS = 3
+
+
+def _normalize(name):
+    return name.strip().strip('"').strip().lower()
+
+
+def sniff_delimiter(header_line):
+    """Pick the candidate delimiter that occurs most often in the header line."""
+    counts = {d: header_line.count(d) for d in _DELIMITERS}
+    sep = max(counts, key=counts.get)
+    return sep if counts[sep] > 0 else None
+
+
+def resolve_columns(names):
+    """
+    Map canonical column names to positions in the raw header.
+    Raises KeyError listing the header if a required column is missing.
+    """
+    norm = [_normalize(n) for n in names]
+    positions = {}
+    for canon, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in norm:
+                positions[canon] = norm.index(alias)
+                break
+        else:
+            raise KeyError(
+                f"Input CSV missing required column '{canon}'. "
+                f"Found columns: {norm}"
+            )
+    return positions
+
+
+def _is_number(token):
+    try:
+        float(token.strip().strip('"'))
+        return True
+    except ValueError:
+        return False
+
+
+def _count_extra_header_rows(lines, sep, frame_pos):
+    """Non-numeric frame cells directly under the header are unit/description rows."""
+    n = 0
+    for line in lines[:_MAX_EXTRA_HEADER_ROWS]:
+        cells = next(csv.reader([line], delimiter=sep))
+        if frame_pos < len(cells) and not _is_number(cells[frame_pos]):
+            n += 1
+        else:
+            break
+    return n
+
+
+def _finalize(df):
+    """Drop unassigned spots and store integral track ids compactly."""
+    df = df.dropna(subset=list(REQUIRED_COLUMNS))
+    tid = df['track_id']
+    if tid.dtype.kind == 'f' and np.all(np.mod(tid.to_numpy(), 1) == 0):
+        df = df.assign(track_id=tid.astype(np.int64))
+    if df['frame'].dtype.kind == 'f':
+        df = df.assign(frame=df['frame'].astype(np.int32))
+    return df.reset_index(drop=True)
+
+
+def _c_engine_options(path):
+    """Delimiter, projected columns, dtypes and header rows to skip for the C engine."""
+    with open(path, 'r', newline='') as fh:
+        header = fh.readline()
+        following = [fh.readline() for _ in range(_MAX_EXTRA_HEADER_ROWS)]
+    sep = sniff_delimiter(header)
+    if sep is None:
+        raise ValueError("could not sniff delimiter from header")
+    names = next(csv.reader([header.rstrip('\r\n')], delimiter=sep))
+    positions = resolve_columns(names)
+    skip = _count_extra_header_rows(following, sep, positions['frame'])
+    rename = {names[pos]: canon for canon, pos in positions.items()}
+    options = dict(
+        sep=sep, engine='c',
+        usecols=sorted(positions.values()),
+        dtype={names[positions[c]]: t for c, t in COLUMN_DTYPES.items()},
+        skiprows=range(1, skip + 1),
+    )
+    return options, rename
+
+
+def _read_c_engine(path):
+    options, rename = _c_engine_options(path)
+    df = pd.read_csv(path, **options)
+    return df.rename(columns=rename)[list(REQUIRED_COLUMNS)]
+
+
+def _normalize_python_frame(df):
+    positions = resolve_columns(list(df.columns))
+    df = df.iloc[:, [positions[c] for c in REQUIRED_COLUMNS]].copy()
+    df.columns = list(REQUIRED_COLUMNS)
+    for col in ('frame', 'x', 'y'):
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    # unit/description rows leave text in track_id until they are dropped
+    df = df.dropna(subset=['frame'])
+    try:
+        df['track_id'] = pd.to_numeric(df['track_id'])
+    except (ValueError, TypeError):
+        pass
+    return df
+
+
+def _read_python_engine(path):
+    return _normalize_python_frame(pd.read_csv(path, sep=None, engine='python'))
+
+
+def load_trajectory_csv(path):
+    """
+    Load a trajectory table as a DataFrame with columns track_id, frame, x, y.
+
+    Returns (df, info) where info holds 'engine', 'rows' and 'seconds'.
+    Missing required columns raise KeyError from either engine.
+    """
+    t0 = time.perf_counter()
+    try:
+        df = _read_c_engine(path)
+        engine = 'c'
+    except KeyError:
+        raise
+    except (ValueError, TypeError, pd.errors.ParserError, csv.Error):
+        df = _read_python_engine(path)
+        engine = 'python'
+    df = _finalize(df)
+    info = {'engine': engine, 'rows': len(df), 'seconds': time.perf_counter() - t0}
+    return df, info
+
+
+# ---- binary trajectory cache ----
+
+CACHE_DIR_NAME = '.trajectory_cache'
+CACHE_VERSION = 1
+_CACHE_META = 'meta.json'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """blake2b hex digest of a file's contents."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_cache_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, _CACHE_META)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache_meta(cache_dir, meta):
+    tmp = os.path.join(cache_dir, _CACHE_META + '.tmp')
+    with open(tmp, 'w') as fh:
+        json.dump(meta, fh, indent=1)
+    os.replace(tmp, os.path.join(cache_dir, _CACHE_META))
+
+
+def cache_is_valid(path, cache_dir):
+    """
+    True if cache_dir holds a cache of path's current contents. A size/mtime
+    match is trusted; otherwise the content hash decides (a touched but
+    unchanged file keeps its cache).
+    """
+    meta = _read_cache_meta(cache_dir)
+    if not meta or meta.get('version') != CACHE_VERSION:
+        return False
+    if meta.get('source') != os.path.basename(path):
+        return False
+    st = os.stat(path)
+    if meta.get('size') != st.st_size:
+        return False
+    if meta.get('mtime_ns') == st.st_mtime_ns:
+        return True
+    if meta.get('digest') == file_digest(path):
+        meta['mtime_ns'] = st.st_mtime_ns
+        _write_cache_meta(cache_dir, meta)
+        return True
+    return False
+
+
+def write_trajectory_cache(path, df, cache_dir, digest=None):
+    """Store df's track_id/frame/x/y as .npy columns keyed by path's size, mtime and hash."""
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, _CACHE_META)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for col in REQUIRED_COLUMNS:
+        arr = df[col].to_numpy()
+        if arr.dtype == object:
+            arr = arr.astype(str)
+        np.save(os.path.join(cache_dir, f'{col}.npy'), arr)
+    st = os.stat(path)
+    _write_cache_meta(cache_dir, {
+        'version':  CACHE_VERSION,
+        'source':   os.path.basename(path),
+        'size':     st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'digest':   digest or file_digest(path),
+        'rows':     len(df),
+    })
+
+
+def read_trajectory_cache(cache_dir):
+    """Memory-map the cached columns into a DataFrame (track_id, frame, x, y)."""
+    cols = {
+        col: np.load(os.path.join(cache_dir, f'{col}.npy'), mmap_mode='r')
+        for col in REQUIRED_COLUMNS
+    }
+    return pd.DataFrame(cols, copy=False)
+
+
+def clear_trajectory_cache(cache_dir):
+    """Remove a trajectory cache directory if present."""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def load_trajectories(path, cache_dir=None):
+    """
+    load_trajectory_csv with a binary cache in front of it. With cache_dir
+    None the CSV is always parsed. info['engine'] is 'cache' on a hit.
+    """
+    if cache_dir is None:
+        return load_trajectory_csv(path)
+    t0 = time.perf_counter()
+    if cache_is_valid(path, cache_dir):
+        df = read_trajectory_cache(cache_dir)
+        return df, {'engine': 'cache', 'rows': len(df),
+                    'seconds': time.perf_counter() - t0}
+    df, info = load_trajectory_csv(path)
+    write_trajectory_cache(path, df, cache_dir)
+    return df, info
+
+
+# ---- streaming, bounded-memory reading ----
+
+class UnsortedTracksError(ValueError):
+    """Streamed rows are not grouped by non-decreasing track_id."""
+
+
+# rough resident bytes per row while a batch is parsed, sorted and analysed
+STREAM_BYTES_PER_ROW = 256
+_MAX_SPILL_PARTS = 512
+
+
+def rows_for_budget(budget_bytes):
+    """Chunk size (rows) that keeps one batch within budget_bytes."""
+    return max(1000, int(budget_bytes // STREAM_BYTES_PER_ROW))
+
+
+def iter_trajectory_chunks(path, chunk_rows):
+    """
+    Yield normalized (track_id, frame, x, y) DataFrames of at most chunk_rows
+    rows. If the C engine fails, while sniffing or part-way through the
+    file, the python engine parses the rows not yet yielded.
+    """
+    skip = consumed = 0
+    try:
+        options, rename = _c_engine_options(path)
+        skip = len(options['skiprows'])
+        with pd.read_csv(path, chunksize=chunk_rows, **options) as reader:
+            for chunk in reader:
+                out = _finalize(chunk.rename(columns=rename)[list(REQUIRED_COLUMNS)])
+                consumed += len(chunk)
+                yield out
+        return
+    except (ValueError, TypeError, csv.Error):
+        pass
+    # header, then everything after the extra header rows and yielded rows
+    with pd.read_csv(path, sep=None, engine='python', chunksize=chunk_rows,
+                     skiprows=range(1, skip + consumed + 1)) as reader:
+        for chunk in reader:
+            yield _finalize(_normalize_python_frame(chunk))
+
+
+def iter_complete_tracks(chunks):
+    """
+    Regroup a chunk stream into batches holding only complete tracks. The
+    trailing (possibly unfinished) track of each chunk is carried into the
+    next one. Raises UnsortedTracksError unless track_id is non-decreasing.
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None and len(carry):
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.empty:
+            continue
+        ids = chunk['track_id'].to_numpy()
+        if np.any(ids[1:] < ids[:-1]):
+            raise UnsortedTracksError(
+                "track_id is not non-decreasing; rows are not grouped by track"
+            )
+        cut = int(np.searchsorted(ids, ids[-1], side='left'))
+        if cut:
+            yield chunk.iloc[:cut]
+        carry = chunk.iloc[cut:]
+    if carry is not None and len(carry):
+        yield carry
+
+
+def _estimate_rows(path, sample_bytes=1 << 20):
+    with open(path, 'rb') as fh:
+        sample = fh.read(sample_bytes)
+    lines = max(1, sample.count(b'\n'))
+    return int(os.path.getsize(path) / (len(sample) / lines)) if sample else 0
+
+
+def iter_spilled_tracks(path, chunk_rows, budget_bytes, spill_dir):
+    """
+    Out-of-core grouping for unsorted input: hash-partition rows by track_id
+    into spill files sized to the memory budget, then yield one partition
+    (every row of every track it holds) at a time. Spill files are removed
+    as they are consumed.
+    """
+    n_parts = int(np.ceil(_estimate_rows(path) * STREAM_BYTES_PER_ROW / budget_bytes))
+    n_parts = min(max(1, n_parts), _MAX_SPILL_PARTS)
+    paths = [os.path.join(spill_dir, f'part_{i:04d}.npy') for i in range(n_parts)]
+    handles = [open(p, 'wb') for p in paths]
+    try:
+        for chunk in iter_trajectory_chunks(path, chunk_rows):
+            part = pd.util.hash_array(chunk['track_id'].to_numpy()) % n_parts
+            for i in np.unique(part):
+                sub = chunk[part == i]
+                for col in REQUIRED_COLUMNS:
+                    arr = sub[col].to_numpy()
+                    np.save(handles[i], arr.astype(str) if arr.dtype == object else arr)
+    finally:
+        for fh in handles:
+            fh.close()
+
+    for p in paths:
+        pieces = {col: [] for col in REQUIRED_COLUMNS}
+        size = os.path.getsize(p)
+        with open(p, 'rb') as fh:
+            while fh.tell() < size:
+                for col in REQUIRED_COLUMNS:
+                    pieces[col].append(np.load(fh))
+        os.remove(p)
+        if pieces['track_id']:
+            yield pd.DataFrame({col: np.concatenate(v) for col, v in pieces.items()})
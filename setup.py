@@ -27,6 +27,11 @@ setup(
         'joblib>=1.2.0,<2.0.0',
         'numba>=0.55.0,<0.60.0'
     ],
+    extras_require={
+        # rainbow movies: GIF through Pillow, MP4 through imageio-ffmpeg
+        'movie': ['Pillow>=9.1'],
+        'mp4':   ['imageio-ffmpeg>=0.4.0'],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: MIT License',
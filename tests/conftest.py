@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def boundschecked(tmp_path):
+    """Run a code string in a subprocess with Numba bounds checks enabled."""
+    def run(code):
+        # a fresh cache dir so every kernel is compiled with bounds checks
+        env = dict(os.environ, NUMBA_BOUNDSCHECK='1',
+                   NUMBA_CACHE_DIR=str(tmp_path / 'numba_cache'))
+        return subprocess.run([sys.executable, '-c', code], cwd=REPO, env=env,
+                              capture_output=True, text=True)
+    return run
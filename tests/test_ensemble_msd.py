@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gemspa.ensemble_analysis import run_ensemble
+from gemspa.ensemble_msd import (
+    empty_msd_stats, add_rows, merge_msd_stats, truncate_msd_stats, load_msd_stats,
+    msd_accumulator, ENSEMBLE_MSD_DIR
+)
+
+
+def _rows(rng, n, n_lags):
+    rows = rng.random((n, n_lags))
+    rows[rng.random((n, n_lags)) < 0.2] = np.nan
+    return rows
+
+
+def _stats(tamsd, eamsd, time_step=0.01):
+    return add_rows(empty_msd_stats(tamsd.shape[1], time_step, 10), tamsd, eamsd)
+
+
+def test_merge_equals_pooled_rows():
+    rng = np.random.default_rng(1)
+    a = [_rows(rng, 30, 12) for _ in range(2)]
+    b = [_rows(rng, 20, 12) for _ in range(2)]
+    merged = merge_msd_stats(merge_msd_stats(None, _stats(*a)), _stats(*b))
+    pooled = _stats(np.vstack([a[0], b[0]]), np.vstack([a[1], b[1]]))
+    assert merged['n_tracks'] == 50
+    for key, val in pooled.items():
+        np.testing.assert_allclose(merged[key], val)
+
+
+def test_merge_rejects_different_lag_axes():
+    rng = np.random.default_rng(2)
+    base = _stats(_rows(rng, 5, 12), _rows(rng, 5, 12))
+    with pytest.raises(ValueError, match='lags'):
+        merge_msd_stats(base, _stats(_rows(rng, 5, 8), _rows(rng, 5, 8)))
+    with pytest.raises(ValueError, match='time steps'):
+        merge_msd_stats(base, _stats(_rows(rng, 5, 12), _rows(rng, 5, 12), time_step=0.02))
+
+
+def _replicate(root, name, rng, n_lags, time_step=0.01, n=20):
+    rep = os.path.join(root, name)
+    tamsd, eamsd = _rows(rng, n, n_lags), _rows(rng, n, n_lags)
+    D, alpha = rng.random(n), rng.random(n) + 0.5
+    with msd_accumulator(os.path.join(rep, ENSEMBLE_MSD_DIR), n_lags, time_step, 10) as acc:
+        acc.add(tamsd, eamsd, D, alpha)
+    pd.DataFrame({'track_id': np.arange(n), 'D_fit': D, 'alpha_fit': alpha,
+                  'r2_fit': np.ones(n)}).to_csv(os.path.join(rep, 'msd_results.csv'), index=False)
+    return _stats(tamsd, eamsd, time_step)
+
+
+def test_run_ensemble_pools_replicates_with_different_lag_counts(tmp_path, capsys):
+    rng = np.random.default_rng(3)
+    root = str(tmp_path)
+    a = [_replicate(root, 'a_1', rng, 12), _replicate(root, 'a_2', rng, 8)]
+    _replicate(root, 'b_1', rng, 8)
+    _replicate(root, 'b_2', rng, 8, time_step=0.02)
+    run_ensemble(root, n_jobs=1, plot_mode='deferred')
+
+    pooled = load_msd_stats(os.path.join(root, 'a', 'grouped_raw', 'ensemble_msd_stats.npz'))
+    expected = merge_msd_stats(truncate_msd_stats(a[0], 8), a[1])
+    for key in ('n_tracks', 'tamsd_sum', 'eamsd_count'):
+        np.testing.assert_allclose(pooled[key], expected[key])
+    # the time-step mismatch only costs condition b its pooled curves
+    assert not os.path.exists(os.path.join(root, 'b', 'grouped_raw', 'ensemble_msd_stats.npz'))
+    assert os.path.isfile(os.path.join(root, 'b', 'grouped_raw', 'msd_results.csv'))
+    assert 'b: cannot merge' in capsys.readouterr().out
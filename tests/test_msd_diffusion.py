@@ -0,0 +1,127 @@
+import numpy as np
+
+from gemspa.msd_diffusion import (
+    msd_diffusion, track_offsets, step_sizes_angles_batch, local_diffusivity_batch
+)
+
+# ragged tracks (1..64 points) run through the parallel and serial variant
+# of each kernel in the bounds-checked subprocess tests
+_RAGGED = '\n'.join([
+    'import numpy as np',
+    'from gemspa import resources',
+    'from gemspa.msd_diffusion import (msd_diffusion, track_offsets,',
+    '    step_sizes_angles_batch, local_diffusivity_batch)',
+    'lengths = np.array([1, 2, 3, 5, 12, 40, 7, 64])',
+    'ids = np.repeat(np.arange(lengths.size), lengths)',
+    'rng = np.random.default_rng(1)',
+    'x, y = rng.random(ids.size) * 20, rng.random(ids.size) * 20',
+    'offsets = track_offsets(ids)',
+    'md = msd_diffusion()',
+    'for work in (0, 10**12):',
+    '    resources.PARALLEL_MIN_WORK = work',
+])
+
+
+def _ragged_tracks(lengths=(1, 2, 3, 5, 12, 40, 7, 64), seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = np.asarray(lengths)
+    ids = np.repeat(np.arange(lengths.size), lengths)
+    x = np.cumsum(rng.normal(size=ids.size))
+    y = np.cumsum(rng.normal(size=ids.size))
+    return x, y, track_offsets(ids)
+
+
+def _msd_reference(x, y, offsets, max_lag):
+    msd = np.full((offsets.size - 1, max_lag), np.nan)
+    for k in range(offsets.size - 1):
+        tx, ty = x[offsets[k]:offsets[k + 1]], y[offsets[k]:offsets[k + 1]]
+        for lag in range(1, min(max_lag, tx.size - 1) + 1):
+            msd[k, lag - 1] = np.mean((tx[lag:] - tx[:-lag])**2 + (ty[lag:] - ty[:-lag])**2)
+    return msd
+
+
+def test_msd_fft_matches_direct():
+    x, y, offsets = _ragged_tracks()
+    md = msd_diffusion()
+    for max_lag in (1, 4, 50):
+        direct = md.msd_batch(x, y, offsets, max_lag, method='direct')
+        fft = md.msd_batch(x, y, offsets, max_lag, method='fft')
+        ref = _msd_reference(x, y, offsets, max_lag)
+        np.testing.assert_array_equal(np.isnan(direct), np.isnan(ref))
+        np.testing.assert_allclose(direct, ref, rtol=1e-12, equal_nan=True)
+        np.testing.assert_allclose(fft, direct, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_warmup_kernels_in_bounds(boundschecked):
+    proc = boundschecked('from gemspa.msd_diffusion import warmup_kernels; warmup_kernels()')
+    assert proc.returncode == 0, proc.stderr
+
+
+def test_msd_kernels_in_bounds(boundschecked):
+    proc = boundschecked(_RAGGED + '\n' + '\n'.join([
+        '    for lag in (1, 3, 70):',
+        '        msd = md.msd_batch(x, y, offsets, lag, method="direct")',
+        '        md.fit_msd_batch(msd[lengths > lag], 0.01)',
+    ]))
+    assert proc.returncode == 0, proc.stderr
+
+
+def test_step_sizes_match_per_track_loop():
+    x, y, offsets = _ragged_tracks()
+    max_lag = 4
+    steps, dX, dY, angles = step_sizes_angles_batch(x, y, offsets, max_lag)
+    for lag in range(1, max_lag + 1):
+        ref_dx, ref_ang = [], []
+        for k in range(offsets.size - 1):
+            tx, ty = x[offsets[k]:offsets[k + 1]], y[offsets[k]:offsets[k + 1]]
+            if lag >= tx.size:
+                continue
+            ref_dx.append(tx[lag:] - tx[:-lag])
+            if lag <= (tx.size - 1) // 2:
+                vx, vy = np.diff(tx[::lag]), np.diff(ty[::lag])
+                cos = (vx[:-1]*vx[1:] + vy[:-1]*vy[1:]) / (np.hypot(vx[:-1], vy[:-1])
+                                                           * np.hypot(vx[1:], vy[1:]))
+                ref_ang.append(np.degrees(np.arccos(np.clip(cos, -1, 1))))
+        ref_dx = np.concatenate(ref_dx)
+        row = dX[lag - 1]
+        np.testing.assert_array_equal(row[:ref_dx.size], ref_dx)
+        assert np.isnan(row[ref_dx.size:]).all()
+        ref_dy = dY[lag - 1, :ref_dx.size]
+        np.testing.assert_array_equal(steps[lag - 1, :ref_dx.size],
+                                      np.sqrt(ref_dx*ref_dx + ref_dy*ref_dy))
+        ref_ang = np.concatenate(ref_ang) if ref_ang else np.empty(0)
+        np.testing.assert_allclose(angles[lag - 1, :ref_ang.size], ref_ang, atol=1e-9)
+        assert np.isnan(angles[lag - 1, ref_ang.size:]).all()
+
+
+def test_step_kernels_in_bounds(boundschecked):
+    proc = boundschecked(_RAGGED + '\n' + '\n'.join([
+        '    for lag in (1, 3, 70):',
+        '        step_sizes_angles_batch(x, y, offsets, lag)',
+    ]))
+    assert proc.returncode == 0, proc.stderr
+
+
+def test_local_diffusivity_matches_window_fits():
+    x, y, offsets = _ragged_tracks()
+    window, max_lag, dt = 6, 3, 0.01
+    win_offsets, D, alpha = local_diffusivity_batch(x, y, offsets, window, max_lag, dt)
+    t = np.arange(1, max_lag + 1) * dt
+    for k in range(offsets.size - 1):
+        tx, ty = x[offsets[k]:offsets[k + 1]], y[offsets[k]:offsets[k + 1]]
+        n_win = max(tx.size - window + 1, 0)
+        assert win_offsets[k + 1] - win_offsets[k] == n_win
+        for w in range(n_win):
+            msd = _msd_reference(tx[w:w + window], ty[w:w + window],
+                                 np.array([0, window]), max_lag)[0]
+            a, b = np.polyfit(np.log(t), np.log(msd), 1)
+            np.testing.assert_allclose(alpha[win_offsets[k] + w], a, rtol=1e-8)
+            np.testing.assert_allclose(D[win_offsets[k] + w], np.exp(b) / 4, rtol=1e-8)
+
+
+def test_local_kernel_in_bounds(boundschecked):
+    proc = boundschecked(_RAGGED + '\n' + '\n'.join([
+        '    local_diffusivity_batch(x, y, offsets, 10, 3, 0.01)',
+        '    local_diffusivity_batch(x, y, offsets, 64, 63, 0.01)',
+    ]))
+    assert proc.returncode == 0, proc.stderr
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+import types
+
+import gemspa
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_submodules_stay_modules():
+    import gemspa.msd_diffusion as md
+    import gemspa.trajectory_analysis as ta
+    assert isinstance(md, types.ModuleType) and isinstance(ta, types.ModuleType)
+    assert callable(md.warmup_kernels) and md.FFT_LAG_THRESHOLD > 0
+    assert gemspa.msd_diffusion is md
+
+
+def test_lazy_class_export():
+    from gemspa.step_size_analysis import run_step_size_analysis_if_requested
+    assert gemspa.run_step_size_analysis_if_requested is run_step_size_analysis_if_requested
+
+
+def test_import_defers_scipy_and_kernels():
+    code = ('import sys, gemspa.trajectory_analysis; '
+            'print(sorted(m for m in ("scipy.linalg", "scipy.optimize", "scipy.stats") '
+            'if m in sys.modules))')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                         cwd=REPO, check=True).stdout
+    assert out.strip() == '[]'
@@ -0,0 +1,36 @@
+import numpy as np
+
+from gemspa.results_store import results_writer, read_results
+from gemspa.step_store import read_step_store
+
+
+def _write(root, rep, track_id):
+    n = len(track_id)
+    with results_writer(str(root), 'ctrl', rep) as w:
+        w.append(track_id, np.full(n, 10), np.linspace(0.1, 1.0, n),
+                 np.ones(n), np.ones(n))
+
+
+def test_numeric_track_ids_keep_their_type(tmp_path):
+    _write(tmp_path, 'ctrl_001', np.arange(3))
+    _write(tmp_path, 'ctrl_002', np.array([1.5, 2.5]))
+    assert read_step_store(str(tmp_path / 'ctrl_001'))['track_id'].dtype == np.int64
+    assert read_step_store(str(tmp_path / 'ctrl_002'))['track_id'].dtype == np.float64
+
+
+def test_string_track_ids_round_trip(tmp_path):
+    ids = np.array(['b', 'a', 'track 7', 'a'], dtype=object)
+    _write(tmp_path, 'ctrl_001', ids[:2])
+    with results_writer(str(tmp_path), 'ctrl', 'ctrl_002') as w:
+        for part in (ids[:2], ids[2:]):
+            w.append(part, np.full(2, 10), np.full(2, 0.5), np.ones(2), np.ones(2))
+    df = read_results(str(tmp_path), replicates=['ctrl_002'])
+    assert df['track_id'].tolist() == ids.tolist()
+    df = read_results(str(tmp_path), bounds={'D_fit': (0.0, 0.2)})
+    assert df['track_id'].tolist() == ['b']
+
+
+def test_empty_partition(tmp_path):
+    with results_writer(str(tmp_path), 'ctrl', 'ctrl_001'):
+        pass
+    assert read_results(str(tmp_path)).empty
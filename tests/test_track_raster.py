@@ -0,0 +1,46 @@
+import numpy as np
+from skimage.draw import line
+
+from gemspa.track_raster import label_segments, rasterize_segments
+
+
+def test_labels_match_skimage_line():
+    rng = np.random.default_rng(0)
+    # endpoints up to 4 px off a 32 x 24 image, as tracks near the border are
+    x0, x1 = rng.uniform(-4, 36, (2, 200))
+    y0, y1 = rng.uniform(-4, 28, (2, 200))
+    label = label_segments((24, 32), x0, y0, x1, y1)
+
+    ref = np.full((24, 32), -1, dtype=np.int32)
+    for k in range(x0.size):
+        rr, cc = line(int(y0[k]), int(x0[k]), int(y1[k]), int(x1[k]))
+        keep = (rr >= -24) & (rr < 24) & (cc >= -32) & (cc < 32)
+        ref[rr[keep], cc[keep]] = k
+    np.testing.assert_array_equal(label, ref)
+
+
+def test_rasterize_colours_last_segment():
+    canvas = np.zeros((8, 8, 4), dtype=np.uint8)
+    colors = np.array([[255, 0, 0], [0, 255, 0]], dtype=np.uint8)
+    rasterize_segments(canvas, np.array([0., 0.]), np.array([2., 0.]),
+                       np.array([7., 7.]), np.array([2., 7.]), colors)
+    np.testing.assert_array_equal(canvas[2, 1, :3], colors[0])
+    np.testing.assert_array_equal(canvas[3, 3, :3], colors[1])
+    np.testing.assert_array_equal(canvas[2, 2, :3], colors[1])
+    assert not canvas[..., 3].any() and not canvas[0, 7].any()
+
+
+def test_raster_kernels_in_bounds(boundschecked):
+    # segments leaving a 16 x 16 canvas on every side, square and anti-aliased pens
+    proc = boundschecked('\n'.join([
+        'import numpy as np',
+        'from gemspa.track_raster import label_segments, rasterize_segments',
+        'rng = np.random.default_rng(1)',
+        'x0, y0, x1, y1 = rng.uniform(-20, 36, (4, 200))',
+        'canvas = np.zeros((16, 16, 3), dtype=np.uint8)',
+        'colors = np.full((200, 3), 255, dtype=np.uint8)',
+        'rasterize_segments(canvas, x0, y0, x1, y1, colors, line_px=3)',
+        'rasterize_segments(canvas, x0, y0, x1, y1, colors, 3, antialias=True)',
+        'label_segments((16, 16), x0, y0, x1, y1)',
+    ]))
+    assert proc.returncode == 0, proc.stderr
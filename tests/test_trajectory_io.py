@@ -0,0 +1,77 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from gemspa.trajectory_io import (
+    iter_trajectory_chunks, load_trajectory_csv, load_trajectories, cache_is_valid
+)
+
+
+def _write_tracks(path, n_tracks=50, n_points=20, sep=','):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'track_id': np.repeat(np.arange(n_tracks), n_points),
+        'frame':    np.tile(np.arange(n_points), n_tracks),
+        'x':        rng.random(n_tracks * n_points) * 100,
+        'y':        rng.random(n_tracks * n_points) * 100,
+    })
+    df.to_csv(path, sep=sep, index=False)
+    return df
+
+
+def test_chunks_match_full_load(tmp_path):
+    path = str(tmp_path / 'Traj_a_001.csv')
+    _write_tracks(path)
+    full, info = load_trajectory_csv(path)
+    assert info['engine'] == 'c'
+    streamed = pd.concat(iter_trajectory_chunks(path, 128), ignore_index=True)
+    pd.testing.assert_frame_equal(streamed, full)
+
+
+def test_chunks_fall_back_after_mid_file_parse_error(tmp_path):
+    path = str(tmp_path / 'Traj_a_001.csv')
+    df = _write_tracks(path)
+    # a bad x value far past the first chunk fails the C engine mid-stream
+    lines = open(path).read().splitlines()
+    cells = lines[700].split(',')
+    cells[2] = 'bad'
+    lines[700] = ','.join(cells)
+    with open(path, 'w') as fh:
+        fh.write('\n'.join(lines) + '\n')
+    streamed = pd.concat(iter_trajectory_chunks(path, 128), ignore_index=True)
+    expected = df.drop(index=699).reset_index(drop=True)
+    assert len(streamed) == len(expected)
+    np.testing.assert_array_equal(streamed['track_id'], expected['track_id'])
+    np.testing.assert_allclose(streamed['x'], expected['x'])
+
+
+
+
+def test_cache_invalidated_on_size_and_mtime(tmp_path):
+    path = str(tmp_path / 'Traj_a_001.csv')
+    cache = str(tmp_path / 'cache')
+    _write_tracks(path)
+    df, info = load_trajectories(path, cache)
+    assert info['engine'] == 'c' and cache_is_valid(path, cache)
+    assert load_trajectories(path, cache)[1]['engine'] == 'cache'
+
+    # touched but unchanged: the content hash keeps the cache
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache_is_valid(path, cache)
+
+    # same size, new contents and mtime
+    time.sleep(0.01)
+    _write_tracks(path)
+    text = open(path).read().replace('\n1,', '\n7,', 1)
+    with open(path, 'w') as fh:
+        fh.write(text)
+    assert not cache_is_valid(path, cache)
+
+    # different size
+    _write_tracks(path, n_tracks=10)
+    assert not cache_is_valid(path, cache)
+    df, info = load_trajectories(path, cache)
+    assert info['engine'] == 'c' and len(df) == 200